@@ -0,0 +1,225 @@
+# File: GangaSkrt/Lib/ArchiveMerger/ArchiveMerger.py
+"""
+Provide for packing many small output files into an indexed archive.
+
+Jobs split at image level may produce very many small output files,
+such as images and logs, exhausting inode quotas and making listing
+and copying slow.  The files matching given patterns, in the output
+directories of subjobs, are instead streamed into a single uncompressed
+tar archive, in one pass and without temporary copies.  An index, mapping
+member names and source files to the byte offsets of member data, is
+written alongside the archive, so that individual members can be read
+without scanning the archive, using:
+
+    from GangaSkrt.Lib.MergeIndex.MergeIndex import ArchiveReader
+    with ArchiveReader("images.tar") as reader:
+        data = reader.read_member("12/image.png")
+
+The archive is a standard tar file, so can also be read with any tar tool.
+"""
+
+import glob
+import os
+import tarfile
+import time
+
+from GangaCore.GPIDev.Adapters.IMerger import IMerger
+from GangaCore.GPIDev.Base.Proxy import stripProxy
+from GangaCore.GPIDev.Schema import SimpleItem
+from GangaCore.Utility.logging import getLogger
+
+from GangaSkrt.Lib.MergeIndex.MergeIndex import write_index
+
+logger = getLogger()
+
+
+def pack_files(members=None, out_path=""):
+    """
+    Write files to uncompressed tar archive, and index of members.
+
+    Each file is streamed into the archive once, and the byte offset
+    of its data is obtained from the archive position after writing.
+    The archive is written to a temporary file, which is then renamed,
+    so that the archive exists only if complete.  Only regular files
+    (including targets of symbolic links) are packed.
+
+    Returns number of members packed.
+
+    Parameters
+    ----------
+    members : iterable, default=None
+        Iterable over tuples of path to input file, and member name.
+
+    out_path : str, default=""
+        Path where archive is to be created.
+    """
+    records = []
+    sources = []
+    tmp_path = f"{out_path}.tmp"
+    try:
+        with tarfile.open(tmp_path, "w", format=tarfile.PAX_FORMAT) as archive:
+            for in_path, name in members or []:
+                stat = os.stat(in_path)
+                info = tarfile.TarInfo(name)
+                info.size = stat.st_size
+                info.mtime = stat.st_mtime
+                info.mode = stat.st_mode & 0o7777
+                with open(in_path, "rb") as in_file:
+                    archive.addfile(info, in_file)
+
+                # Data are padded to a multiple of the block size.
+                padded = -(-info.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+                records.append((archive.offset - padded, info.size, [name]))
+                sources.append(in_path)
+        os.replace(tmp_path, out_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    write_index(out_path, records, ["name"], sources, "tar")
+    return len(records)
+
+
+def find_files(directory="", patterns=None):
+    """
+    Return sorted list of paths to regular files matching patterns,
+    relative to a directory.
+
+    Parameters
+    ----------
+    directory : str, default=""
+        Directory relative to which patterns are matched.
+
+    patterns : list, default=None
+        List of glob patterns, where "**" matches any number of
+        subdirectories.
+    """
+    paths = set()
+    for pattern in patterns or []:
+        pattern = os.path.join(directory, pattern)
+        for path in glob.glob(pattern, recursive=True):
+            if os.path.isfile(path):
+                paths.add(path)
+    return sorted(paths)
+
+
+class ArchiveMerger(IMerger):
+    """Merger packing subjob output files into an indexed tar archive."""
+
+    _category = "postprocessor"
+    _name = "ArchiveMerger"
+    _schema = IMerger._schema.inherit_copy()
+    _schema.datadict["archive"] = SimpleItem(
+        defvalue="outputs.tar",
+        doc="Name of archive to be written to the output directory of "
+        "the master job.  Files matching the patterns of the files "
+        "attribute are packed as members named <subjob id>/<path>, "
+        "where <path> is relative to the subjob output directory.",
+    )
+    _schema.datadict["delete_inputs"] = SimpleItem(
+        defvalue=False,
+        doc="Specify whether files packed are to be deleted from subjob "
+        "output directories once the archive and its index have been "
+        "written, so that inodes are freed.",
+    )
+
+    def merge(self, jobs, outputdir=None, ignorefailed=None, overwrite=None):
+        """
+        Pack output files of jobs into archive.
+
+        The files attribute gives glob patterns, relative to the output
+        directory of each job, where "**" matches any number of
+        subdirectories.
+
+        Parameters
+        ----------
+        jobs : list
+            List of jobs (normally subjobs) whose outputs are to be packed.
+        outputdir : str, default=None
+            Directory where archive is to be written.
+        ignorefailed : bool, default=None
+            If True, outputs of failed jobs are packed; if None,
+            the merger's ignorefailed attribute is used.
+        overwrite : bool, default=None
+            If True, an existing archive is overwritten; if None,
+            the merger's overwrite attribute is used.
+        """
+        if ignorefailed is None:
+            ignorefailed = self.ignorefailed
+        if overwrite is None:
+            overwrite = getattr(self, "overwrite", False)
+        jobs = sorted(
+            (
+                stripProxy(job)
+                for job in jobs
+                if ignorefailed or "completed" == stripProxy(job).status
+            ),
+            key=lambda job: job.id,
+        )
+
+        out_path = os.path.join(outputdir or ".", self.archive)
+        if os.path.exists(out_path) and not overwrite:
+            logger.error(f"Archive {out_path} exists, and overwrite not set")
+            return False
+
+        members = [
+            (path, f"{job.id}/{os.path.relpath(path, job.outputdir)}")
+            for job in jobs
+            for path in find_files(job.outputdir, self.files)
+        ]
+        self.pack(members, out_path)
+        return True
+
+    def mergefiles(self, in_paths=None, out_path=""):
+        """
+        Pack files into archive.
+
+        Member names are paths relative to the deepest directory
+        containing all input files.
+
+        Parameters
+        ----------
+        in_paths : list, default=None
+            List of paths to input files.
+        out_path : str, default = ''
+            Path where archive is to be created.
+        """
+        in_paths = [os.path.abspath(path) for path in in_paths or []]
+        if out_path:
+            top = ""
+            if in_paths:
+                top = os.path.commonpath(
+                    [os.path.dirname(path) for path in in_paths]
+                )
+            self.pack(
+                [(path, os.path.relpath(path, top)) for path in in_paths],
+                out_path,
+            )
+        else:
+            logger.warning("Path to output file not defined")
+
+    def pack(self, members=None, out_path=""):
+        """
+        Pack files into archive, and delete inputs if requested.
+
+        Parameters
+        ----------
+        members : list, default=None
+            List of tuples of path to input file, and member name.
+        out_path : str, default = ''
+            Path where archive is to be created.
+        """
+        # Create output directory, for archives in subdirectories.
+        os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+
+        start = time.time()
+        n_member = pack_files(members, out_path)
+        logger.info(
+            f"Packed {n_member} file(s) to {out_path}: "
+            f"{time.time() - start:.2f} s, "
+            f"{os.path.getsize(out_path)} bytes"
+        )
+
+        if self.delete_inputs:
+            for in_path, _ in members or []:
+                os.remove(in_path)
@@ -0,0 +1,4 @@
+# File: GangaSkrt/Lib/ArchiveMerger/__init__.py
+"""Provide for packing output files into an indexed archive."""
+
+from GangaSkrt.Lib.ArchiveMerger import ArchiveMerger
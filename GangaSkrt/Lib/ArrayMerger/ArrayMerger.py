@@ -0,0 +1,623 @@
+# File: GangaSkrt/Lib/ArrayMerger/ArrayMerger.py
+"""
+Provide for merging files of NumPy arrays, in .npy or .npz format.
+
+Arrays are merged without being loaded in full.  Shapes and data types
+are read from the array headers, a memory-mapped output array of the
+merged shape is preallocated, and the data of each input are copied
+in blocks to their place in the output.  Arrays of archives in .npz
+format are written in blocks directly to the archive members.
+Memory use is then bounded
+by block size, rather than by data size.
+
+For each merged file, a provenance index records the rows of each
+merged array that originated from each input file (normally the output
+of a subjob).  The index is stored alongside the merged file, in JSON
+format, and can be used, for example from notebooks, with:
+
+    from GangaSkrt.Lib.ArrayMerger.ArrayMerger import get_source
+    source = get_source("dvh.npy", 42)
+"""
+
+import bisect
+import json
+import math
+import os
+import tempfile
+import time
+import zipfile
+from contextlib import ExitStack, contextmanager
+
+from GangaCore.GPIDev.Adapters.IMerger import IMerger
+from GangaCore.GPIDev.Schema import SimpleItem
+from GangaCore.Utility.logging import getLogger
+
+logger = getLogger()
+
+# Suffix for name of provenance index, relative to merged file.
+PROVENANCE_SUFFIX = ".provenance.json"
+
+
+def get_provenance_path(data_path=""):
+    """
+    Return path to provenance index for merged file.
+
+    Parameters
+    ----------
+    data_path : str, default=""
+        Path to merged file.
+    """
+    return f"{data_path}{PROVENANCE_SUFFIX}"
+
+
+def is_npz(path=""):
+    """
+    Return True if path is to a file in .npz format, and False otherwise.
+
+    Parameters
+    ----------
+    path : str, default=""
+        Path to file.
+    """
+    return ".npz" == os.path.splitext(path)[1].lower()
+
+
+@contextmanager
+def open_array(in_path="", name=""):
+    """
+    Context manager yielding file object positioned at start of array
+    data, and tuple of shape, Fortran-order flag, and data type.
+
+    Requires numpy, which is imported only when this function is called.
+
+    Parameters
+    ----------
+    in_path : str, default=""
+        Path to file in .npy or .npz format.
+
+    name : str, default=""
+        Name of array, for file in .npz format.
+    """
+    from numpy.lib import format as npy_format
+
+    with ExitStack() as stack:
+        if is_npz(in_path):
+            archive = stack.enter_context(zipfile.ZipFile(in_path))
+            in_file = stack.enter_context(archive.open(f"{name}.npy"))
+        else:
+            in_file = stack.enter_context(open(in_path, "rb"))
+
+        version = npy_format.read_magic(in_file)
+        assert version in [(1, 0), (2, 0)], (
+            f"Unsupported .npy format version {version}: {in_path}"
+        )
+        if (1, 0) == version:
+            header = npy_format.read_array_header_1_0(in_file)
+        else:
+            header = npy_format.read_array_header_2_0(in_file)
+        yield in_file, header
+
+
+def get_names(in_path=""):
+    """
+    Return names of arrays in file.
+
+    For a file in .npy format, this is a list with a single,
+    empty name.
+
+    Parameters
+    ----------
+    in_path : str, default=""
+        Path to file in .npy or .npz format.
+    """
+    if not is_npz(in_path):
+        return [""]
+    with zipfile.ZipFile(in_path) as archive:
+        return [
+            member[: -len(".npy")]
+            for member in archive.namelist()
+            if member.endswith(".npy")
+        ]
+
+
+def get_layout(headers=None, stack=False):
+    """
+    Return shape and data type of array merged from arrays
+    with given headers.
+
+    Arrays are concatenated along their first axis, with
+    zero-dimensional arrays treated as having a single row, or
+    are stacked along a new first axis.  Data types are promoted
+    as for numpy.result_type().
+
+    Parameters
+    ----------
+    headers : list, default=None
+        List of tuples of shape, Fortran-order flag, and data type.
+
+    stack : bool, default=False
+        Specify whether arrays are to be stacked, rather than
+        concatenated.
+    """
+    import numpy as np
+
+    shapes = [tuple(shape) for shape, _, _ in headers]
+    if stack:
+        assert all(shape == shapes[0] for shape in shapes), (
+            f"Arrays to be stacked have different shapes: {set(shapes)}"
+        )
+        shape = (len(shapes),) + shapes[0]
+    else:
+        shapes = [shape or (1,) for shape in shapes]
+        tails = set(shape[1:] for shape in shapes)
+        assert 1 == len(tails), (
+            f"Arrays to be concatenated have different row shapes: {tails}"
+        )
+        shape = (sum(shape[0] for shape in shapes),) + shapes[0][1:]
+
+    dtypes = [dtype for _, _, dtype in headers]
+    assert not any(dtype.hasobject for dtype in dtypes), (
+        "Arrays of Python objects not supported"
+    )
+    try:
+        dtype = np.result_type(*dtypes)
+    except TypeError as error:
+        raise AssertionError(
+            f"Arrays have incompatible data types: {set(dtypes)}"
+        ) from error
+    return shape, dtype
+
+
+def iter_blocks(in_path="", name="", block_size=None):
+    """
+    Yield data of input array, in C order, as one-dimensional arrays
+    of consecutive items, in blocks.
+
+    Data in C order are read in blocks of approximately block_size
+    bytes.  Data in Fortran order are memory-mapped, for a file in
+    .npy format, or are first copied, one block of the transposed
+    array at a time, to a memory-mapped temporary file in C order,
+    for an array in .npz format.  Blocks of C-ordered data are then
+    taken from the memory-mapped array, so that the input array
+    isn't loaded in full.
+
+    Requires numpy, which is imported only when this function is called.
+
+    Parameters
+    ----------
+    in_path : str, default=""
+        Path to file in .npy or .npz format.
+
+    name : str, default=""
+        Name of array, for file in .npz format.
+
+    block_size : int, default=None
+        Approximate size (bytes) of blocks yielded.  If None, the input
+        array is yielded in a single block.
+    """
+    import numpy as np
+    from numpy.lib import format as npy_format
+
+    with open_array(in_path, name) as (in_file, header):
+        shape, fortran_order, dtype = header
+        n_item = math.prod(shape)
+        block_items = max(1, n_item)
+        if block_size:
+            block_items = max(1, block_size // max(dtype.itemsize, 1))
+
+        def read(count):
+            data = in_file.read(count * dtype.itemsize)
+            assert len(data) == count * dtype.itemsize, (
+                "Unexpected end of array data"
+            )
+            return np.frombuffer(data, dtype=dtype)
+
+        if not fortran_order or len(shape) < 2:
+            for start in range(0, n_item, block_items):
+                yield read(min(block_items, n_item - start))
+            return
+
+        # Data in Fortran order are those of the transposed array
+        # in C order, so are copied as blocks of rows of this array.
+        tmp_path = ""
+        if is_npz(in_path):
+            fd, tmp_path = tempfile.mkstemp(
+                prefix=".array_stage_",
+                suffix=".npy",
+                dir=os.path.dirname(in_path) or ".",
+            )
+            os.close(fd)
+        try:
+            if tmp_path:
+                array = npy_format.open_memmap(
+                    tmp_path, mode="w+", dtype=dtype, shape=shape
+                )
+                rows = array.T
+                row_items = n_item // max(shape[-1], 1)
+                block_rows = max(1, block_items // max(row_items, 1))
+                for start in range(0, shape[-1], block_rows):
+                    stop = min(start + block_rows, shape[-1])
+                    block = read((stop - start) * row_items)
+                    rows[start:stop] = block.reshape(rows[start:stop].shape)
+            else:
+                array = npy_format.open_memmap(in_path, mode="r")
+
+            row_items = n_item // max(shape[0], 1)
+            block_rows = max(1, block_items // max(row_items, 1))
+            for start in range(0, shape[0], block_rows):
+                yield np.ascontiguousarray(
+                    array[start : start + block_rows]
+                ).reshape(-1)
+            del array
+        finally:
+            if tmp_path:
+                os.remove(tmp_path)
+
+
+def get_headers(in_paths=None, name=""):
+    """
+    Return list of array headers, one for each input file,
+    as tuples of shape, Fortran-order flag, and data type.
+
+    Parameters
+    ----------
+    in_paths : list, default=None
+        List of paths to input files.
+
+    name : str, default=""
+        Name of array, for input files in .npz format.
+    """
+    headers = []
+    for in_path in in_paths or []:
+        with open_array(in_path, name) as (_, header):
+            headers.append(header)
+    return headers
+
+
+def get_rows(in_paths=None, headers=None, stack=False):
+    """
+    Return list of paths to input files, and the first and
+    last-plus-one rows of the merged array to which each contributes.
+
+    Parameters
+    ----------
+    in_paths : list, default=None
+        List of paths to input files.
+
+    headers : list, default=None
+        List of array headers, one for each input file, as returned
+        by get_headers().
+
+    stack : bool, default=False
+        Specify whether arrays are to be stacked along a new first axis,
+        rather than concatenated along their first axis.
+    """
+    rows = []
+    start = 0
+    for in_path, (in_shape, _, _) in zip(in_paths or [], headers or []):
+        stop = start + (1 if stack else (tuple(in_shape) or (1,))[0])
+        rows.append([in_path, start, stop])
+        start = stop
+    return rows
+
+
+def merge_array(
+    in_paths=None, out_path="", name="", stack=False, block_size=None
+):
+    """
+    Merge arrays of input files to file in .npy format.
+
+    The output array is preallocated as a memory-mapped array, and
+    the data of each input array are copied to it in a single pass.
+    Only the rows for one input array are mapped at a time, so that
+    pages written are released after each input.  The output is
+    written to a temporary file, which is then renamed, so that
+    the output exists only if complete.
+
+    Returns list of paths to input files, and the first and last-plus-one
+    rows of the output array to which each contributed.
+
+    Requires numpy, which is imported only when this function is called.
+
+    Parameters
+    ----------
+    in_paths : list, default=None
+        List of paths to input files.
+
+    out_path : str, default=""
+        Path where output file is to be created.
+
+    name : str, default=""
+        Name of array, for input files in .npz format.
+
+    stack : bool, default=False
+        Specify whether arrays are to be stacked along a new first axis,
+        rather than concatenated along their first axis.
+
+    block_size : int, default=None
+        Approximate size (bytes) of blocks in which data are copied.
+    """
+    import numpy as np
+    from numpy.lib import format as npy_format
+
+    in_paths = list(in_paths or [])
+    headers = get_headers(in_paths, name)
+    shape, dtype = get_layout(headers, stack)
+    rows = get_rows(in_paths, headers, stack)
+
+    tmp_path = f"{out_path}.tmp"
+    try:
+        out_array = npy_format.open_memmap(
+            tmp_path, mode="w+", dtype=dtype, shape=shape
+        )
+        offset = out_array.offset
+        del out_array
+        row_size = dtype.itemsize * math.prod(shape[1:])
+
+        for in_path, start, stop in rows:
+            if row_size and stop > start:
+                out_rows = np.memmap(
+                    tmp_path,
+                    dtype=dtype,
+                    mode="r+",
+                    offset=offset + start * row_size,
+                    shape=(stop - start,) + shape[1:],
+                )
+                out_items = out_rows.reshape(-1)
+                pos = 0
+                for block in iter_blocks(in_path, name, block_size):
+                    out_items[pos : pos + block.size] = block
+                    pos += block.size
+                out_rows.flush()
+                del out_items, out_rows
+        os.replace(tmp_path, out_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return rows
+
+
+def write_array(
+    in_paths=None, out_file=None, name="", stack=False, block_size=None
+):
+    """
+    Merge arrays of input files, writing in .npy format to file object.
+
+    The array header is written first, followed by the data of each
+    input array, in blocks, so that the output file object needn't
+    support seeking.  This is used for writing members of archives
+    in .npz format.
+
+    Returns list of paths to input files, and the first and last-plus-one
+    rows of the output array to which each contributed.
+
+    Requires numpy, which is imported only when this function is called.
+
+    Parameters
+    ----------
+    in_paths : list, default=None
+        List of paths to input files.
+
+    out_file : file object, default=None
+        File object, open for writing in binary mode.
+
+    name : str, default=""
+        Name of array, for input files in .npz format.
+
+    stack : bool, default=False
+        Specify whether arrays are to be stacked along a new first axis,
+        rather than concatenated along their first axis.
+
+    block_size : int, default=None
+        Approximate size (bytes) of blocks in which data are copied.
+    """
+    from numpy.lib import format as npy_format
+
+    in_paths = list(in_paths or [])
+    headers = get_headers(in_paths, name)
+    shape, dtype = get_layout(headers, stack)
+    header = {
+        "descr": npy_format.dtype_to_descr(dtype),
+        "fortran_order": False,
+        "shape": shape,
+    }
+    try:
+        npy_format.write_array_header_1_0(out_file, header)
+    except ValueError:
+        npy_format.write_array_header_2_0(out_file, header)
+
+    for in_path in in_paths:
+        for block in iter_blocks(in_path, name, block_size):
+            out_file.write(block.astype(dtype, copy=False).tobytes())
+
+    return get_rows(in_paths, headers, stack)
+
+
+def merge_arrays(in_paths=None, out_path="", stack=False, block_size=None):
+    """
+    Merge files of NumPy arrays, in .npy or .npz format.
+
+    For files in .npz format, each named array is merged separately,
+    and all input files must contain the same array names.  Merged
+    arrays are written to a file in .npz format without compression,
+    so that they can be read without decompression.  Files in .npz
+    format containing a single array may also be merged to a file
+    in .npy format.
+
+    Returns dictionary where keys are array names (empty for .npy
+    format) and values are lists of paths to input files, and the first
+    and last-plus-one rows of the merged array to which each contributed.
+    If there are no non-empty input files, nothing is written, and
+    the dictionary returned is empty.
+
+    Parameters
+    ----------
+    in_paths : list, default=None
+        List of paths to input files.  Empty files are ignored.
+
+    out_path : str, default=""
+        Path where output file is to be created.
+
+    stack : bool, default=False
+        Specify whether arrays are to be stacked along a new first axis,
+        rather than concatenated along their first axis.
+
+    block_size : int, default=None
+        Approximate size (bytes) of blocks in which data are copied.
+    """
+    in_paths = [path for path in in_paths or [] if os.path.getsize(path)]
+    if not in_paths:
+        return {}
+    names = get_names(in_paths[0])
+    for in_path in in_paths[1:]:
+        assert set(get_names(in_path)) == set(names), (
+            f"Array names of {in_path} differ from those of {in_paths[0]}"
+        )
+
+    if not is_npz(out_path):
+        assert 1 == len(names), (
+            f"Arrays {names} of {in_paths[0]} can't be merged to a file "
+            f"in .npy format, which holds a single array: {out_path}"
+        )
+        return {
+            "": merge_array(in_paths, out_path, names[0], stack, block_size)
+        }
+
+    # Write each named array directly to the archive.
+    provenance = {}
+    tmp_path = f"{out_path}.tmp"
+    try:
+        with zipfile.ZipFile(
+            tmp_path, "w", zipfile.ZIP_STORED, allowZip64=True
+        ) as archive:
+            for name in names:
+                with archive.open(
+                    f"{name}.npy", "w", force_zip64=True
+                ) as out_file:
+                    provenance[name] = write_array(
+                        in_paths, out_file, name, stack, block_size
+                    )
+        os.replace(tmp_path, out_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return provenance
+
+
+def write_provenance(data_path="", provenance=None):
+    """
+    Write provenance index for merged file.
+
+    Parameters
+    ----------
+    data_path : str, default=""
+        Path to merged file.
+
+    provenance : dict, default=None
+        Dictionary, as returned by merge_arrays(), where keys are array
+        names and values are lists of paths to input files, and the
+        first and last-plus-one rows to which each contributed.
+    """
+    provenance_path = get_provenance_path(data_path)
+    with open(f"{provenance_path}.tmp", "w", encoding="utf-8") as out_file:
+        json.dump(provenance or {}, out_file, indent=1)
+    os.replace(f"{provenance_path}.tmp", provenance_path)
+
+
+def read_provenance(data_path=""):
+    """
+    Return provenance index for merged file, as written
+    by write_provenance().
+
+    Parameters
+    ----------
+    data_path : str, default=""
+        Path to merged file.
+    """
+    with open(get_provenance_path(data_path), encoding="utf-8") as in_file:
+        return json.load(in_file)
+
+
+def get_source(data_path="", row=0, name=""):
+    """
+    Return path to input file from which a row of a merged array
+    originated, or None if the row is out of range.
+
+    Parameters
+    ----------
+    data_path : str, default=""
+        Path to merged file.
+
+    row : int, default=0
+        Index of row (position along first axis) of merged array.
+
+    name : str, default=""
+        Name of array, for merged file in .npz format.
+    """
+    rows = read_provenance(data_path).get(name, [])
+    idx = bisect.bisect_right([stop for _, _, stop in rows], row)
+    if idx < len(rows) and rows[idx][1] <= row:
+        return rows[idx][0]
+    return None
+
+
+class ArrayMerger(IMerger):
+    """Merger for files of NumPy arrays, in .npy or .npz format."""
+
+    _category = "postprocessor"
+    _name = "ArrayMerger"
+    _schema = IMerger._schema.inherit_copy()
+    _schema.datadict["stack"] = SimpleItem(
+        defvalue=False,
+        doc="Specify whether arrays are to be stacked along a new "
+        "first axis, for example to merge per-patient feature vectors "
+        "into a two-dimensional array, rather than concatenated along "
+        "their first axis.",
+    )
+
+    # Approximate size (bytes) of blocks in which data are copied.
+    block_size = 64 * 1024**2
+
+    def mergefiles(self, in_paths=None, out_path=""):
+        """
+        Merge files of NumPy arrays.
+
+        Arrays are merged without being loaded in full: shapes and
+        data types are checked using the array headers, and data are
+        copied in blocks to a preallocated, memory-mapped output.
+        A provenance index, recording the rows of each merged array
+        originating from each input file, is written alongside
+        the merged file.
+
+        Requires numpy, which is imported only when merging is performed.
+
+        Parameters
+        ----------
+        in_paths : list, default=None
+            List of paths to input files.
+        out_path : str, default = ''
+            Path where output file is to be created.
+        """
+
+        in_paths = in_paths or []
+        if out_path:
+            # Create output directory, for files in subdirectories.
+            os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+
+            start = time.time()
+            provenance = merge_arrays(
+                in_paths, out_path, self.stack, self.block_size
+            )
+            if not provenance:
+                logger.warning(f"No arrays to merge for {out_path}")
+                return
+            write_provenance(out_path, provenance)
+            logger.info(
+                f"Merged {len(in_paths)} file(s) to {out_path}: "
+                f"{time.time() - start:.2f} s, "
+                f"{os.path.getsize(out_path)} bytes"
+            )
+
+        else:
+            logger.warning("Path to output file not defined")
@@ -0,0 +1,4 @@
+# File: GangaSkrt/Lib/ArrayMerger/__init__.py
+"""Provide for merging files of NumPy arrays."""
+
+from GangaSkrt.Lib.ArrayMerger import ArrayMerger
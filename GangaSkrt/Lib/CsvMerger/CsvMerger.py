@@ -1,23 +1,764 @@
 # File: GangaSkrt/Lib/CsvMerger.py
 """Provide for merging files of data in CSV format."""
 
-from GangaCore.GPIDev.Adapters.IMerger import IMerger
+import csv
+import heapq
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+
+from GangaCore.GPIDev.Schema import SimpleItem
 from GangaCore.Utility.logging import getLogger
 
+from GangaSkrt.Lib.IncrementalMerger.IncrementalMerger import (
+    IncrementalMerger,
+    get_hidden_path,
+    read_ledger,
+)
+from GangaSkrt.Lib.MergeFilter.MergeFilter import get_predicate
+from GangaSkrt.Lib.MergeIndex.MergeIndex import index_csv
+
 logger = getLogger()
 
 
-class CsvMerger(IMerger):
+def read_labels(in_path=""):
+    """
+    Return list of column labels, read from first row of CSV file.
+
+    Parameter
+    ---------
+    in_path : str, default=""
+        Path to input file.
+    """
+    with open(in_path, newline="", encoding="utf-8") as in_file:
+        return next(csv.reader(in_file), [])
+
+
+def get_positions(labels=None, all_labels=None):
+    """
+    Return list mapping output columns to positions in input rows.
+
+    The list has one element for each output column, this being
+    the position of the first input column with the same label,
+    or None if there's no such input column.
+
+    Parameters
+    ----------
+    labels : list, default=None
+        Column labels of input file.
+
+    all_labels : list, default=None
+        Column labels of output file.
+    """
+    index = {}
+    for position, label in enumerate(labels or []):
+        index.setdefault(label, position)
+    return [index.get(label) for label in all_labels or []]
+
+
+def get_labels(in_paths=None, columns=None):
+    """
+    Return column labels for output of merging files of CSV data.
+
+    Parameters
+    ----------
+    in_paths : list, default=None
+        List of paths to input files.
+
+    columns : list, default=None
+        Labels of columns selected for output.  If non-empty, these
+        are returned, in the order given.  Otherwise, the sorted union
+        of column labels of all input files is returned, reading only
+        the first row of each file.
+    """
+    if columns:
+        return list(columns)
+    all_labels = set()
+    for in_path in in_paths or []:
+        all_labels.update(read_labels(in_path))
+    return sorted(all_labels)
+
+
+def write_rows(in_path="", writer=None, all_labels=None, predicate=None):
+    """
+    Write rows of CSV file, with columns reordered to match output labels.
+
+    Rows are read and written one at a time, so that memory use
+    doesn't depend on file size.  Empty rows are skipped, and values
+    missing from an input row are written as empty strings.  Input
+    columns not in the output labels are dropped, and rows not
+    satisfying the predicate, if given, are skipped.
+
+    Parameters
+    ----------
+    in_path : str, default=""
+        Path to input file.
+
+    writer : csv.writer, default=None
+        Writer for output file.
+
+    all_labels : list, default=None
+        Column labels of output file.
+
+    predicate : MergeFilter.Predicate, default=None
+        Predicate that rows must satisfy to be written.  Fields
+        referenced need not be in the output labels.
+    """
+    with open(in_path, newline="", encoding="utf-8") as in_file:
+        reader = csv.reader(in_file)
+        labels = next(reader, [])
+        positions = get_positions(labels, all_labels)
+        if predicate is not None:
+            fields = predicate.fields
+            field_positions = get_positions(labels, fields)
+        for row in reader:
+            if not row:
+                continue
+            n_value = len(row)
+            if predicate is not None and not predicate(
+                {
+                    field: row[position]
+                    for field, position in zip(fields, field_positions)
+                    if position is not None and position < n_value
+                }
+            ):
+                continue
+            writer.writerow(
+                [
+                    row[position]
+                    if position is not None and position < n_value
+                    else ""
+                    for position in positions
+                ]
+            )
+
+
+def write_shard(in_paths=None, shard_path="", all_labels=None, where=""):
+    """
+    Write rows of CSV files to shard file, with columns reordered
+    to match output labels, and without header row.
+
+    Returns path to shard file.
+
+    Parameters
+    ----------
+    in_paths : list, default=None
+        List of paths to input files.
+
+    shard_path : str, default=""
+        Path where shard file is to be written.
+
+    all_labels : list, default=None
+        Column labels of output file.
+
+    where : str, default=""
+        Predicate that rows must satisfy to be written; if empty,
+        all rows are written.
+    """
+    predicate = get_predicate(where)
+    with open(shard_path, "w", newline="", encoding="utf-8") as out_file:
+        writer = csv.writer(out_file, lineterminator="\n")
+        for in_path in in_paths or []:
+            write_rows(in_path, writer, all_labels, predicate)
+    return shard_path
+
+
+def merge_csv_files(in_paths=None, out_path="", columns=None, where=""):
+    """
+    Merge files of data in CSV format, serially.
+
+    The output file has a header row of the sorted union of column
+    labels of all input files, or of the columns selected, followed
+    by the rows of the input files, in input order, with columns
+    reordered to match the header row.
+
+    Parameters
+    ----------
+    in_paths : list, default=None
+        List of paths to input files.
+
+    out_path : str, default=""
+        Path where output file is to be created.
+
+    columns : list, default=None
+        Labels of columns selected for output; if empty or None,
+        all columns are output.
+
+    where : str, default=""
+        Predicate that rows must satisfy to be output; if empty,
+        all rows are output.
+    """
+    all_labels = get_labels(in_paths, columns)
+    predicate = get_predicate(where)
+
+    # Write the merged file, one row at a time.
+    with open(out_path, "w", newline="", encoding="utf-8") as out_file:
+        writer = csv.writer(out_file, lineterminator="\n")
+        writer.writerow(all_labels)
+        for in_path in in_paths or []:
+            write_rows(in_path, writer, all_labels, predicate)
+
+
+def get_key_function(labels=None, keys=None):
+    """
+    Return function returning key values for a row of CSV data.
+
+    Parameters
+    ----------
+    labels : list, default=None
+        Column labels of CSV data.
+
+    keys : list, default=None
+        Labels of key columns.
+    """
+    positions = get_positions(labels, keys)
+    missing = [
+        key for key, position in zip(keys, positions) if position is None
+    ]
+    assert not missing, f"Key column(s) not found: {missing}"
+    return lambda row: tuple(row[position] for position in positions)
+
+
+def write_run(rows=None, run_path=""):
+    """
+    Write rows of CSV data, without header row, to file.
+
+    Returns path to file written.
+
+    Parameters
+    ----------
+    rows : iterable, default=None
+        Iterable over rows, each a list of values.
+
+    run_path : str, default=""
+        Path where file is to be written.
+    """
+    with open(run_path, "w", newline="", encoding="utf-8") as run_file:
+        csv.writer(run_file, lineterminator="\n").writerows(rows or [])
+    return run_path
+
+
+def read_run(run_path=""):
+    """
+    Generator yielding rows of file of CSV data without header row.
+
+    Parameters
+    ----------
+    run_path : str, default=""
+        Path to file.
+    """
+    with open(run_path, newline="", encoding="utf-8") as run_file:
+        yield from csv.reader(run_file)
+
+
+def dedupe_rows(rows=None, key=None, keep="last"):
+    """
+    Generator yielding rows sorted by key, with duplicates removed.
+
+    Parameters
+    ----------
+    rows : iterable, default=None
+        Iterable over rows, sorted by key, with rows having
+        the same key in input order.
+
+    key : callable, default=None
+        Function returning key for a row.
+
+    keep : str, default="last"
+        Row to be kept from rows having the same key: "first", "last",
+        or "all" for all rows to be kept.
+    """
+    if "all" == keep:
+        yield from rows or []
+        return
+
+    pending = None
+    pending_key = None
+    for row in rows or []:
+        row_key = key(row)
+        if pending is not None and row_key == pending_key:
+            if "last" == keep:
+                pending = row
+            continue
+        if pending is not None:
+            yield pending
+        pending, pending_key = row, row_key
+    if pending is not None:
+        yield pending
+
+
+def sort_csv(
+    in_path="",
+    out_path="",
+    keys=None,
+    keep="last",
+    run_size=256 * 1024**2,
+    max_runs=64,
+):
+    """
+    Sort file of CSV data by key columns, removing duplicates,
+    using an external k-way merge.
+
+    Rows are read in runs, of approximate memory footprint given by
+    run_size, and each run is sorted and written to a temporary file.
+    Sorted runs are merged, in groups of at most max_runs, until
+    no more than max_runs remain, which are merged to the output file.
+    Sorting is stable, and values are compared as strings.  Memory use
+    is bounded by run_size, rather than by data size.
+
+    Parameters
+    ----------
+    in_path : str, default=""
+        Path to input file.
+
+    out_path : str, default=""
+        Path where output file is to be created.
+
+    keys : list, default=None
+        Labels of key columns.
+
+    keep : str, default="last"
+        Row to be kept from rows having the same key: "first", "last",
+        or "all" for all rows to be kept.
+
+    run_size : int, default=268435456
+        Approximate memory footprint (bytes) of rows sorted in memory.
+
+    max_runs : int, default=64
+        Maximum number of sorted runs to be merged together.
+    """
+    assert keep in ["first", "last", "all"], f"Invalid keep value: {keep}"
+    run_dir = tempfile.mkdtemp(
+        prefix=".csv_sort_", dir=os.path.dirname(out_path) or "."
+    )
+    try:
+        with open(in_path, newline="", encoding="utf-8") as in_file:
+            reader = csv.reader(in_file)
+            labels = next(reader, [])
+            key = get_key_function(labels, keys)
+
+            # Sort runs of rows, writing to temporary files
+            # if data don't fit in a single run.
+            run_paths = []
+            rows = []
+            size = 0
+            for row in reader:
+                rows.append(row)
+                size += 64 + sum(56 + len(value) for value in row)
+                if size >= run_size:
+                    rows.sort(key=key)
+                    run_path = os.path.join(run_dir, f"{len(run_paths)}.csv")
+                    run_paths.append(write_run(rows, run_path))
+                    rows = []
+                    size = 0
+            rows.sort(key=key)
+
+        if run_paths:
+            if rows:
+                run_path = os.path.join(run_dir, f"{len(run_paths)}.csv")
+                run_paths.append(write_run(rows, run_path))
+            rows = None
+
+            # Merge groups of runs, until few enough runs remain.
+            level = 0
+            while len(run_paths) > max_runs:
+                groups = [
+                    run_paths[idx : idx + max_runs]
+                    for idx in range(0, len(run_paths), max_runs)
+                ]
+                run_paths = []
+                for group in groups:
+                    run_path = os.path.join(
+                        run_dir, f"{level}_{len(run_paths)}.csv"
+                    )
+                    merged = heapq.merge(*map(read_run, group), key=key)
+                    run_paths.append(
+                        write_run(dedupe_rows(merged, key, keep), run_path)
+                    )
+                    for path in group:
+                        os.remove(path)
+                level += 1
+            rows = heapq.merge(*map(read_run, run_paths), key=key)
+
+        with open(out_path, "w", newline="", encoding="utf-8") as out_file:
+            writer = csv.writer(out_file, lineterminator="\n")
+            writer.writerow(labels)
+            writer.writerows(dedupe_rows(rows, key, keep))
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+
+def promote_types(types=None):
+    """
+    Return Arrow type to which values of all given types can be converted.
+
+    Null types (inferred for columns with no values) are ignored.  Types
+    that differ are promoted to 64-bit integer if all are integer types,
+    otherwise to 64-bit floating point if all are numeric, and otherwise
+    to string.  If only null types are given, string is returned.
+
+    Parameters
+    ----------
+    types : list, default=None
+        List of Arrow types.
+    """
+    import pyarrow as pa
+
+    types = [dtype for dtype in types or [] if not pa.types.is_null(dtype)]
+    if not types:
+        return pa.string()
+    if all(dtype == types[0] for dtype in types):
+        return types[0]
+    if all(pa.types.is_integer(dtype) for dtype in types):
+        return pa.int64()
+    if all(
+        pa.types.is_integer(dtype) or pa.types.is_floating(dtype)
+        for dtype in types
+    ):
+        return pa.float64()
+    return pa.string()
+
+
+def filter_table(table=None, predicate=None):
+    """
+    Return rows of Arrow table that satisfy predicate.
+
+    The predicate is evaluated as a vectorised compute expression.
+    If this fails, for example because a column of strings is compared
+    with a number, the predicate is instead evaluated row by row,
+    with values converted as for the python engine.
+
+    Parameters
+    ----------
+    table : pyarrow.Table, default=None
+        Table to be filtered, including all columns referenced
+        by the predicate.
+
+    predicate : MergeFilter.Predicate, default=None
+        Predicate that rows must satisfy.
+    """
+    import pyarrow as pa
+
+    try:
+        return table.filter(predicate.to_expression())
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        fields = predicate.fields
+        if fields:
+            rows = zip(*(table.column(field).to_pylist() for field in fields))
+            mask = [predicate(dict(zip(fields, row))) for row in rows]
+        else:
+            mask = [predicate({})] * table.num_rows
+        return table.filter(pa.array(mask, pa.bool_()))
+
+
+def merge_typed(
+    in_paths=None, out_paths=None, batch_rows=100000, columns=None, where=""
+):
+    """
+    Merge files of data in CSV format, with types inferred for columns.
+
+    Each input file is read using pyarrow's vectorised CSV reader, which
+    infers column types.  A unified schema is then obtained, with columns
+    the sorted union of column labels of all input files, or the columns
+    selected, and types promoted as needed across files.  Input files
+    are read a second time, with values converted directly to the unified
+    types, so that values of columns promoted to string keep their
+    original text.  Values missing, including for columns missing from
+    an input file, are null.  Only columns selected, or referenced by
+    the predicate, are converted, and rows not satisfying the predicate
+    are dropped before writing.  Data are written in batches of at least
+    batch_rows rows (except for the last), so that memory use is bounded
+    by batch size rather than by data size.  Parquet output is compressed
+    with Snappy, and Feather output with LZ4.
+
+    Returns number of rows merged.
+
+    Requires pyarrow, which is imported only when this function is called.
+
+    Parameters
+    ----------
+    in_paths : list, default=None
+        List of paths to input files.  Empty files are ignored.
+
+    out_paths : dict, default=None
+        Dictionary where keys are output formats ("csv", "parquet",
+        "feather"), and values are paths to the corresponding output files.
+
+    batch_rows : int, default=100000
+        Minimum number of rows to be written together, this being
+        the row-group size for Parquet.
+
+    columns : list, default=None
+        Labels of columns selected for output, in the order to be output;
+        if empty or None, all columns are output, in sorted order.
+
+    where : str, default=""
+        Predicate that rows must satisfy to be output; if empty,
+        all rows are output.
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+
+    in_paths = [path for path in in_paths or [] if os.path.getsize(path)]
+    predicate = get_predicate(where)
+
+    # Identify columns needed, or None if all columns are needed.
+    needed = None
+    if columns:
+        needed = set(columns)
+        if predicate is not None:
+            needed.update(predicate.fields)
+
+    def read_table(in_path, column_types=None):
+        labels = [
+            label
+            for label in dict.fromkeys(read_labels(in_path))
+            if needed is None or label in needed
+        ]
+        if column_types is not None:
+            column_types = {label: column_types[label] for label in labels}
+        return labels, pa_csv.read_csv(
+            in_path,
+            convert_options=pa_csv.ConvertOptions(
+                column_types=column_types, include_columns=labels
+            ),
+        )
+
+    # Obtain unified schema, for columns needed, and for output.
+    all_types = {}
+    for in_path in in_paths:
+        labels, table = read_table(in_path)
+        for label in labels:
+            dtype = table.schema.field(label).type
+            all_types.setdefault(label, []).append(dtype)
+    work_labels = sorted(
+        set(all_types)
+        .union(needed or [])
+        .union(predicate.fields if predicate is not None else [])
+    )
+    work_schema = pa.schema(
+        [
+            (label, promote_types(all_types.get(label)))
+            for label in work_labels
+        ]
+    )
+    column_types = {field.name: field.type for field in work_schema}
+    schema = pa.schema(
+        [
+            work_schema.field(label)
+            for label in (columns or sorted(all_types))
+        ]
+    )
+
+    with ExitStack() as stack:
+        writers = []
+        for fmt, out_path in (out_paths or {}).items():
+            if "csv" == fmt:
+                writer = pa_csv.CSVWriter(
+                    out_path,
+                    schema,
+                    write_options=pa_csv.WriteOptions(quoting_style="needed"),
+                )
+            elif "parquet" == fmt:
+                writer = pq.ParquetWriter(out_path, schema)
+            else:
+                writer = pa.ipc.new_file(
+                    out_path,
+                    schema,
+                    options=pa.ipc.IpcWriteOptions(compression="lz4"),
+                )
+            writers.append(stack.enter_context(writer))
+
+        def write(tables):
+            table = pa.concat_tables(tables)
+            for writer in writers:
+                writer.write_table(table)
+
+        n_row = 0
+        pending = []
+        n_pending = 0
+        for in_path in in_paths:
+            labels, table = read_table(in_path, column_types)
+            table = pa.Table.from_arrays(
+                [
+                    table.column(field.name)
+                    if field.name in labels
+                    else pa.nulls(table.num_rows, field.type)
+                    for field in work_schema
+                ],
+                schema=work_schema,
+            )
+            if predicate is not None:
+                table = filter_table(table, predicate)
+            pending.append(table.select(schema.names))
+            n_pending += table.num_rows
+            n_row += table.num_rows
+            if n_pending >= batch_rows:
+                write(pending)
+                pending = []
+                n_pending = 0
+        if pending or not n_row:
+            write(pending or [schema.empty_table()])
+
+    return n_row
+
+
+def convert_csv(csv_path="", out_path="", fmt="parquet", block_size=None):
+    """
+    Convert file of data in CSV format to a columnar format.
+
+    The CSV file is read in blocks, each of which is written as a row
+    group (Parquet) or record batch (Feather), so that memory use is
+    bounded by block size rather than by data size.  Column types are
+    inferred from the first block.  If a later block is inconsistent
+    with the inferred types, the conversion is repeated with all
+    columns read as strings.  Output is compressed: with Snappy
+    (the pyarrow default) for Parquet, and with LZ4 for Feather.
+
+    Requires pyarrow, which is imported only when this function is called.
+
+    Parameters
+    ----------
+    csv_path : str, default=""
+        Path to input file, in CSV format.
+
+    out_path : str, default=""
+        Path where output file is to be created.
+
+    fmt : str, default="parquet"
+        Output format: "parquet" or "feather".
+
+    block_size : int, default=None
+        Size (bytes) of blocks read from CSV file.  If None,
+        the pyarrow default is used.
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+
+    def write(column_types=None):
+        reader = pa_csv.open_csv(
+            csv_path,
+            read_options=pa_csv.ReadOptions(block_size=block_size),
+            convert_options=pa_csv.ConvertOptions(column_types=column_types),
+        )
+        if "parquet" == fmt:
+            import pyarrow.parquet as pq
+
+            writer = pq.ParquetWriter(out_path, reader.schema)
+        else:
+            writer = pa.ipc.new_file(
+                out_path,
+                reader.schema,
+                options=pa.ipc.IpcWriteOptions(compression="lz4"),
+            )
+        with writer:
+            for batch in reader:
+                writer.write_batch(batch)
+        return reader.schema
+
+    try:
+        write()
+    except pa.ArrowInvalid as error:
+        logger.warning(
+            f"Column types inferred for {csv_path} inconsistent with data "
+            f"({error}); writing {fmt} with all columns as strings"
+        )
+        labels = read_labels(csv_path)
+        write({label: pa.string() for label in labels})
+
+
+class CsvMerger(IncrementalMerger):
     """Merger for files of data in CSV format."""
 
     _category = "postprocessor"
     _name = "CsvMerger"
-    _schema = IMerger._schema.inherit_copy()
+    _schema = IncrementalMerger._schema.inherit_copy()
+    _schema.datadict["workers"] = SimpleItem(
+        defvalue=0,
+        doc="Number of worker processes for merging; "
+        "if 0 or 1, merging is performed serially.",
+    )
+    _schema.datadict["formats"] = SimpleItem(
+        defvalue=["csv"],
+        doc="List of formats in which merged output is to be written: "
+        "any of 'csv', 'parquet', 'feather'.  Columnar formats "
+        "('parquet', 'feather') require pyarrow, and are written "
+        "to the output path with suffix replaced by format name, "
+        "with Snappy compression for Parquet and LZ4 for Feather.",
+    )
+
+    _schema.datadict["engine"] = SimpleItem(
+        defvalue="python",
+        doc="Engine for merging: 'python' for merging that treats all "
+        "values as strings, or 'pyarrow' for vectorised reading, "
+        "with column types inferred and unified across files, "
+        "and missing values written as nulls.  The 'pyarrow' engine "
+        "requires pyarrow, and doesn't support sorting by key.",
+    )
+    _schema.datadict["keys"] = SimpleItem(
+        defvalue=[],
+        doc="Labels of key columns; if non-empty, merged output is sorted "
+        "by key, and rows with duplicate keys are removed as specified "
+        "by the keep attribute.",
+    )
+    _schema.datadict["keep"] = SimpleItem(
+        defvalue="last",
+        doc="Row to be kept from rows with the same key, in input order: "
+        "'first', 'last', or 'all' for sorting without removal "
+        "of duplicates.",
+    )
+
+    # Number of shards per worker process, for parallel merging.
+    shards_per_worker = 4
+
+    # Size (bytes) of blocks read from CSV file when writing
+    # columnar formats; each block is written as a row group.
+    block_size = 64 * 1024**2
+
+    # Formats that may be written.
+    known_formats = ["csv", "parquet", "feather"]
+
+    # Minimum number of rows written together by pyarrow engine.
+    batch_rows = 100000
+
+    # Approximate memory footprint (bytes) of rows sorted in memory,
+    # and maximum number of sorted runs merged together, when sorting
+    # by key columns.
+    sort_run_size = 256 * 1024**2
+    sort_max_runs = 64
 
     def mergefiles(self, in_paths=None, out_path=""):
         """
         Merge files of data in CSV format.
 
+        The output file has a header row of the sorted union of column
+        labels of all input files, followed by the rows of the input
+        files, in input order, with columns reordered to match the
+        header row.  Values for columns missing from an input file
+        are left empty.  Input rows are streamed to the output file,
+        so that memory use doesn't depend on data size.
+
+        If the columns attribute is non-empty, only the columns listed
+        are output, in the order listed.  If the where attribute is
+        non-empty, only rows satisfying the predicate that it defines
+        are output.  Columns and rows not selected are dropped as
+        input rows are streamed, and so are never held in memory.
+
+        If key columns are specified, the rows of the output file
+        are instead sorted by key, with duplicates removed.  If the
+        index_keys attribute is non-empty, an index is written for
+        random access to rows of the output file.
+
+        Merged data may additionally, or instead, be written in columnar
+        formats, as specified by the formats attribute.
+
+        If the engine attribute is 'pyarrow', merging is instead performed
+        by merge_typed(), with column types inferred.
+
         Parameters
         ----------
         in_paths : list, default=None
@@ -28,35 +769,477 @@ class CsvMerger(IMerger):
 
         in_paths = in_paths or []
         if out_path:
-            # Obtain sorted list of all column labels.
-            all_labels = set()
-            for in_path in in_paths:
-                with open(in_path, encoding="utf-8") as in_file:
-                    labels = in_file.readline().rstrip().split(",")
-                    all_labels = all_labels.union(labels)
-            all_labels = sorted(list(all_labels))
-            lines = [",".join(all_labels)]
-
-            # Obtain ordered list of values for each input line of each file,
-            # taking into account that all labels may not be present.
-            for in_path in in_paths:
-                with open(in_path, encoding="utf-8") as in_file:
-                    labels = in_file.readline().rstrip().split(",")
-                    for line in in_file:
-                        in_values = line.rstrip().split(",")
-                        out_values = []
-                        for label in all_labels:
-                            if label in labels:
-                                idx = labels.index(label)
-                                out_values.append(in_values[idx])
-                            else:
-                                out_values.append("")
-
-                        lines.append(",".join(out_values))
-
-            # Write the merged file.
-            with open(out_path, "w", encoding="utf-8") as out_file:
-                out_file.write("\n".join(lines))
+            # Create output directory, for files in subdirectories.
+            os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+
+            formats = self.get_formats()
+            if "pyarrow" == self.get_engine():
+                self.merge_typed(in_paths, out_path, formats)
+                return
+
+            # Merge to CSV, using temporary file if CSV not requested.
+            if "csv" in formats:
+                csv_path = out_path
+            else:
+                fd, csv_path = tempfile.mkstemp(
+                    prefix=".csv_merge_",
+                    suffix=".csv",
+                    dir=os.path.dirname(out_path) or ".",
+                )
+                os.close(fd)
+
+            try:
+                start = time.time()
+                self.merge_csv(in_paths, csv_path)
+                if self.keys:
+                    self.sort_keyed(csv_path, csv_path)
+                csv_time = time.time() - start
+                csv_size = os.path.getsize(csv_path)
+                logger.info(
+                    f"Merged {len(in_paths)} file(s) to CSV: "
+                    f"{csv_time:.2f} s, {csv_size} bytes"
+                )
+
+                for fmt in formats:
+                    if "csv" != fmt:
+                        self.write_columnar(
+                            csv_path, out_path, fmt, csv_time, csv_size
+                        )
+
+                # Sources can't be indexed after sorting or filtering.
+                if self.index_keys:
+                    self.write_index(
+                        csv_path,
+                        out_path,
+                        None if self.keys or self.where else in_paths,
+                    )
+            finally:
+                if csv_path != out_path and os.path.exists(csv_path):
+                    os.remove(csv_path)
 
         else:
             logger.warning("Path to output file not defined")
+
+    def get_formats(self):
+        """
+        Return list of formats in which merged output is to be written.
+        """
+        formats = list(self.formats or ["csv"])
+        unknown = set(formats).difference(self.known_formats)
+        assert not unknown, f"Unknown output format(s): {unknown}"
+        return formats
+
+    def get_engine(self):
+        """
+        Return name of engine to be used for merging.
+
+        If the pyarrow engine is requested, but pyarrow isn't installed,
+        or sorting by key is requested, a warning is logged, and the
+        python engine is used.
+        """
+        assert self.engine in ["python", "pyarrow"], (
+            f"Unknown engine: {self.engine}"
+        )
+        if "pyarrow" == self.engine:
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                logger.warning("pyarrow not installed - using python engine")
+                return "python"
+            if self.keys:
+                logger.warning(
+                    "Sorting by key not supported by pyarrow engine - "
+                    "using python engine"
+                )
+                return "python"
+        return self.engine
+
+    def merge_typed(self, in_paths=None, out_path="", formats=None):
+        """
+        Merge files of data in CSV format, using the pyarrow engine.
+
+        Output is written directly in each of the formats requested,
+        and an index is written if requested.
+
+        Parameters
+        ----------
+        in_paths : list, default=None
+            List of paths to input files.
+        out_path : str, default = ''
+            Path where output file is to be created; output in a
+            format other than CSV is written to this path with suffix
+            replaced by format name.
+        formats : list, default=None
+            List of output formats.
+        """
+        out_paths = {
+            fmt: (
+                out_path
+                if "csv" == fmt
+                else f"{os.path.splitext(out_path)[0]}.{fmt}"
+            )
+            for fmt in formats or ["csv"]
+        }
+        start = time.time()
+        n_row = merge_typed(
+            in_paths, out_paths, self.batch_rows, self.columns, self.where
+        )
+        sizes = ", ".join(
+            f"{fmt}: {os.path.getsize(path)} bytes"
+            for fmt, path in out_paths.items()
+        )
+        logger.info(
+            f"Merged {len(in_paths or [])} file(s), {n_row} rows, "
+            f"with pyarrow engine: {time.time() - start:.2f} s; {sizes}"
+        )
+
+        # Sources can't be indexed after filtering rows.
+        if self.index_keys:
+            csv_path = out_paths.get("csv", "")
+            self.write_index(
+                csv_path, out_path, None if self.where else in_paths
+            )
+
+    def merge_csv(self, in_paths=None, out_path=""):
+        """
+        Merge files of data in CSV format to output file in CSV format.
+
+        Merging is performed hierarchically if the number of input
+        files is greater than the fan_in attribute (when this is greater
+        than 1), otherwise in parallel if the number of workers is
+        greater than 1, and otherwise serially.
+
+        Parameters
+        ----------
+        in_paths : list, default=None
+            List of paths to input files.
+        out_path : str, default = ''
+            Path where output file is to be created.
+        """
+        if self.use_tree(in_paths):
+            self.merge_tree(in_paths, out_path)
+        elif self.workers and self.workers > 1 and len(in_paths) > 1:
+            self.merge_parallel(in_paths, out_path)
+        else:
+            merge_csv_files(in_paths, out_path, self.columns, self.where)
+
+    def sort_keyed(self, in_path="", out_path=""):
+        """
+        Sort file of CSV data by key columns, removing duplicates.
+
+        The input and output paths may be the same.
+
+        Parameters
+        ----------
+        in_path : str, default=""
+            Path to input file.
+        out_path : str, default = ''
+            Path where output file is to be created.
+        """
+        start = time.time()
+        tmp_path = f"{out_path}.sorted.tmp"
+        try:
+            sort_csv(
+                in_path,
+                tmp_path,
+                self.keys,
+                self.keep,
+                self.sort_run_size,
+                self.sort_max_runs,
+            )
+            os.replace(tmp_path, out_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        logger.info(
+            f"Sorted by {self.keys}, keeping {self.keep}: "
+            f"{time.time() - start:.2f} s"
+        )
+
+    def write_index(self, csv_path="", out_path="", in_paths=None):
+        """
+        Write index for merged file in CSV format.
+
+        An index is written only if CSV is one of the output formats.
+
+        Parameters
+        ----------
+        csv_path : str, default=""
+            Path to merged data in CSV format.
+        out_path : str, default = ''
+            Path requested for merger output.
+        in_paths : list, default=None
+            List of paths to input files, in the order in which their
+            rows were written; if None, sources aren't indexed.
+        """
+        if csv_path != out_path:
+            logger.warning("Index written only for output in CSV format")
+            return
+        start = time.time()
+        index_csv(out_path, self.index_keys, in_paths)
+        logger.info(f"Indexed {out_path}: {time.time() - start:.2f} s")
+
+    def get_group_merger(self, level=0):
+        """
+        Return function for merging group of files at a given level
+        of hierarchical merging, and tuple of additional arguments.
+
+        Files in CSV format are merged in the same way at all levels,
+        except that rows are filtered only at level 0, as columns
+        referenced by the predicate may not be selected for output.
+
+        Parameters
+        ----------
+        level : int, default=0
+            Level of merging.
+        """
+        return (
+            merge_csv_files,
+            (list(self.columns or []), "" if level else self.where),
+        )
+
+    def write_columnar(
+        self, csv_path="", out_path="", fmt="", csv_time=0, csv_size=0
+    ):
+        """
+        Write merged data in columnar format, and log time and size
+        relative to merging in CSV format.
+
+        If pyarrow isn't installed, a warning is logged, and
+        nothing is written.
+
+        Parameters
+        ----------
+        csv_path : str, default=""
+            Path to merged data in CSV format.
+        out_path : str, default = ''
+            Path requested for merger output; the path of the file
+            written is obtained by replacing the suffix with format name.
+        fmt : str, default=""
+            Columnar format: "parquet" or "feather".
+        csv_time : float, default=0
+            Time (seconds) taken to merge data in CSV format.
+        csv_size : int, default=0
+            Size (bytes) of merged data in CSV format.
+        """
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            logger.warning(f"pyarrow not installed - {fmt} output not written")
+            return
+
+        fmt_path = f"{os.path.splitext(out_path)[0]}.{fmt}"
+        start = time.time()
+        try:
+            convert_csv(csv_path, fmt_path, fmt, self.block_size)
+        except Exception:
+            if os.path.exists(fmt_path):
+                os.remove(fmt_path)
+            raise
+        fmt_time = time.time() - start
+        fmt_size = os.path.getsize(fmt_path)
+        logger.info(
+            f"Wrote {fmt}: {fmt_time:.2f} s, {fmt_size} bytes "
+            f"(CSV: {csv_time:.2f} s, {csv_size} bytes; "
+            f"size ratio {fmt_size / max(csv_size, 1):.3f})"
+        )
+
+    def merge_parallel(self, in_paths=None, out_path=""):
+        """
+        Merge files of data in CSV format, using a pool of processes.
+
+        Column labels are read from the input files concurrently,
+        unless columns are selected.
+        The input files are then divided into contiguous chunks, and
+        the rows of each chunk are written, with columns reordered,
+        to a temporary shard file by a worker process.  Finally, the
+        header row and the shard files are concatenated, in input
+        order.  The result is identical to that of serial merging.
+
+        Parameters
+        ----------
+        in_paths : list, default=None
+            List of paths to input files.
+        out_path : str, default = ''
+            Path where output file is to be created.
+        """
+        in_paths = list(in_paths or [])
+        n_shard = min(len(in_paths), self.workers * self.shards_per_worker)
+        chunk_size = -(-len(in_paths) // n_shard)
+        chunks = [
+            in_paths[idx : idx + chunk_size]
+            for idx in range(0, len(in_paths), chunk_size)
+        ]
+
+        shard_dir = tempfile.mkdtemp(
+            prefix=".csv_merge_", dir=os.path.dirname(out_path) or "."
+        )
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                if self.columns:
+                    all_labels = list(self.columns)
+                else:
+                    all_labels = set()
+                    for labels in executor.map(
+                        read_labels,
+                        in_paths,
+                        chunksize=max(1, len(in_paths) // (4 * self.workers)),
+                    ):
+                        all_labels.update(labels)
+                    all_labels = sorted(all_labels)
+
+                shard_paths = executor.map(
+                    write_shard,
+                    chunks,
+                    [
+                        os.path.join(shard_dir, f"shard_{idx:06d}.csv")
+                        for idx in range(len(chunks))
+                    ],
+                    [all_labels] * len(chunks),
+                    [self.where] * len(chunks),
+                )
+
+                with open(out_path, "w", newline="", encoding="utf-8") as out:
+                    csv.writer(out, lineterminator="\n").writerow(all_labels)
+                with open(out_path, "ab") as out_file:
+                    for shard_path in shard_paths:
+                        with open(shard_path, "rb") as shard_file:
+                            shutil.copyfileobj(shard_file, out_file, 1 << 20)
+        finally:
+            shutil.rmtree(shard_dir, ignore_errors=True)
+
+    def get_data_path(self, out_path=""):
+        """
+        Return path to file in CSV format into which inputs are folded,
+        for incremental merging.
+
+        This is the output path if CSV is one of the output formats
+        and no key columns are specified, and otherwise is the path
+        to a hidden file alongside.
+
+        Parameters
+        ----------
+        out_path : str, default = ''
+            Path where merger output is to be created.
+        """
+        if "csv" in self.get_formats() and not self.keys:
+            return out_path
+        return get_hidden_path(out_path, ".incremental.csv")
+
+    def append_file(self, in_path="", data_path="", ledger=None):
+        """
+        Append rows of input file to merged file in CSV format.
+
+        Rows are appended with columns reordered to match the header row
+        of the merged file, and are filtered if a predicate is given.
+        If columns aren't selected, and the input file has column labels
+        not in the header row, the merged file is first rewritten with
+        header row the sorted union of old and new labels.
+
+        Parameters
+        ----------
+        in_path : str, default=""
+            Path to input file.
+        data_path : str, default=""
+            Path to merged file.
+        ledger : dict, default=None
+            Ledger for merged file.  The column labels of the merged
+            file are stored as ledger["state"]["labels"].
+        """
+        labels = set(self.columns or read_labels(in_path))
+        all_labels = ledger["state"].get("labels")
+        predicate = get_predicate(self.where)
+
+        if all_labels is not None and labels.issubset(all_labels):
+            with open(data_path, "a", newline="", encoding="utf-8") as out:
+                writer = csv.writer(out, lineterminator="\n")
+                write_rows(in_path, writer, all_labels, predicate)
+            return
+
+        in_paths = [in_path]
+        if all_labels is not None:
+            in_paths.insert(0, data_path)
+            labels.update(all_labels)
+        all_labels = list(self.columns) if self.columns else sorted(labels)
+
+        # Rows already merged have been filtered.
+        tmp_path = f"{data_path}.tmp"
+        with open(tmp_path, "w", newline="", encoding="utf-8") as out_file:
+            writer = csv.writer(out_file, lineterminator="\n")
+            writer.writerow(all_labels)
+            for path in in_paths:
+                write_rows(
+                    path,
+                    writer,
+                    all_labels,
+                    predicate if path == in_path else None,
+                )
+        os.replace(tmp_path, data_path)
+        ledger["state"]["labels"] = all_labels
+
+    def is_consistent(self, data_path="", ledger=None):
+        """
+        Return True if header row of merged file matches
+        column labels recorded in ledger.
+
+        Parameters
+        ----------
+        data_path : str, default=""
+            Path to merged file.
+        ledger : dict, default=None
+            Ledger for merged file.
+        """
+        return read_labels(data_path) == ledger["state"].get("labels")
+
+    def finalise(self, out_path=""):
+        """
+        Finalise merger output, after all inputs have been folded in.
+
+        If no inputs have been merged, a file containing only an empty
+        header row is written.  If key columns are specified, the merged
+        data are sorted by key, with duplicates removed.  Output is then
+        written in any columnar formats requested.  The merged data
+        in CSV format are kept, in a hidden file if CSV isn't one of
+        the output formats or if key columns are specified, so that
+        further merging can be incremental.
+
+        Parameters
+        ----------
+        out_path : str, default = ''
+            Path where merger output is to be created.
+        """
+        start = time.time()
+        formats = self.get_formats()
+        data_path = self.get_data_path(out_path)
+        if not os.path.exists(data_path):
+            self.merge_csv([], data_path)
+
+        # Sort by key, to output path or temporary file.
+        csv_path = data_path
+        if self.keys:
+            if "csv" in formats:
+                csv_path = out_path
+            else:
+                csv_path = get_hidden_path(out_path, ".sorted.csv")
+            self.sort_keyed(data_path, csv_path)
+
+        try:
+            csv_time = time.time() - start
+            csv_size = os.path.getsize(csv_path)
+            for fmt in formats:
+                if "csv" != fmt:
+                    self.write_columnar(
+                        csv_path, out_path, fmt, csv_time, csv_size
+                    )
+
+            # Sources can't be indexed after sorting or filtering.
+            if self.index_keys:
+                in_paths = read_ledger(data_path)["paths"]
+                self.write_index(
+                    csv_path,
+                    out_path,
+                    None if self.keys or self.where else in_paths,
+                )
+        finally:
+            if csv_path not in [out_path, data_path]:
+                os.remove(csv_path)
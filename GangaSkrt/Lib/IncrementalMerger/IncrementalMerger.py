@@ -0,0 +1,630 @@
+# File: GangaSkrt/Lib/IncrementalMerger/IncrementalMerger.py
+"""
+Provide base class for mergers that support incremental merging.
+
+With incremental merging, the outputs of each subjob are folded into
+the merged outputs as soon as the subjob completes, rather than all
+outputs being merged after the last subjob has completed.  Partial
+results are then available while a job is running, and the merge
+performed on completion of the master job handles only the outputs
+of subjobs that haven't already been merged.
+
+For each merged file, a ledger records the input files merged, in order
+of merging, with their sizes and modification times, the size of the
+merged file after the last merge, and any merger-specific state.  The
+ledger is stored alongside the merged file, and is updated under a file
+lock, so that subjobs completing at the same time are merged one after
+the other.  If a merged file is found to be inconsistent with its ledger,
+for example following an interruption during merging, or if the selection
+of fields and rows to be merged has changed, or if an input file merged
+has since changed, for example when a subjob is resubmitted, the merged
+file is rebuilt from the files recorded.  If the
+merger's overwrite attribute is set, the merge performed on completion
+of the master job discards any existing merged file and ledger, and
+merges all outputs afresh.
+
+The base class also provides for hierarchical merging, where groups of
+input files are merged into intermediate files, which are themselves
+merged in groups, until few enough files remain to be merged into the
+final output.  Intermediate files are written to a hidden directory
+alongside the final output, and are kept until the final output has
+been written, so that merging can be resumed after a failure.
+"""
+
+import fcntl
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+from GangaCore.GPIDev.Base.Proxy import stripProxy
+from GangaCore.GPIDev.Schema import SimpleItem
+from GangaCore.GPIDev.Adapters.IMerger import IMerger
+from GangaCore.Utility.logging import getLogger
+
+logger = getLogger()
+
+# Suffixes for names of ledger and lock files, relative to merged file.
+LEDGER_SUFFIX = ".ledger.json"
+LOCK_SUFFIX = ".lock"
+
+# Suffix for name of directory of intermediate files, relative to merged file.
+TREE_SUFFIX = ".tree"
+
+# Selection of fields and rows assumed for ledgers that don't record one.
+NO_SELECTION = {"columns": [], "where": ""}
+
+
+def get_hidden_path(path="", suffix=""):
+    """
+    Return path to hidden file alongside a given file.
+
+    The name of the hidden file is the name of the given file,
+    with suffix appended, and prefixed by a dot if not already
+    starting with one.
+
+    Parameters
+    ----------
+    path : str, default=""
+        Path to file.
+
+    suffix : str, default=""
+        Suffix to be appended to name of file.
+    """
+    dirname, basename = os.path.split(path)
+    prefix = "" if basename.startswith(".") else "."
+    return os.path.join(dirname, f"{prefix}{basename}{suffix}")
+
+
+def read_ledger(data_path=""):
+    """
+    Return ledger for merged file, or an empty ledger if none exists.
+
+    Parameters
+    ----------
+    data_path : str, default=""
+        Path to merged file.
+    """
+    ledger_path = get_hidden_path(data_path, LEDGER_SUFFIX)
+    if os.path.exists(ledger_path):
+        with open(ledger_path, encoding="utf-8") as ledger_file:
+            return json.load(ledger_file)
+    return {"paths": [], "versions": {}, "size": 0, "state": {}}
+
+
+def get_version(path=""):
+    """
+    Return version of file, as list of size and modification time (ns).
+
+    Parameters
+    ----------
+    path : str, default=""
+        Path to file.
+    """
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def write_ledger(data_path="", ledger=None):
+    """
+    Write ledger for merged file, replacing any existing ledger atomically.
+
+    Parameters
+    ----------
+    data_path : str, default=""
+        Path to merged file.
+
+    ledger : dict, default=None
+        Ledger to be written.
+    """
+    ledger_path = get_hidden_path(data_path, LEDGER_SUFFIX)
+    tmp_path = f"{ledger_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as ledger_file:
+        json.dump(ledger, ledger_file)
+    os.replace(tmp_path, ledger_path)
+
+
+@contextmanager
+def locked(data_path=""):
+    """
+    Context manager holding exclusive lock for updating merged file.
+
+    Parameters
+    ----------
+    data_path : str, default=""
+        Path to merged file.
+    """
+    with open(get_hidden_path(data_path, LOCK_SUFFIX), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def concatenate_files(in_paths=None, out_path=""):
+    """
+    Concatenate input files, byte for byte, to output file.
+
+    Parameters
+    ----------
+    in_paths : list, default=None
+        List of paths to input files.
+
+    out_path : str, default=""
+        Path where output file is to be created.
+    """
+    with open(out_path, "wb") as out_file:
+        for in_path in in_paths or []:
+            with open(in_path, "rb") as in_file:
+                shutil.copyfileobj(in_file, out_file)
+
+
+def merge_group(func=None, in_paths=None, out_path="", args=()):
+    """
+    Merge group of files to intermediate file.
+
+    Output is written to a temporary file, which is then renamed,
+    so that the intermediate file exists only if complete.
+
+    Parameters
+    ----------
+    func : callable, default=None
+        Function to be called for merging, as
+        func(in_paths, out_path, *args).
+
+    in_paths : list, default=None
+        List of paths to input files.
+
+    out_path : str, default=""
+        Path where intermediate file is to be created.
+
+    args : tuple, default=()
+        Additional arguments to be passed to func.
+    """
+    tmp_path = f"{out_path}.tmp"
+    func(in_paths, tmp_path, *args)
+    os.replace(tmp_path, out_path)
+
+
+def merge_subjob(job=None):
+    """
+    Fold outputs of completed subjob into the merged outputs
+    of the master job's incremental mergers.
+
+    Errors are logged rather than raised, so that a problem with merging
+    doesn't affect the status of the subjob.  Outputs not merged here
+    are merged on completion of the master job.
+
+    Parameters
+    ----------
+    job : GangaCore.GPIDev.Lib.Job.Job, default=None
+        Job for which outputs are to be merged.  Nothing is done
+        if this isn't a subjob.
+    """
+    job = stripProxy(job)
+    master = getattr(job, "master", None)
+    if master is None:
+        return
+
+    postprocessors = stripProxy(master.postprocessors)
+    for postprocessor in getattr(
+        postprocessors, "process_objects", postprocessors
+    ):
+        postprocessor = stripProxy(postprocessor)
+        if (
+            isinstance(postprocessor, IncrementalMerger)
+            and postprocessor.incremental
+        ):
+            try:
+                postprocessor.merge_subjob(job, master.outputdir)
+            except Exception as error:
+                logger.warning(
+                    f"Incremental merging failed for job {job.fqid}: {error}"
+                )
+
+
+class IncrementalMerger(IMerger):
+    """
+    Base class for mergers that support incremental merging.
+
+    A derived class implements mergefiles(), for merging all inputs in
+    one go, and may override the methods append_file(), is_consistent()
+    and finalise(), for incremental merging.  With incremental merging,
+    inputs are merged in order of subjob completion, rather than in order
+    of subjob number.  For hierarchical merging, a derived class may
+    override get_group_merger(), and calls merge_tree() when use_tree()
+    is True.  By default, inputs are concatenated byte for byte, which
+    a derived class overrides for data with headers or other structure.
+    """
+
+    _category = "postprocessor"
+    _name = "IncrementalMerger"
+    _hidden = 1
+    _schema = IMerger._schema.inherit_copy()
+    _schema.datadict["incremental"] = SimpleItem(
+        defvalue=False,
+        doc="Specify whether outputs of each subjob are to be merged "
+        "as soon as the subjob completes.  This requires an application "
+        "(such as SkrtAlg or SkrtApp) that calls merge_subjob() when "
+        "postprocessing; otherwise, outputs are merged on completion "
+        "of the master job.",
+    )
+    _schema.datadict["fan_in"] = SimpleItem(
+        defvalue=0,
+        doc="Maximum number of files to be merged together, for "
+        "hierarchical merging; if 0 or 1, all files are merged together.",
+    )
+    _schema.datadict["index_keys"] = SimpleItem(
+        defvalue=[],
+        doc="Names of key fields for random-access index of merged "
+        "output; if non-empty, an index mapping key values and source "
+        "files to byte offsets is written alongside the merged output.",
+    )
+    _schema.datadict["columns"] = SimpleItem(
+        defvalue=[],
+        doc="Names of fields to be kept in merged output: column labels "
+        "for CSV data, in the order to be output, or keys of records "
+        "(dotted for keys of nested dictionaries) for JSON data; "
+        "if empty, all fields are kept.",
+    )
+    _schema.datadict["where"] = SimpleItem(
+        defvalue="",
+        doc="Predicate that rows of CSV data, or records of JSON data, "
+        "must satisfy to be kept in merged output, for example "
+        "'dice < 0.999'; if empty, all are kept.  For supported syntax, "
+        "see GangaSkrt.Lib.MergeFilter.MergeFilter.",
+    )
+
+    def merge(self, jobs, outputdir=None, ignorefailed=None, overwrite=None):
+        """
+        Merge outputs of jobs.
+
+        If incremental merging is disabled, or no output directory is
+        given, merging is performed as for IMerger.  Otherwise, outputs
+        not yet merged are folded into the merged outputs, which are
+        then finalised.  With incremental merging, existing merged
+        outputs are expected, and are extended rather than overwritten,
+        unless overwrite is set, in which case they're discarded and
+        all outputs are merged afresh.
+
+        Parameters
+        ----------
+        jobs : list
+            List of jobs (normally subjobs) whose outputs are to be merged.
+        outputdir : str, default=None
+            Directory where merged outputs are to be written.
+        ignorefailed : bool, default=None
+            If True, outputs of failed jobs are merged; if None,
+            the merger's ignorefailed attribute is used.
+        overwrite : bool, default=None
+            If True, existing merged outputs are overwritten; if None,
+            the merger's overwrite attribute is used.
+        """
+        if not (self.incremental and outputdir):
+            return super().merge(jobs, outputdir, ignorefailed, overwrite)
+
+        if ignorefailed is None:
+            ignorefailed = self.ignorefailed
+        if overwrite is None:
+            overwrite = getattr(self, "overwrite", False)
+        jobs = [
+            stripProxy(job)
+            for job in jobs
+            if ignorefailed or "completed" == stripProxy(job).status
+        ]
+
+        for file_name in self.files:
+            in_paths = [
+                os.path.join(job.outputdir, file_name)
+                for job in jobs
+                if os.path.exists(os.path.join(job.outputdir, file_name))
+            ]
+            out_path = os.path.join(outputdir, file_name)
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            if overwrite:
+                self.discard(out_path)
+            self.fold(in_paths, out_path)
+            self.finalise(out_path)
+
+        return True
+
+    def merge_subjob(self, job=None, outputdir=""):
+        """
+        Fold outputs of subjob into merged outputs.
+
+        Parameters
+        ----------
+        job : GangaCore.GPIDev.Lib.Job.Job, default=None
+            Subjob whose outputs are to be merged.
+        outputdir : str, default=""
+            Directory where merged outputs are to be written.
+        """
+        for file_name in self.files:
+            in_path = os.path.join(job.outputdir, file_name)
+            if os.path.exists(in_path):
+                out_path = os.path.join(outputdir, file_name)
+                os.makedirs(os.path.dirname(out_path), exist_ok=True)
+                self.fold([in_path], out_path)
+
+    def discard(self, out_path=""):
+        """
+        Discard merged file and its ledger, so that inputs are
+        subsequently merged afresh.  Outputs written on finalising
+        are replaced when next finalised.
+
+        Parameters
+        ----------
+        out_path : str, default = ''
+            Path where merger output is to be created.
+        """
+        data_path = self.get_data_path(out_path)
+        with locked(data_path):
+            for path in [get_hidden_path(data_path, LEDGER_SUFFIX), data_path]:
+                if os.path.exists(path):
+                    os.remove(path)
+        logger.info(f"Discarded {data_path}, to be merged afresh")
+
+    def fold(self, in_paths=None, out_path=""):
+        """
+        Fold input files not already merged into merged file.
+
+        Parameters
+        ----------
+        in_paths : list, default=None
+            List of paths to input files.
+        out_path : str, default = ''
+            Path to merged file.
+        """
+        data_path = self.get_data_path(out_path)
+        with locked(data_path):
+            ledger = read_ledger(data_path)
+
+            # Check merged file against ledger, truncating any data
+            # from an interrupted merge, or rebuilding if necessary.
+            size = (
+                os.path.getsize(data_path) if os.path.exists(data_path) else -1
+            )
+            if size > ledger["size"]:
+                if ledger["paths"]:
+                    os.truncate(data_path, ledger["size"])
+                else:
+                    os.remove(data_path)
+            # Rebuild also if selection of fields and rows has changed,
+            # or if an input already merged has changed since merging.
+            selection = self.get_selection()
+            if ledger["paths"] and (
+                size < ledger["size"]
+                or ledger["state"].get("selection", NO_SELECTION) != selection
+                or self.get_changed(ledger)
+                or not self.is_consistent(data_path, ledger)
+            ):
+                logger.warning(f"Rebuilding {data_path} from merged inputs")
+                in_paths = ledger["paths"] + list(in_paths or [])
+                ledger = {"paths": [], "versions": {}, "size": 0, "state": {}}
+                if os.path.exists(data_path):
+                    os.remove(data_path)
+            ledger["state"]["selection"] = selection
+            ledger.setdefault("versions", {})
+
+            merged = set(ledger["paths"])
+            for in_path in in_paths or []:
+                if in_path in merged or not os.path.exists(in_path):
+                    continue
+                version = get_version(in_path)
+                self.append_file(in_path, data_path, ledger)
+                ledger["paths"].append(in_path)
+                ledger["versions"][in_path] = version
+                ledger["size"] = os.path.getsize(data_path)
+                write_ledger(data_path, ledger)
+                merged.add(in_path)
+
+    def get_changed(self, ledger=None):
+        """
+        Return list of input files merged that have changed since merging.
+
+        Input files that no longer exist, and input files whose versions
+        weren't recorded, are assumed unchanged.
+
+        Parameters
+        ----------
+        ledger : dict, default=None
+            Ledger for merged file.
+        """
+        versions = (ledger or {}).get("versions", {})
+        return [
+            path
+            for path in (ledger or {}).get("paths", [])
+            if path in versions
+            and os.path.exists(path)
+            and get_version(path) != versions[path]
+        ]
+
+    def get_selection(self):
+        """
+        Return dictionary of fields and predicate selecting merged data.
+        """
+        return {"columns": list(self.columns or []), "where": self.where}
+
+    def get_data_path(self, out_path=""):
+        """
+        Return path to file into which inputs are folded.
+
+        Parameters
+        ----------
+        out_path : str, default = ''
+            Path where merger output is to be created.
+        """
+        return out_path
+
+    def append_file(self, in_path="", data_path="", ledger=None):
+        """
+        Append data of input file to merged file.
+
+        By default, the input file is appended byte for byte.
+
+        Parameters
+        ----------
+        in_path : str, default=""
+            Path to input file.
+        data_path : str, default=""
+            Path to merged file.
+        ledger : dict, default=None
+            Ledger for merged file.  Merger-specific state is stored
+            in the dictionary ledger["state"], which may be updated.
+        """
+        with open(data_path, "ab") as out_file:
+            with open(in_path, "rb") as in_file:
+                shutil.copyfileobj(in_file, out_file)
+
+    def is_consistent(self, data_path="", ledger=None):
+        """
+        Return True if merged file is consistent with its ledger.
+
+        Parameters
+        ----------
+        data_path : str, default=""
+            Path to merged file.
+        ledger : dict, default=None
+            Ledger for merged file.
+        """
+        return True
+
+    def finalise(self, out_path=""):
+        """
+        Finalise merger output, after all inputs have been folded in.
+
+        Parameters
+        ----------
+        out_path : str, default = ''
+            Path where merger output is to be created.
+        """
+
+    def use_tree(self, in_paths=None):
+        """
+        Return True if hierarchical merging is to be used
+        for a given list of input files.
+
+        Parameters
+        ----------
+        in_paths : list, default=None
+            List of paths to input files.
+        """
+        return bool(
+            self.fan_in
+            and self.fan_in > 1
+            and len(in_paths or []) > self.fan_in
+        )
+
+    def get_group_merger(self, level=0):
+        """
+        Return function for merging group of files at a given level
+        of hierarchical merging, and tuple of additional arguments.
+
+        The function is called as func(in_paths, out_path, *args),
+        possibly in a worker process, so must be defined at module
+        level, and the arguments must be picklable.  By default, files
+        are concatenated byte for byte at all levels.
+
+        Parameters
+        ----------
+        level : int, default=0
+            Level of merging: 0 for merging of input files, and
+            higher levels for merging of intermediate files.
+        """
+        return (concatenate_files, ())
+
+    def merge_tree(self, in_paths=None, out_path=""):
+        """
+        Merge files hierarchically.
+
+        Input files are merged in groups of size given by the fan_in
+        attribute, and the resulting intermediate files are merged in
+        the same way, until no more than fan_in files remain, which are
+        merged to the output file.  Groups are contiguous, so that input
+        order is preserved.  If the merger has a workers attribute greater
+        than 1, the groups at each level are merged in parallel.
+
+        Intermediate files from an earlier, failed attempt are reused if
+        the input files, their sizes and modification times, and the
+        merging options are unchanged.  Intermediate files are deleted
+        once the output file has been written.
+
+        Parameters
+        ----------
+        in_paths : list, default=None
+            List of paths to input files.
+        out_path : str, default = ''
+            Path where output file is to be created.
+        """
+        paths = list(in_paths or [])
+        tree_dir = get_hidden_path(out_path, TREE_SUFFIX)
+        manifest_path = os.path.join(tree_dir, "manifest.json")
+
+        # Check whether intermediate files can be reused.
+        inputs = []
+        for path in paths:
+            stat = os.stat(path)
+            inputs.append([path, stat.st_size, stat.st_mtime_ns])
+        manifest = json.dumps(
+            {
+                "fan_in": self.fan_in,
+                "mergers": [
+                    [func.__name__, args]
+                    for func, args in map(self.get_group_merger, [0, 1])
+                ],
+                "inputs": inputs,
+            }
+        )
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding="utf-8") as manifest_file:
+                if manifest_file.read() != manifest:
+                    shutil.rmtree(tree_dir)
+        if not os.path.exists(manifest_path):
+            os.makedirs(tree_dir, exist_ok=True)
+            with open(manifest_path, "w", encoding="utf-8") as manifest_file:
+                manifest_file.write(manifest)
+
+        suffix = os.path.splitext(out_path)[1]
+        workers = getattr(self, "workers", 0) or 0
+        level = 0
+        while len(paths) > self.fan_in:
+            level_dir = os.path.join(tree_dir, f"level{level}")
+            os.makedirs(level_dir, exist_ok=True)
+            groups = [
+                paths[idx : idx + self.fan_in]
+                for idx in range(0, len(paths), self.fan_in)
+            ]
+            paths = [
+                os.path.join(level_dir, f"{idx:06d}{suffix}")
+                for idx in range(len(groups))
+            ]
+            tasks = [
+                (group, path)
+                for group, path in zip(groups, paths)
+                if not os.path.exists(path)
+            ]
+
+            func, args = self.get_group_merger(level)
+            if workers > 1 and len(tasks) > 1:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    futures = [
+                        executor.submit(merge_group, func, group, path, args)
+                        for group, path in tasks
+                    ]
+                    for future in futures:
+                        future.result()
+            else:
+                for group, path in tasks:
+                    merge_group(func, group, path, args)
+
+            logger.info(
+                f"Merging level {level}: {len(groups)} group(s), "
+                f"{len(groups) - len(tasks)} reused"
+            )
+            level += 1
+
+        func, args = self.get_group_merger(level)
+        func(paths, out_path, *args)
+        shutil.rmtree(tree_dir, ignore_errors=True)
@@ -0,0 +1,4 @@
+# File: GangaSkrt/Lib/IncrementalMerger/__init__.py
+"""Provide base class for mergers that support incremental merging."""
+
+from GangaSkrt.Lib.IncrementalMerger import IncrementalMerger
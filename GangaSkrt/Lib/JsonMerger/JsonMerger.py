@@ -1,21 +1,331 @@
 # File: GangaSkrt/Lib/JsonMerger.py
 """Provide for merging files of data in JSON format."""
 
+import collections
 import json
+import os
+from concurrent.futures import ProcessPoolExecutor
 
 from GangaCore.GPIDev.Schema import SimpleItem
-from GangaCore.GPIDev.Adapters.IMerger import IMerger
 from GangaCore.Utility.logging import getLogger
 
+from GangaSkrt.Lib.IncrementalMerger.IncrementalMerger import (
+    IncrementalMerger,
+    read_ledger,
+)
+from GangaSkrt.Lib.MergeFilter.MergeFilter import get_predicate, select_fields
+from GangaSkrt.Lib.MergeIndex.MergeIndex import index_json
+
 logger = getLogger()
 
 
-class JsonMerger(IMerger):
+def get_engine(engine="auto"):
+    """
+    Return name of engine to be used for JSON decoding and encoding.
+
+    Parameters
+    ----------
+    engine : str, default="auto"
+        Requested engine: "json" for the standard-library json module,
+        "orjson" for orjson, or "auto" for orjson if installed and
+        json otherwise.  If orjson is requested but not installed,
+        a warning is logged, and json is used.
+    """
+    if engine in ["auto", "orjson"]:
+        try:
+            import orjson  # noqa: F401
+
+            return "orjson"
+        except ImportError:
+            if "orjson" == engine:
+                logger.warning("orjson not installed - using json")
+    return "json"
+
+
+def load_json(in_path="", engine="json"):
+    """
+    Return data loaded from file in JSON format.
+
+    Parameters
+    ----------
+    in_path : str, default=""
+        Path to input file.
+
+    engine : str, default="json"
+        Engine to be used for decoding: "json" or "orjson".
+    """
+    if "orjson" == engine:
+        import orjson
+
+        with open(in_path, "rb") as in_file:
+            return orjson.loads(in_file.read())
+
+    with open(in_path, encoding="utf-8") as in_file:
+        return json.load(in_file)
+
+
+def encode_json(
+    json_data=None,
+    indent=1,
+    separators=(",", ":"),
+    sort_keys=True,
+    jsonl=False,
+    engine="json",
+):
+    """
+    Return data encoded as output record.
+
+    For JSON Lines output, this is the data encoded without
+    indentation.  Otherwise, this is the data encoded as an item
+    of an output list, including indentation.
+
+    The orjson engine is used only for JSON Lines output with compact
+    separators, as orjson doesn't support other formatting.  For JSON
+    Lines output, non-ASCII characters are written as UTF-8, rather than
+    being escaped, with either engine.  The output of orjson is then
+    semantically identical to that of the json module, but may differ
+    in the formatting of floats, for example 1e-7 rather than 1e-07.
+
+    Parameters
+    ----------
+    json_data : any, default=None
+        Data to be encoded.
+
+    indent : int/str/None, default=1
+        Indent level, for output other than JSON Lines.
+
+    separators : tuple, default=(",", ":")
+        Separators between items, and between keys and items.
+
+    sort_keys : bool, default=True
+        Specify whether to sort keys of output dictionaries.
+
+    jsonl : bool, default=False
+        Specify whether data are to be encoded for JSON Lines output.
+
+    engine : str, default="json"
+        Engine to be used for encoding: "json" or "orjson".
+    """
+    if jsonl:
+        if "orjson" == engine and (",", ":") == tuple(separators):
+            import orjson
+
+            option = orjson.OPT_SORT_KEYS if sort_keys else 0
+            return orjson.dumps(json_data, option=option).decode()
+        return json.dumps(
+            json_data,
+            separators=separators,
+            sort_keys=sort_keys,
+            ensure_ascii=False,
+        )
+
+    # Encode data as single-item list, and extract the item.
+    newline = "" if indent is None else "\n"
+    text = json.dumps(
+        [json_data],
+        indent=indent,
+        separators=separators,
+        sort_keys=sort_keys,
+    )
+    return text[1 + len(newline) : len(text) - len(newline) - 1]
+
+
+def convert_json(in_path="", encoding_opts=None, columns=None, where=""):
+    """
+    Return data of file in JSON format, encoded as output record,
+    or None if the data don't satisfy the predicate given.
+
+    With the orjson engine, a file that orjson can't handle, for
+    example because it contains NaN or integers outside the 64-bit
+    range, is decoded and encoded using the json module.
+
+    Parameters
+    ----------
+    in_path : str, default=""
+        Path to input file.
+
+    encoding_opts : dict, default=None
+        Dictionary of keyword arguments for encode_json(), and
+        optionally the engine to be used for decoding, as the value
+        for "decoder".  If no decoder is given, the value for "engine"
+        is used for decoding.
+
+    columns : list, default=None
+        Names of fields to be kept, if the data are a dictionary;
+        if empty or None, all fields are kept.
+
+    where : str, default=""
+        Predicate that the data must satisfy to be output; if empty,
+        the data are always output.
+    """
+    encoding_opts = dict(encoding_opts or {})
+    decoder = encoding_opts.pop("decoder", encoding_opts.get("engine"))
+    predicate = get_predicate(where)
+
+    def convert(json_data):
+        if predicate is not None and not predicate(json_data):
+            return None
+        return encode_json(select_fields(json_data, columns), **encoding_opts)
+
+    if "orjson" == decoder:
+        import orjson
+
+        try:
+            return convert(load_json(in_path, "orjson"))
+        except (orjson.JSONDecodeError, orjson.JSONEncodeError):
+            encoding_opts = dict(encoding_opts, engine="json")
+    return convert(load_json(in_path, "json"))
+
+
+def write_records(
+    out_file=None, records=None, newline="\n", separator=",", jsonl=False
+):
+    """
+    Write encoded records to output file, as JSON list or JSON Lines.
+
+    Parameters
+    ----------
+    out_file : file object, default=None
+        File object, opened for writing text, to which records are written.
+
+    records : iterable, default=None
+        Iterable over records, encoded by encode_json().  A record may
+        also be the concatenation of several encoded records, joined
+        as in the output.  Records that are None are skipped.
+
+    newline : str, default="\n"
+        String output by JSON encoder before each list item.
+
+    separator : str, default=","
+        Separator between items of JSON list.
+
+    jsonl : bool, default=False
+        Specify whether output is to be written in JSON Lines format.
+    """
+    if not jsonl:
+        out_file.write("[")
+    n_record = 0
+    for record in records or []:
+        if record is None:
+            continue
+        if jsonl:
+            out_file.write(f"{record}\n")
+        else:
+            out_file.write(f"{separator if n_record else ''}{newline}{record}")
+        n_record += 1
+    if not jsonl:
+        out_file.write(f"{newline}]" if n_record else "]")
+
+
+def merge_json_files(
+    in_paths=None, out_path="", encoding_opts=None, columns=None, where=""
+):
+    """
+    Merge files of data in JSON format, serially.
+
+    Parameters
+    ----------
+    in_paths : list, default=None
+        List of paths to input files.
+
+    out_path : str, default=""
+        Path where output file is to be created.
+
+    encoding_opts : dict, default=None
+        Dictionary of keyword arguments for encode_json(), and
+        optionally engine for decoding, as for convert_json().
+
+    columns : list, default=None
+        Names of fields to be kept, for data that are dictionaries;
+        if empty or None, all fields are kept.
+
+    where : str, default=""
+        Predicate that data must satisfy to be output; if empty,
+        all data are output.
+    """
+    encoding_opts = encoding_opts or {}
+    records = (
+        convert_json(in_path, encoding_opts, columns, where)
+        for in_path in in_paths
+    )
+    with open(out_path, "w", encoding="utf-8") as out_file:
+        write_records(
+            out_file,
+            records,
+            "" if encoding_opts.get("indent") is None else "\n",
+            encoding_opts.get("separators", (",", ":"))[0],
+            encoding_opts.get("jsonl", False),
+        )
+
+
+def get_records(in_path="", newline="\n", jsonl=False):
+    """
+    Return records of merged file, as joined in the file,
+    or None if the merged file contains no records.
+
+    Parameters
+    ----------
+    in_path : str, default=""
+        Path to merged file.
+
+    newline : str, default="\n"
+        String output by JSON encoder before each list item.
+
+    jsonl : bool, default=False
+        Specify whether merged file is in JSON Lines format.
+    """
+    with open(in_path, encoding="utf-8") as in_file:
+        text = in_file.read()
+    if jsonl:
+        return text[:-1] or None
+    if "[]" == text:
+        return None
+    return text[1 + len(newline) : len(text) - len(newline) - 1]
+
+
+def splice_json_files(
+    in_paths=None, out_path="", newline="\n", separator=",", jsonl=False
+):
+    """
+    Merge files previously output by merging, without decoding records.
+
+    The records of each file are read as text, so that memory use
+    is bounded by the size of the largest file.
+
+    Parameters
+    ----------
+    in_paths : list, default=None
+        List of paths to files output by merging.
+
+    out_path : str, default=""
+        Path where output file is to be created.
+
+    newline : str, default="\n"
+        String output by JSON encoder before each list item.
+
+    separator : str, default=","
+        Separator between items of JSON list.
+
+    jsonl : bool, default=False
+        Specify whether files are in JSON Lines format.
+    """
+    records = (get_records(in_path, newline, jsonl) for in_path in in_paths)
+    with open(out_path, "w", encoding="utf-8") as out_file:
+        write_records(
+            out_file,
+            (record for record in records if record is not None),
+            newline,
+            separator,
+            jsonl,
+        )
+
+
+class JsonMerger(IncrementalMerger):
     """Merger for files of data in JSON format."""
 
     _category = "postprocessor"
     _name = "JsonMerger"
-    _schema = IMerger._schema.inherit_copy()
+    _schema = IncrementalMerger._schema.inherit_copy()
     _schema.datadict["indent"] = SimpleItem(defvalue=1, doc="Indent level.")
     _schema.datadict["separators"] = SimpleItem(
         defvalue=(",", ":"),
@@ -26,11 +336,56 @@ class JsonMerger(IMerger):
         defvalue=True,
         doc="Specify whether to sort keys of output dictionaries.",
     )
+    _schema.datadict["jsonl"] = SimpleItem(
+        defvalue=False,
+        doc="Specify whether to write output in JSON Lines format, "
+        "with one record per line and no indentation, rather than "
+        "as a JSON list.",
+    )
+    _schema.datadict["engine"] = SimpleItem(
+        defvalue="auto",
+        doc="Engine for JSON decoding and encoding: 'json' for the "
+        "standard-library json module, 'orjson' for orjson, or 'auto' "
+        "for decoding with orjson if installed and json otherwise, and "
+        "encoding with json, so that output doesn't depend on whether "
+        "orjson is installed.",
+    )
+    _schema.datadict["workers"] = SimpleItem(
+        defvalue=0,
+        doc="Number of worker processes for decoding and encoding; "
+        "if 0 or 1, files are processed serially.",
+    )
+
+    # Number of files per worker process for which results
+    # may be pending at any time, for parallel processing.
+    files_per_worker = 8
 
     def mergefiles(self, in_paths=None, out_path=""):
         """
         Merge files of data in JSON format.
 
+        Output is written one record at a time, as each input file is
+        read, so that memory use is bounded by the size of the largest
+        input.  By default, the output is a JSON list, formatted as
+        if written by a single call to json.dump().  If the jsonl
+        attribute is True, the output is in JSON Lines format.
+
+        Inputs may be decoded using orjson, and by a pool of processes,
+        as specified by the engine and workers attributes.  The data
+        output are the same whatever the engine and number of workers,
+        and, with the "auto" engine, the output is the same byte for
+        byte whether or not orjson is installed.
+        If the number of input files is greater than the fan_in
+        attribute (when this is greater than 1), merging is performed
+        hierarchically.  If the index_keys attribute is non-empty,
+        an index is written for random access to records.
+
+        If the columns attribute is non-empty, only the fields listed
+        are kept, for data that are dictionaries.  If the where attribute
+        is non-empty, only data satisfying the predicate that it defines
+        are output.  Data are selected as each input file is read,
+        and fields not selected are never written.
+
         Parameters
         ----------
         in_paths : list, default=None
@@ -41,18 +396,206 @@ class JsonMerger(IMerger):
 
         in_paths = in_paths or []
         if out_path:
-            json_data = []
-            for in_path in in_paths:
-                with open(in_path, encoding="utf-8") as in_file:
-                    json_data.append(json.load(in_file))
-
-            with open(out_path, "w", encoding="utf-8") as out_file:
-                json.dump(
-                    json_data,
-                    out_file,
-                    indent=self.indent,
-                    separators=self.separators,
-                    sort_keys=self.sort_keys,
+            # Create output directory, for files in subdirectories.
+            os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+
+            if self.use_tree(in_paths):
+                self.merge_tree(in_paths, out_path)
+            else:
+                with open(out_path, "w", encoding="utf-8") as out_file:
+                    write_records(
+                        out_file,
+                        self.convert_files(in_paths),
+                        self.get_newline(),
+                        self.separators[0],
+                        self.jsonl,
+                    )
+
+            # Sources can't be indexed after filtering records.
+            if self.index_keys:
+                index_json(
+                    out_path,
+                    self.index_keys,
+                    None if self.where else in_paths,
+                    self.jsonl,
                 )
         else:
             logger.warning("Path to output file not defined")
+
+    def get_encoding_opts(self):
+        """
+        Return dictionary of keyword arguments for encode_json(),
+        and engine for decoding, as expected by convert_json().
+        """
+        engine = get_engine(self.engine)
+        return {
+            "indent": self.indent,
+            "separators": tuple(self.separators),
+            "sort_keys": self.sort_keys,
+            "jsonl": self.jsonl,
+            "engine": engine if "orjson" == self.engine else "json",
+            "decoder": engine,
+        }
+
+    def convert_files(self, in_paths=None):
+        """
+        Generator yielding data of files in JSON format,
+        encoded as output records, in input order, or None
+        for data not satisfying the predicate.
+
+        If the number of workers is greater than 1, files are decoded
+        and encoded by a pool of processes.  The number of files for
+        which results may be pending is limited, so that memory use
+        remains bounded.
+
+        Parameters
+        ----------
+        in_paths : list, default=None
+            List of paths to input files.
+        """
+        in_paths = list(in_paths or [])
+        args = (self.get_encoding_opts(), list(self.columns), self.where)
+        if not (self.workers and self.workers > 1 and len(in_paths) > 1):
+            for in_path in in_paths:
+                yield convert_json(in_path, *args)
+            return
+
+        max_pending = self.workers * self.files_per_worker
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            pending = collections.deque()
+            for in_path in in_paths:
+                if len(pending) >= max_pending:
+                    yield pending.popleft().result()
+                pending.append(executor.submit(convert_json, in_path, *args))
+            while pending:
+                yield pending.popleft().result()
+
+    def get_group_merger(self, level=0):
+        """
+        Return function for merging group of files at a given level
+        of hierarchical merging, and tuple of additional arguments.
+
+        Input files are decoded, selected and encoded at level 0.
+        At higher levels, the records of intermediate files are copied
+        as text.
+
+        Parameters
+        ----------
+        level : int, default=0
+            Level of merging.
+        """
+        if level:
+            return (
+                splice_json_files,
+                (self.get_newline(), self.separators[0], self.jsonl),
+            )
+        return (
+            merge_json_files,
+            (self.get_encoding_opts(), list(self.columns or []), self.where),
+        )
+
+    def get_newline(self):
+        """
+        Return string output by JSON encoder before each list item.
+        """
+        return "" if self.indent is None else "\n"
+
+    def get_tail(self):
+        """
+        Return bytes with which a non-empty merged file ends.
+        """
+        return b"\n" if self.jsonl else f"{self.get_newline()}]".encode()
+
+    def append_file(self, in_path="", data_path="", ledger=None):
+        """
+        Append data of input file to merged file.
+
+        For JSON Lines output, a line is appended.  Otherwise, the merged
+        file is maintained as a JSON list, with the same formatting as
+        for mergefiles().  Appending a list item replaces the closing
+        bracket, so that only the new item is written.  Nothing is
+        appended for data not satisfying the predicate, but an empty
+        merged file is written if no records have yet been merged.
+
+        Parameters
+        ----------
+        in_path : str, default=""
+            Path to input file.
+        data_path : str, default=""
+            Path to merged file.
+        ledger : dict, default=None
+            Ledger for merged file.
+        """
+        item = convert_json(
+            in_path, self.get_encoding_opts(), self.columns, self.where
+        )
+        n_record = ledger["state"].get("n_record", len(ledger["paths"]))
+        newline = self.get_newline()
+        tail = self.get_tail()
+
+        if item is None:
+            if not n_record:
+                with open(data_path, "w", encoding="utf-8") as out_file:
+                    write_records(out_file, [], newline, jsonl=self.jsonl)
+            return
+
+        if self.jsonl:
+            with open(data_path, "ab" if n_record else "wb") as out:
+                out.write(item.encode() + tail)
+        elif n_record:
+            with open(data_path, "r+b") as out_file:
+                out_file.seek(ledger["size"] - len(tail))
+                out_file.truncate()
+                out_file.write(f"{self.separators[0]}{newline}".encode())
+                out_file.write(item.encode() + tail)
+        else:
+            with open(data_path, "wb") as out_file:
+                out_file.write(f"[{newline}".encode() + item.encode() + tail)
+        ledger["state"]["n_record"] = n_record + 1
+
+    def is_consistent(self, data_path="", ledger=None):
+        """
+        Return True if merged file ends as expected for a non-empty
+        list or, for JSON Lines output, with a newline.
+
+        Parameters
+        ----------
+        data_path : str, default=""
+            Path to merged file.
+        ledger : dict, default=None
+            Ledger for merged file.  The number of records merged is
+            stored as ledger["state"]["n_record"].
+        """
+        if not ledger["state"].get("n_record", len(ledger["paths"])):
+            with open(data_path, "rb") as out_file:
+                return out_file.read() == (b"" if self.jsonl else b"[]")
+        tail = self.get_tail()
+        with open(data_path, "rb") as out_file:
+            out_file.seek(max(ledger["size"] - len(tail), 0))
+            return out_file.read() == tail
+
+    def finalise(self, out_path=""):
+        """
+        Finalise merger output, after all inputs have been folded in.
+
+        If no inputs have been merged, an empty list, or for JSON Lines
+        output an empty file, is written.  If the index_keys attribute
+        is non-empty, an index is written for random access to records.
+
+        Parameters
+        ----------
+        out_path : str, default = ''
+            Path where merger output is to be created.
+        """
+        if not os.path.exists(out_path):
+            self.mergefiles([], out_path)
+
+        # Sources can't be indexed after filtering records.
+        if self.index_keys:
+            in_paths = read_ledger(out_path)["paths"]
+            index_json(
+                out_path,
+                self.index_keys,
+                None if self.where else in_paths,
+                self.jsonl,
+            )
@@ -0,0 +1,363 @@
+# File: GangaSkrt/Lib/MergeFilter/MergeFilter.py
+"""
+Provide selection of fields and rows for mergers.
+
+A merger may keep only selected fields (columns of CSV data, or keys of
+JSON records), and only the rows (or records) that satisfy a predicate.
+A predicate is a Python-like expression, for example:
+
+    dice < 0.999
+    dice < 0.999 and roi in ["parotid_left", "parotid_right"]
+    not (0 < volume <= 10) or status == "ok"
+
+Supported are: comparisons (<, <=, >, >=, ==, !=, including chained
+comparisons); membership tests (in, not in) against lists or tuples
+of constants; the logical operators and, or, not; and parentheses.
+Operands are field names, or constants (numbers, strings, True, False,
+None).  For JSON data, fields of nested dictionaries are referenced
+with dotted names, for example "flags.valid".
+
+Values of CSV data are strings, and are converted to numbers when
+compared with numbers.  A comparison involving a missing value, or
+a value that can't be converted, is false.
+
+The predicate is parsed to a syntax tree, and evaluated without use
+of eval(), so that only the operations listed are possible.
+
+This module doesn't depend on Ganga.
+"""
+
+import ast
+import functools
+import operator
+
+# Functions implementing comparison operators.
+COMPARISONS = {
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+}
+
+
+def get_field(node=None):
+    """
+    Return dotted field name for syntax-tree node,
+    or None if the node doesn't represent a field.
+
+    Parameters
+    ----------
+    node : ast.AST, default=None
+        Node of syntax tree.
+    """
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        parent = get_field(node.value)
+        if parent is not None:
+            return f"{parent}.{node.attr}"
+    return None
+
+
+def get_constant(node=None):
+    """
+    Return value of syntax-tree node representing a constant,
+    or a list or tuple of constants.
+
+    A ValueError is raised if the node doesn't represent a constant.
+
+    Parameters
+    ----------
+    node : ast.AST, default=None
+        Node of syntax tree.
+    """
+    if isinstance(node, ast.Constant):
+        return node.value
+    if (
+        isinstance(node, ast.UnaryOp)
+        and isinstance(node.op, (ast.USub, ast.UAdd))
+        and isinstance(node.operand, ast.Constant)
+        and isinstance(node.operand.value, (int, float))
+    ):
+        value = node.operand.value
+        return -value if isinstance(node.op, ast.USub) else value
+    if isinstance(node, (ast.List, ast.Tuple)):
+        return [get_constant(item) for item in node.elts]
+    raise ValueError(f"Unsupported expression: {ast.unparse(node)}")
+
+
+def get_value(record=None, field=""):
+    """
+    Return value of field of record, or None if the field is missing.
+
+    Parameters
+    ----------
+    record : dict, default=None
+        Record from which value is to be obtained.
+
+    field : str, default=""
+        Field name.  If the record has no key equal to the field name,
+        a dotted name is looked up in nested dictionaries.
+    """
+    if not isinstance(record, dict):
+        return None
+    if field in record:
+        return record[field]
+    value = record
+    for key in field.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def compare(op=None, left=None, right=None):
+    """
+    Return result of comparing two values.
+
+    A string compared with a number is converted to a number.
+    The result is False if either value is None, or if the values
+    can't be compared.
+
+    Parameters
+    ----------
+    op : ast.cmpop, default=None
+        Comparison operator.
+
+    left : any, default=None
+        Value on left of operator.
+
+    right : any, default=None
+        Value on right of operator.
+    """
+    if left is None or right is None:
+        return False
+    if isinstance(op, (ast.In, ast.NotIn)):
+        if not isinstance(right, (list, tuple)):
+            return False
+        found = any(compare(ast.Eq(), left, item) for item in right)
+        return found if isinstance(op, ast.In) else not found
+
+    def is_number(value):
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+    try:
+        if isinstance(left, str) and is_number(right):
+            left = float(left)
+        elif isinstance(right, str) and is_number(left):
+            right = float(right)
+        return COMPARISONS[type(op)](left, right)
+    except (TypeError, ValueError):
+        return False
+
+
+class Predicate:
+    """
+    Predicate that rows or records must satisfy to be selected.
+    """
+
+    def __init__(self, where=""):
+        """
+        Create instance of Predicate.
+
+        Parameters
+        ----------
+        where : str, default=""
+            Expression defining predicate.  A ValueError is raised
+            if the expression is invalid or uses unsupported syntax.
+        """
+        self.where = where
+        try:
+            self.tree = ast.parse(where.strip(), mode="eval").body
+        except SyntaxError as error:
+            raise ValueError(f"Invalid predicate: {where!r}") from error
+
+        # Names of fields referenced, in order of first reference.
+        self.fields = []
+        self.check(self.tree)
+
+    def __call__(self, record=None):
+        """
+        Return True if record satisfies predicate, and False otherwise.
+
+        Parameters
+        ----------
+        record : dict, default=None
+            Record to be tested.  For CSV data, this maps column labels
+            to values, and needs to include only the fields referenced.
+        """
+        return self.evaluate(self.tree, record)
+
+    def check(self, node=None):
+        """
+        Check that syntax-tree node uses only supported syntax,
+        and record names of fields referenced.
+
+        A ValueError is raised if unsupported syntax is found.
+
+        Parameters
+        ----------
+        node : ast.AST, default=None
+            Node of syntax tree.
+        """
+        if isinstance(node, ast.BoolOp):
+            for value in node.values:
+                self.check(value)
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            self.check(node.operand)
+        elif isinstance(node, ast.Compare):
+            for operand in [node.left] + node.comparators:
+                field = get_field(operand)
+                if field is None:
+                    get_constant(operand)
+                elif field not in self.fields:
+                    self.fields.append(field)
+            for op, operand in zip(node.ops, node.comparators):
+                if isinstance(op, (ast.In, ast.NotIn)):
+                    if not isinstance(operand, (ast.List, ast.Tuple)):
+                        raise ValueError(
+                            "Membership test requires list or tuple: "
+                            f"{ast.unparse(node)}"
+                        )
+                elif type(op) not in COMPARISONS:
+                    raise ValueError(
+                        f"Unsupported comparison: {ast.unparse(node)}"
+                    )
+        else:
+            raise ValueError(f"Unsupported expression: {ast.unparse(node)}")
+
+    def evaluate(self, node=None, record=None):
+        """
+        Return result of evaluating syntax-tree node for record.
+
+        Parameters
+        ----------
+        node : ast.AST, default=None
+            Node of syntax tree.
+
+        record : dict, default=None
+            Record for which node is to be evaluated.
+        """
+        if isinstance(node, ast.BoolOp):
+            values = (self.evaluate(value, record) for value in node.values)
+            return all(values) if isinstance(node.op, ast.And) else any(values)
+        if isinstance(node, ast.UnaryOp):
+            return not self.evaluate(node.operand, record)
+
+        def get_operand(operand):
+            field = get_field(operand)
+            if field is None:
+                return get_constant(operand)
+            return get_value(record, field)
+
+        left = get_operand(node.left)
+        for op, operand in zip(node.ops, node.comparators):
+            right = get_operand(operand)
+            if not compare(op, left, right):
+                return False
+            left = right
+        return True
+
+    def to_expression(self, node=None):
+        """
+        Return pyarrow compute expression equivalent to predicate,
+        for filtering tables of typed data.
+
+        Values are compared according to their types in the table,
+        so that filtering fails with an Arrow error, rather than
+        values being converted, if a string is compared with a number.
+        Comparisons involving null values are false.
+
+        Requires pyarrow, which is imported only when this method
+        is called.
+
+        Parameters
+        ----------
+        node : ast.AST, default=None
+            Node of syntax tree; if None, the root node is used.
+        """
+        import pyarrow.compute as pc
+
+        node = self.tree if node is None else node
+        if isinstance(node, ast.BoolOp):
+            values = [self.to_expression(value) for value in node.values]
+            if isinstance(node.op, ast.And):
+                return functools.reduce(operator.and_, values)
+            return functools.reduce(operator.or_, values)
+        if isinstance(node, ast.UnaryOp):
+            return ~self.to_expression(node.operand)
+
+        def get_operand(operand):
+            field = get_field(operand)
+            if field is None:
+                return pc.scalar(get_constant(operand))
+            return pc.field(field)
+
+        expressions = []
+        left = node.left
+        for op, operand in zip(node.ops, node.comparators):
+            if isinstance(op, (ast.In, ast.NotIn)):
+                expression = get_operand(left).isin(get_constant(operand))
+                if isinstance(op, ast.NotIn):
+                    expression = ~expression & get_operand(left).is_valid()
+            else:
+                expression = COMPARISONS[type(op)](
+                    get_operand(left), get_operand(operand)
+                )
+            expressions.append(pc.coalesce(expression, pc.scalar(False)))
+            left = operand
+        return functools.reduce(operator.and_, expressions)
+
+
+@functools.lru_cache(maxsize=64)
+def get_predicate(where=""):
+    """
+    Return Predicate for expression, or None if expression is empty.
+
+    Predicates are cached, so that an expression is parsed only once
+    when applied to many input files.
+
+    Parameters
+    ----------
+    where : str, default=""
+        Expression defining predicate.
+    """
+    return Predicate(where) if where and where.strip() else None
+
+
+def select_fields(record=None, fields=None):
+    """
+    Return record with only selected fields.
+
+    Parameters
+    ----------
+    record : any, default=None
+        Record from which fields are to be selected.  A record that
+        isn't a dictionary is returned unchanged.
+
+    fields : list, default=None
+        Names of fields to be selected; if empty or None, the record
+        is returned unchanged.  If a record has no key equal to a
+        field name, a dotted name selects a field of nested dictionaries,
+        which is returned with the same nesting.  Fields missing from
+        the record are omitted.
+    """
+    if not fields or not isinstance(record, dict):
+        return record
+    selected = {}
+    for field in fields:
+        if field in record:
+            selected[field] = record[field]
+            continue
+        keys = field.split(".")
+        parent = record
+        for key in keys[:-1]:
+            parent = parent.get(key) if isinstance(parent, dict) else None
+        if isinstance(parent, dict) and keys[-1] in parent:
+            target = selected
+            for key in keys[:-1]:
+                target = target.setdefault(key, {})
+            target[keys[-1]] = parent[keys[-1]]
+    return selected
@@ -0,0 +1,4 @@
+# File: GangaSkrt/Lib/MergeFilter/__init__.py
+"""Provide selection of fields and rows for mergers."""
+
+from GangaSkrt.Lib.MergeFilter import MergeFilter
@@ -0,0 +1,599 @@
+# File: GangaSkrt/Lib/MergeIndex/MergeIndex.py
+"""
+Provide random-access indexes for files output by mergers.
+
+An index is an SQLite database, written alongside a merged file, mapping
+the values of key fields of each record, and the input file (normally the
+output of a subjob) from which the record originated, to the byte offset
+and length of the record in the merged file.  Records can then be read
+with a seek, rather than by scanning the merged file.
+
+A record is a row of a file in CSV format, or an item of a JSON list,
+or a line of a file in JSON Lines format, or the data of a member of
+an uncompressed tar archive.  Key values are stored as strings: for CSV
+data, these are the values as written; for JSON data, values that aren't
+strings are stored encoded as JSON; for tar archives, the key is the
+member name.
+
+This module doesn't depend on Ganga, so that merged files can be read,
+for example from notebooks, using:
+
+    from GangaSkrt.Lib.MergeIndex.MergeIndex import IndexedReader
+    reader = IndexedReader("roi_info.csv")
+    records = reader.get(id="patient001")
+
+Members of archives written by ArchiveMerger can be read using:
+
+    from GangaSkrt.Lib.MergeIndex.MergeIndex import ArchiveReader
+    with ArchiveReader("images.tar") as reader:
+        data = reader.read_member("12/image.png")
+"""
+
+import csv
+import io
+import json
+import os
+import sqlite3
+
+# Suffix for name of index file, relative to merged file.
+INDEX_SUFFIX = ".index.sqlite"
+
+# Size (characters) of blocks read when scanning merged JSON list.
+BLOCK_SIZE = 1024**2
+
+
+def get_index_path(data_path=""):
+    """
+    Return path to index for merged file.
+
+    Parameters
+    ----------
+    data_path : str, default=""
+        Path to merged file.
+    """
+    return f"{data_path}{INDEX_SUFFIX}"
+
+
+def encode_key(value=None):
+    """
+    Return key value encoded as string, for storage in index.
+
+    Parameters
+    ----------
+    value : any, default=None
+        Key value.  A string is returned unchanged, and
+        any other value is encoded as JSON.
+    """
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, sort_keys=True)
+
+
+def count_rows(in_path=""):
+    """
+    Return number of non-empty data rows in file of CSV data,
+    this being the number of rows written for the file by CsvMerger.
+
+    Parameters
+    ----------
+    in_path : str, default=""
+        Path to input file.
+    """
+    with open(in_path, newline="", encoding="utf-8") as in_file:
+        reader = csv.reader(in_file)
+        next(reader, None)
+        return sum(1 for row in reader if row)
+
+
+def scan_csv(data_path=""):
+    """
+    Generator yielding, for each data row of file of CSV data,
+    tuple of byte offset, length, and row as list of values.
+
+    Physical lines are combined while a quoted value is open, so that
+    values containing newlines are handled correctly.
+
+    Parameters
+    ----------
+    data_path : str, default=""
+        Path to file of CSV data.
+    """
+    with open(data_path, "rb") as in_file:
+        offset = 0
+        header = True
+        parts = []
+        n_quote = 0
+        for line in in_file:
+            parts.append(line)
+            n_quote += line.count(b'"')
+            if n_quote % 2:
+                continue
+            record = b"".join(parts)
+            parts = []
+            n_quote = 0
+            if not header:
+                text = record.decode("utf-8")
+                row = next(csv.reader(io.StringIO(text, newline="")), [])
+                if row:
+                    yield (offset, len(record), row)
+            header = False
+            offset += len(record)
+
+
+def scan_jsonl(data_path=""):
+    """
+    Generator yielding, for each record of file in JSON Lines format,
+    tuple of byte offset, length, and decoded record.
+
+    Parameters
+    ----------
+    data_path : str, default=""
+        Path to file in JSON Lines format.
+    """
+    with open(data_path, "rb") as in_file:
+        offset = 0
+        for line in in_file:
+            if line.strip():
+                yield (offset, len(line), json.loads(line))
+            offset += len(line)
+
+
+def scan_json(data_path="", block_size=BLOCK_SIZE):
+    """
+    Generator yielding, for each item of file containing a JSON list,
+    tuple of byte offset, length, and decoded item.
+
+    The file is read in blocks, and items are decoded one at a time,
+    so that memory use is bounded by the size of the largest item.
+
+    Parameters
+    ----------
+    data_path : str, default=""
+        Path to file containing a JSON list.
+
+    block_size : int, default=BLOCK_SIZE
+        Size (characters) of blocks read from file.
+    """
+    decoder = json.JSONDecoder()
+    whitespace = " \t\n\r"
+
+    with open(data_path, encoding="utf-8") as in_file:
+        buffer = in_file.read(block_size)
+        eof = not buffer
+
+        # Position in buffer, and byte offset in file,
+        # of first character not yet consumed.
+        base = 0
+        base_offset = 0
+
+        pos = len(buffer) - len(buffer.lstrip(whitespace))
+        if "[" != buffer[pos : pos + 1]:
+            raise ValueError(f"File doesn't contain a JSON list: {data_path}")
+        pos += 1
+
+        while True:
+            # Skip whitespace and separators between items.
+            while pos < len(buffer) and buffer[pos] in f"{whitespace},":
+                pos += 1
+            complete = False
+            if pos < len(buffer) and "]" != buffer[pos]:
+                try:
+                    item, end = decoder.raw_decode(buffer, pos)
+                    complete = end < len(buffer) or eof
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+            elif eof or pos < len(buffer):
+                return
+
+            # Read more of file if item is incomplete, or not yet reached.
+            if not complete:
+                block = in_file.read(max(block_size, len(buffer) - base))
+                eof = not block
+                buffer = buffer[base:] + block
+                pos -= base
+                base = 0
+                continue
+
+            start = base_offset + len(buffer[base:pos].encode())
+            length = len(buffer[pos:end].encode())
+            yield (start, length, item)
+            base = pos = end
+            base_offset = start + length
+
+
+def write_index(
+    data_path="", records=None, keys=None, sources=None, fmt=""
+):
+    """
+    Write index for merged file.
+
+    The index is written to a temporary file, which is then renamed,
+    so that the index exists only if complete.
+
+    Parameters
+    ----------
+    data_path : str, default=""
+        Path to merged file.
+
+    records : iterable, default=None
+        Iterable over tuples of byte offset, length, and list of
+        key values, for records of merged file.
+
+    keys : list, default=None
+        Names of key fields.
+
+    sources : iterable, default=None
+        Iterable over paths to input files from which records originated,
+        with one path for each record.  If None, or if the number of paths
+        doesn't match the number of records, sources aren't indexed.
+
+    fmt : str, default=""
+        Format of merged file: "csv", "json", "jsonl" or "tar".
+    """
+    keys = list(keys or [])
+    index_path = get_index_path(data_path)
+    tmp_path = f"{index_path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    columns = [f"k{idx}" for idx in range(len(keys))]
+    stat = os.stat(data_path)
+    sources = iter(sources if sources is not None else ())
+
+    connection = sqlite3.connect(tmp_path)
+    try:
+        with connection:
+            connection.execute("CREATE TABLE meta (name TEXT, value TEXT)")
+            connection.execute(
+                "CREATE TABLE records "
+                "(offset INTEGER, length INTEGER, source TEXT"
+                f"{''.join(f', {column} TEXT' for column in columns)})"
+            )
+            placeholders = ", ".join(["?"] * (3 + len(columns)))
+            connection.executemany(
+                f"INSERT INTO records VALUES ({placeholders})",
+                (
+                    (offset, length, next(sources, None), *values)
+                    for offset, length, values in records or []
+                ),
+            )
+
+            # Discard sources if they don't match records.
+            indexed_sources = True
+            if next(sources, None) is not None or (
+                connection.execute(
+                    "SELECT COUNT(*) FROM records WHERE source IS NULL"
+                ).fetchone()[0]
+            ):
+                connection.execute("UPDATE records SET source = NULL")
+                indexed_sources = False
+
+            connection.executemany(
+                "INSERT INTO meta VALUES (?, ?)",
+                [
+                    ("format", fmt),
+                    ("keys", json.dumps(keys)),
+                    ("size", str(stat.st_size)),
+                    ("mtime_ns", str(stat.st_mtime_ns)),
+                    ("indexed_sources", json.dumps(indexed_sources)),
+                ],
+            )
+            if columns:
+                connection.execute(
+                    "CREATE INDEX records_keys "
+                    f"ON records ({', '.join(columns)})"
+                )
+            connection.execute(
+                "CREATE INDEX records_source ON records (source)"
+            )
+    finally:
+        connection.close()
+    os.replace(tmp_path, index_path)
+
+
+def index_csv(data_path="", keys=None, in_paths=None):
+    """
+    Write index for merged file of CSV data.
+
+    Parameters
+    ----------
+    data_path : str, default=""
+        Path to merged file.
+
+    keys : list, default=None
+        Labels of key columns.
+
+    in_paths : list, default=None
+        List of paths to input files, in the order in which their
+        rows were written to the merged file.  Rows of input files are
+        counted to assign sources to rows of the merged file.  If None,
+        sources aren't indexed.
+    """
+    with open(data_path, newline="", encoding="utf-8") as in_file:
+        labels = next(csv.reader(in_file), [])
+    index = {}
+    for position, label in enumerate(labels):
+        index.setdefault(label, position)
+    missing = [key for key in keys or [] if key not in index]
+    assert not missing, f"Key column(s) not found: {missing}"
+    positions = [index[key] for key in keys or []]
+
+    sources = None
+    if in_paths is not None:
+        sources = (
+            in_path
+            for in_path in in_paths
+            for _ in range(count_rows(in_path))
+        )
+
+    records = (
+        (offset, length, [row[position] for position in positions])
+        for offset, length, row in scan_csv(data_path)
+    )
+    write_index(data_path, records, keys, sources, "csv")
+
+
+def index_json(data_path="", keys=None, in_paths=None, jsonl=False):
+    """
+    Write index for merged file of JSON data.
+
+    Parameters
+    ----------
+    data_path : str, default=""
+        Path to merged file.
+
+    keys : list, default=None
+        Names of top-level fields of records to be used as keys.
+        For a record that isn't a dictionary, or that doesn't have
+        a field, the key value is stored as None.
+
+    in_paths : list, default=None
+        List of paths to input files, one for each record, in the
+        order in which records were written to the merged file.
+        If None, sources aren't indexed.
+
+    jsonl : bool, default=False
+        Specify whether merged file is in JSON Lines format.
+    """
+    scan = scan_jsonl if jsonl else scan_json
+    records = (
+        (
+            offset,
+            length,
+            [
+                encode_key(item[key])
+                if isinstance(item, dict) and key in item
+                else None
+                for key in keys or []
+            ],
+        )
+        for offset, length, item in scan(data_path)
+    )
+    fmt = "jsonl" if jsonl else "json"
+    write_index(data_path, records, keys, in_paths, fmt)
+
+
+class IndexedReader:
+    """
+    Reader of records of merged file, using index for random access.
+    """
+
+    def __init__(self, data_path=""):
+        """
+        Create instance of IndexedReader.
+
+        Parameters
+        ----------
+        data_path : str, default=""
+            Path to merged file, in CSV, JSON or JSON Lines format,
+            or tar archive, for which an index has been written.
+            A ValueError is raised if the merged file has been
+            modified since indexing.
+        """
+        self.data_path = data_path
+        self.connection = sqlite3.connect(get_index_path(data_path))
+        meta = dict(self.connection.execute("SELECT name, value FROM meta"))
+        self.fmt = meta["format"]
+        self.keys = json.loads(meta["keys"])
+        self.indexed_sources = json.loads(meta["indexed_sources"])
+
+        stat = os.stat(data_path)
+        if [str(stat.st_size), str(stat.st_mtime_ns)] != [
+            meta["size"],
+            meta["mtime_ns"],
+        ]:
+            self.connection.close()
+            raise ValueError(f"Index out of date for {data_path}")
+
+        # Column labels, for CSV data.
+        self.labels = None
+        if "csv" == self.fmt:
+            with open(data_path, newline="", encoding="utf-8") as in_file:
+                self.labels = next(csv.reader(in_file), [])
+
+        self.data_file = open(data_path, "rb")
+
+    def __len__(self):
+        """Return number of records indexed."""
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM records"
+        ).fetchone()[0]
+
+    def close(self):
+        """Close merged file and index."""
+        self.data_file.close()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def read(self, offset=0, length=0):
+        """
+        Return record read from given position in merged file.
+
+        For CSV data, the record is returned as a dictionary mapping
+        column labels to values.  For JSON data, the decoded record
+        is returned.  For a tar archive, the member data are returned
+        as bytes.
+
+        Parameters
+        ----------
+        offset : int, default=0
+            Byte offset of record.
+
+        length : int, default=0
+            Length (bytes) of record.
+        """
+        self.data_file.seek(offset)
+        data = self.data_file.read(length)
+        if "tar" == self.fmt:
+            return data
+        text = data.decode("utf-8")
+        if self.labels is not None:
+            row = next(csv.reader(io.StringIO(text, newline="")), [])
+            return dict(zip(self.labels, row))
+        return json.loads(text)
+
+    def query(self, where="", params=()):
+        """
+        Return list of records satisfying condition on index columns,
+        in order of position in merged file.
+
+        Parameters
+        ----------
+        where : str, default=""
+            SQL condition; if empty, all records are returned.
+
+        params : tuple, default=()
+            Parameters for placeholders in condition.
+        """
+        sql = "SELECT offset, length FROM records"
+        if where:
+            sql = f"{sql} WHERE {where}"
+        rows = self.connection.execute(f"{sql} ORDER BY offset", params)
+        return [self.read(offset, length) for offset, length in rows]
+
+    def get(self, **kwargs):
+        """
+        Return list of records with given key values.
+
+        Parameters
+        ----------
+        **kwargs
+            Keyword arguments, where each keyword is the name of a key
+            field, and each value is the required key value.
+        """
+        unknown = set(kwargs).difference(self.keys)
+        assert not unknown, f"Unknown key(s): {unknown}"
+        where = " AND ".join(
+            f"k{self.keys.index(key)} = ?" for key in kwargs
+        )
+        return self.query(where, tuple(map(encode_key, kwargs.values())))
+
+    def get_source(self, source=""):
+        """
+        Return list of records originating from given input file.
+
+        Parameters
+        ----------
+        source : str, default=""
+            Path to input file.
+        """
+        return self.query("source = ?", (source,))
+
+    def get_sources(self):
+        """
+        Return list of input files from which records originated,
+        in order of first record.
+        """
+        return [
+            source
+            for (source,) in self.connection.execute(
+                "SELECT source FROM records WHERE source IS NOT NULL "
+                "GROUP BY source ORDER BY MIN(offset)"
+            )
+        ]
+
+
+class ArchiveReader(IndexedReader):
+    """
+    Reader of members of tar archive, using index for random access.
+    """
+
+    def names(self):
+        """Return list of member names, in archive order."""
+        return [
+            name
+            for (name,) in self.connection.execute(
+                "SELECT k0 FROM records ORDER BY offset"
+            )
+        ]
+
+    def locate(self, name=""):
+        """
+        Return byte offset and length of data of archive member.
+
+        A KeyError is raised if the archive has no member
+        with the given name.
+
+        Parameters
+        ----------
+        name : str, default=""
+            Member name.
+        """
+        row = self.connection.execute(
+            "SELECT offset, length FROM records WHERE k0 = ?", (name,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(f"No member {name!r} in {self.data_path}")
+        return row
+
+    def read_member(self, name=""):
+        """
+        Return data of archive member, as bytes.
+
+        Parameters
+        ----------
+        name : str, default=""
+            Member name.
+        """
+        return self.read(*self.locate(name))
+
+    def extract(self, name="", out_path="", block_size=BLOCK_SIZE):
+        """
+        Extract archive member to file, copying data in blocks.
+
+        Returns path to file written.
+
+        Parameters
+        ----------
+        name : str, default=""
+            Member name.
+
+        out_path : str, default=""
+            Path to file to be written; if empty, the member name
+            is used, relative to the current directory, unless the name
+            is absolute or contains "..", when a ValueError is raised.
+
+        block_size : int, default=BLOCK_SIZE
+            Size (bytes) of blocks copied.
+        """
+        offset, length = self.locate(name)
+        if not out_path:
+            if os.path.isabs(name) or ".." in name.split("/"):
+                raise ValueError(f"Unsafe member name: {name!r}")
+            out_path = name
+        os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+        self.data_file.seek(offset)
+        with open(out_path, "wb") as out_file:
+            while length:
+                data = self.data_file.read(min(length, block_size))
+                if not data:
+                    raise ValueError(f"Truncated archive: {self.data_path}")
+                out_file.write(data)
+                length -= len(data)
+        return out_path
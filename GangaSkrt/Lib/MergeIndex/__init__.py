@@ -0,0 +1,4 @@
+# File: GangaSkrt/Lib/MergeIndex/__init__.py
+"""Provide random-access indexes for files output by mergers."""
+
+from GangaSkrt.Lib.MergeIndex import MergeIndex
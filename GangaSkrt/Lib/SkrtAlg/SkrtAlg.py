@@ -10,6 +10,8 @@ from GangaCore.GPIDev.Lib.File import ShareDir
 from GangaCore.GPIDev.Schema import Schema, SimpleItem, Version
 from GangaCore.GPIDev.Adapters.IPrepareApp import IPrepareApp
 
+from GangaSkrt.Lib.IncrementalMerger.IncrementalMerger import merge_subjob
+
 logger = logging.getLogger()
 
 
@@ -60,6 +62,65 @@ class SkrtAlg(IPrepareApp):
                 doc="Bash setup script to be sourced on worker node\n"
                 + "(ignored if SkrtAlg is passed in list to SkrtApp)",
             ),
+            "env_cache": SimpleItem(
+                defvalue="",
+                doc="Directory on worker node for caching environment "
+                + "resulting from sourcing setup_script; if empty, "
+                + "setup_script is sourced for every job\n"
+                + "(ignored if SkrtAlg is passed in list to SkrtApp)",
+            ),
+            "env_cache_lifetime": SimpleItem(
+                defvalue=86400,
+                doc="Time (seconds) after which cached environment "
+                + "is recreated\n"
+                + "(ignored if SkrtAlg is passed in list to SkrtApp)",
+            ),
+            "print_env": SimpleItem(
+                defvalue=True,
+                doc="Flag for printing environment after setup\n"
+                + "(ignored if SkrtAlg is passed in list to SkrtApp)",
+            ),
+            "master_wrapper": SimpleItem(
+                defvalue=False,
+                doc="Flag for generating Python wrapper once, at master "
+                + "level, with subjobs parameterised by small "
+                + "parameter files\n"
+                + "(ignored if SkrtAlg is passed in list to SkrtApp)",
+            ),
+            "timeout": SimpleItem(
+                defvalue=0,
+                doc="Time limit (seconds) for execution of algorithm "
+                + "for a single patient; if zero, no limit",
+            ),
+            "patient_timeout": SimpleItem(
+                defvalue=0,
+                doc="Time limit (seconds) for processing of each patient; "
+                + "if zero, no limit\n"
+                + "(ignored if SkrtAlg is passed in list to SkrtApp)",
+            ),
+            "checkpoint_dir": SimpleItem(
+                defvalue="",
+                doc="Directory, accessible from worker nodes, for "
+                + "per-subjob checkpoints of patients processed and "
+                + "algorithm states; if empty, no checkpointing\n"
+                + "(ignored if SkrtAlg is passed in list to SkrtApp)",
+            ),
+            "output_dir": SimpleItem(
+                defvalue="",
+                doc="Subdirectory of working directory, in which "
+                + "algorithm is run, and its outputs written; "
+                + "if empty, working directory is used",
+            ),
+            "local_pool": SimpleItem(
+                defvalue={},
+                doc="Dictionary of options for running subjobs under "
+                + "memory-aware admission control, in pool sharing "
+                + "resources of node; keys are pool_dir, cpus, "
+                + "cpus_per_subjob, memory, memory_per_subjob, "
+                + "memory_per_patient, max_requeues, poll_interval; "
+                + "if empty, no admission control\n"
+                + "(ignored if SkrtAlg is passed in list to SkrtApp)",
+            ),
             "is_prepared": SimpleItem(
                 defvalue=None,
                 strict_sequence=0,
@@ -96,6 +157,15 @@ class SkrtAlg(IPrepareApp):
         setup_script="",
         patient_class=None,
         patient_opts=None,
+        env_cache="",
+        env_cache_lifetime=None,
+        print_env=None,
+        master_wrapper=None,
+        checkpoint_dir="",
+        timeout=None,
+        patient_timeout=None,
+        local_pool=None,
+        output_dir="",
     ):
         """
         Create instance of SkrtAlg.
@@ -132,6 +202,72 @@ class SkrtAlg(IPrepareApp):
         setup_script : str, default=''
             Bash setup script to be sourced on worker node;
             ignored if SkrtAlg is passed in list to SkrtApp.
+
+        env_cache : str, default=''
+            Directory on worker node for caching environment resulting
+            from sourcing setup_script.  The environment is cached once
+            for each combination of node and setup-script digest,
+            and is replayed by later jobs on the same node.  If empty,
+            setup_script is sourced for every job.  Ignored if SkrtAlg
+            is passed in list to SkrtApp.
+
+        env_cache_lifetime : int, default=None
+            Time (seconds) after which cached environment is recreated.
+            If None, the schema default (86400) is used.  Ignored if SkrtAlg
+            is passed in list to SkrtApp.
+
+        print_env : bool, default=None
+            Flag for printing environment after setup.  If None,
+            the schema default (True) is used.  Ignored if SkrtAlg
+            is passed in list to SkrtApp.
+
+        master_wrapper : bool, default=None
+            Flag for generating the Python part of the wrapper script
+            once, at master level, as a byte-compiled module, with each
+            subjob then shipping only a short shell script and small
+            parameter files.  If None, the schema default (False) is used.
+            Ignored if SkrtAlg is passed in list to SkrtApp.
+
+        checkpoint_dir : str, default=''
+            Directory, accessible from worker nodes, for checkpoints.
+            Each subjob uses a subdirectory named after its fully
+            qualified identifier, where it records the patient datasets
+            processed and the algorithm states.  A resubmitted subjob
+            resumes from its checkpoint, skipping datasets already
+            processed.  If empty, no checkpointing is performed.
+            Ignored if SkrtAlg is passed in list to SkrtApp.
+
+        timeout : int/float, default=None
+            Time limit (seconds) for execution of algorithm for
+            a single patient.  When the limit is reached, the patient
+            is skipped, with algorithm states restored to their values
+            before processing of the patient started.  If None,
+            the schema default (0, meaning no limit) is used.
+
+        patient_timeout : int/float, default=None
+            Time limit (seconds) for processing of each patient,
+            including loading of patient dataset.  When the limit is
+            reached, the patient is skipped, as for timeout.  If None,
+            the schema default (0, meaning no limit) is used.
+            Ignored if SkrtAlg is passed in list to SkrtApp.
+
+        local_pool : dict, default=None
+            Dictionary of options for running subjobs under memory-aware
+            admission control, in a pool sharing the CPUs and memory
+            of a node, for example with the Local backend.  Subjobs are
+            admitted when their estimated memory footprint, from history
+            or from the split plan, fits within what is free, and are
+            re-queued if they exceed it.  Keys are the parameters of
+            SkrtRunner.SkrtPool: pool_dir, cpus, cpus_per_subjob, memory,
+            memory_per_subjob, memory_per_patient, max_requeues,
+            poll_interval.  If None or empty, no admission control
+            is applied.  Ignored if SkrtAlg is passed in list to SkrtApp.
+
+        output_dir : str, default=''
+            Subdirectory of the working directory, in which the algorithm
+            is run, so that its outputs are written there, and returned
+            in the same subdirectory of the job's output directory.
+            If empty, the working directory is used.
         """
         super().__init__()
 
@@ -168,6 +304,42 @@ class SkrtAlg(IPrepareApp):
             assert isinstance(setup_script, str)
             self.setup_script = setup_script
 
+        if env_cache:
+            assert isinstance(env_cache, str)
+            self.env_cache = env_cache
+
+        if env_cache_lifetime is not None:
+            assert isinstance(env_cache_lifetime, int)
+            self.env_cache_lifetime = env_cache_lifetime
+
+        if print_env is not None:
+            assert isinstance(print_env, bool)
+            self.print_env = print_env
+
+        if master_wrapper is not None:
+            assert isinstance(master_wrapper, bool)
+            self.master_wrapper = master_wrapper
+
+        if checkpoint_dir:
+            assert isinstance(checkpoint_dir, str)
+            self.checkpoint_dir = checkpoint_dir
+
+        if timeout is not None:
+            assert isinstance(timeout, (int, float))
+            self.timeout = timeout
+
+        if patient_timeout is not None:
+            assert isinstance(patient_timeout, (int, float))
+            self.patient_timeout = patient_timeout
+
+        if local_pool:
+            assert isinstance(local_pool, dict)
+            self.local_pool = local_pool
+
+        if output_dir:
+            assert isinstance(output_dir, str)
+            self.output_dir = output_dir
+
     @classmethod
     def from_algorithm(
         cls, alg=None, setup_script="", patient_class=None, patient_opts=None
@@ -227,6 +399,15 @@ class SkrtAlg(IPrepareApp):
             f"patient_opts = {str(self.patient_opts)}",
             f"log_level = {str(self.log_level)}",
             f"setup_script = '{self.setup_script}'",
+            f"env_cache = '{self.env_cache}'",
+            f"env_cache_lifetime = {self.env_cache_lifetime}",
+            f"print_env = {self.print_env}",
+            f"master_wrapper = {self.master_wrapper}",
+            f"checkpoint_dir = '{self.checkpoint_dir}'",
+            f"timeout = {self.timeout}",
+            f"patient_timeout = {self.patient_timeout}",
+            f"local_pool = {self.local_pool}",
+            f"output_dir = '{self.output_dir}'",
         ]
         args_string = ", ".join(args)
 
@@ -271,10 +452,28 @@ class SkrtAlg(IPrepareApp):
             "patient_opts": self.patient_opts,
             "log_level": self.log_level,
             "setup_script": self.setup_script,
+            "env_cache": self.env_cache,
+            "env_cache_lifetime": self.env_cache_lifetime,
+            "print_env": self.print_env,
+            "master_wrapper": self.master_wrapper,
+            "checkpoint_dir": self.checkpoint_dir,
+            "timeout": self.timeout,
+            "patient_timeout": self.patient_timeout,
+            "local_pool": self.local_pool,
+            "output_dir": self.output_dir,
         }
 
         return (False, app)
 
+    def postprocess(self):
+        """
+        Perform postprocessing, on completion of job or subjob.
+
+        For a subjob, outputs are folded into the merged outputs
+        of any incremental mergers of the master job.
+        """
+        merge_subjob(self.getJobObject())
+
 
 # Add SkrtAlg to configuration scope
 # (necessary to read in SkrtAlg from XML repository)
@@ -3,7 +3,9 @@
 Define SkrtAlg application's runtime handling on local system.
 """
 
+import importlib.util
 import os
+import py_compile
 import time
 
 from GangaCore.GPIDev.Adapters.IRuntimeHandler import IRuntimeHandler
@@ -12,6 +14,9 @@ from GangaCore.GPIDev.Lib.File import File
 from GangaCore.GPIDev.Lib.File import FileBuffer
 from GangaCore.Utility.files import fullpath
 
+from GangaSkrt.Lib.SkrtLoader import SkrtLoader
+from GangaSkrt.Lib.SkrtRunner import SkrtRunner
+
 
 class SkrtAlgLocal(IRuntimeHandler):
     """
@@ -21,6 +26,81 @@ class SkrtAlgLocal(IRuntimeHandler):
     GangaCore.GPIDev.Adapters.IRuntimeHandler.IRuntimeHandler
     """
 
+    # Name of Python module for wrapper generated at master level.
+    wrapper_module = "skrt_wrapper"
+
+    def master_prepare(self, app, appmasterconfig):
+        """
+        Prepare for running SkrtAlg application on local system,
+        performing operations common to all subjobs.
+
+        The items placed in the master input sandbox are:
+            - the modules providing worker-side support;
+            - a sidecar file of the options common to all subjobs.
+
+        If the application's master_wrapper flag is set, the Python part
+        of the wrapper script is also generated once, as a module to be
+        placed in the master input sandbox, along with its
+        byte-compiled form and any algorithm modules.
+
+        **Parameters:**
+
+        app : GangaSkrt.Lib.SkrtAlg.SkrtAlg
+            Object representing application to be run.
+
+        appmasterconfig : dict
+            Data structure containing information extracted
+            during application configuration before
+            any job splitting.
+        """
+
+        job = app.getJobObject()
+
+        inbox = self.get_support_files()
+        inbox.append(
+            FileBuffer(
+                SkrtRunner.OPTIONS_FILE,
+                SkrtRunner.encode_options(
+                    self.get_alg_opts(appsubconfig=appmasterconfig),
+                    appmasterconfig["patient_opts"],
+                    self.get_runner_opts(appsubconfig=appmasterconfig),
+                ),
+            )
+        )
+
+        if not appmasterconfig.get("master_wrapper", False):
+            return StandardJobConfig(inputbox=inbox)
+
+        lines = self.python_head()
+        lines.extend(self.options())
+
+        body_lines, body_inbox, _ = self.body(appsubconfig=appmasterconfig)
+        lines.extend(body_lines)
+        inbox.extend(body_inbox)
+
+        tail_lines, _ = self.tail(heredoc=False)
+        lines.extend(tail_lines)
+
+        # Write wrapper module to job's input directory,
+        # and byte-compile with hash-based validation, so that
+        # the compiled code remains valid after transfer.
+        wrapper_path = os.path.join(job.inputdir, f"{self.wrapper_module}.py")
+        with open(wrapper_path, "w", encoding="utf-8") as wrapper_file:
+            wrapper_file.write("\n".join(lines) + "\n")
+        inbox.append(File(wrapper_path))
+
+        pyc_path = importlib.util.cache_from_source(wrapper_path)
+        py_compile.compile(
+            wrapper_path,
+            cfile=pyc_path,
+            doraise=True,
+            invalidation_mode=py_compile.PycInvalidationMode.CHECKED_HASH,
+        )
+        inbox.append(File(pyc_path, subdir=os.path.basename(
+            os.path.dirname(pyc_path))))
+
+        return StandardJobConfig(inputbox=inbox)
+
     def prepare(self, app, appsubconfig, appmasterconfig, jobmasterconfig):
         """
         Prepare for running SkrtAlg application on local system.
@@ -30,6 +110,11 @@ class SkrtAlgLocal(IRuntimeHandler):
             - define items to be transferred for when application runs;
             - define items to be returned after application completes.
 
+        Options that differ from those of the master job are written
+        to a sidecar file.  If the Python part of the wrapper script
+        has been generated at master level, the only other item
+        created here is a short shell script.
+
         **Parameters:**
 
         app : GangaSkrt.Lib.SkrtAlg.SkrtAlg
@@ -40,27 +125,40 @@ class SkrtAlgLocal(IRuntimeHandler):
             during application configuration after
             any job splitting.
 
-        appmasterconfig: any
-            In principle a data structure containing information
-            extracted during application configuration before
-            any job splitting, but here ignored.
+        appmasterconfig: dict
+            Data structure containing information extracted
+            during application configuration before
+            any job splitting.
 
         jobmasterconfig: any
-            In principle a data structure containing information
-            extracted during job configuration before
-            any job splitting, but here ignored.
+            Data structure containing information extracted
+            during job configuration before any job splitting.
         """
 
         job = app.getJobObject()
 
+        options_box = self.options_box(
+            job=job,
+            appsubconfig=appsubconfig,
+            appmasterconfig=appmasterconfig,
+            jobmasterconfig=jobmasterconfig,
+        )
+
+        if jobmasterconfig is not None and appsubconfig.get(
+            "master_wrapper", False
+        ):
+            return self.prepare_from_master(job, appsubconfig, options_box)
+
         lines = []
-        inbox = []
+        inbox = list(options_box)
         outbox = []
 
         head_lines, head_box = self.head(job=job, appsubconfig=appsubconfig)
         lines.extend(head_lines)
         inbox.extend(head_box)
 
+        lines.extend(self.options())
+
         body_lines, body_inbox, body_outbox = self.body(
                 appsubconfig=appsubconfig
         )
@@ -71,6 +169,7 @@ class SkrtAlgLocal(IRuntimeHandler):
         tail_lines, tail_box = self.tail()
         lines.extend(tail_lines)
         outbox.extend(tail_box)
+        outbox.extend(self.get_runner_outbox(appsubconfig=appsubconfig))
 
         job_script = "\n".join(lines)
         job_wrapper = FileBuffer(
@@ -85,6 +184,50 @@ class SkrtAlgLocal(IRuntimeHandler):
             exe=job_wrapper, inputbox=inbox, outputbox=outbox
         )
 
+    def prepare_from_master(
+        self, job=None, appsubconfig=None, options_box=None
+    ):
+        """
+        Prepare subjob for running wrapper generated at master level.
+
+        Returns job configuration for subjob, where the executable
+        is a short shell script that sets up the environment, then
+        runs the master-level wrapper module, and where the items
+        to be transferred are limited to files of subjob parameters.
+
+        **Parameters:**
+
+        job          : GangaCore.Lib.Job.Job
+            Job object with which application is associated.
+
+        appsubconfig : dict
+            Data structure containing information extracted
+            during application configuration after
+            any job splitting.
+
+        options_box : list, default=None
+            List of items for passing subjob options.
+        """
+        inbox = [self.paths_buffer(job=job)]
+        inbox.extend(options_box or [])
+
+        lines = self.shell_head(job=job, appsubconfig=appsubconfig)
+        lines.append(f"python -m {self.wrapper_module}")
+
+        job_wrapper = FileBuffer(
+            f"skrt_{getattr(job.application, '_name')[6:].lower()}.sh",
+            "\n".join(lines), executable=1
+        )
+
+        _, outbox = self.tail(heredoc=False)
+        outbox.extend(self.get_runner_outbox(appsubconfig=appsubconfig))
+        for outputfile in job.outputfiles:
+            outbox.append(outputfile.namePattern)
+
+        return StandardJobConfig(
+            exe=job_wrapper, inputbox=inbox, outputbox=outbox
+        )
+
     def head(self, job=None, appsubconfig=None, patient_data="patient_data"):
         """
         Define operations needed before application is run.
@@ -107,14 +250,48 @@ class SkrtAlgLocal(IRuntimeHandler):
             Name to be used for file containing paths to input data.
         """
 
+        inbox = [self.paths_buffer(job=job, patient_data=patient_data)]
+
+        lines = self.shell_head(job=job, appsubconfig=appsubconfig)
+        lines.append("python << PYTHON_END")
+        lines.extend(self.python_head(patient_data=patient_data))
+
+        return (lines, inbox)
+
+    def paths_buffer(self, job=None, patient_data="patient_data"):
+        """
+        Return FileBuffer for file containing paths to input data.
+
+        **Parameters:**
+
+        job          : GangaCore.Lib.Job.Job
+            Job object with which application is associated.
+
+        patient_data : str, default='patient_data'
+            Name to be used for file containing paths to input data.
+        """
         paths_file = f"{patient_data}.py"
         if hasattr(job.inputdata, "write_paths_to_file_buffer"):
-            inbox = [job.inputdata.write_paths_to_file_buffer(paths_file)]
-        else:
-            inbox = [FileBuffer(paths_file, "paths = []")]
+            return job.inputdata.write_paths_to_file_buffer(paths_file)
+        return FileBuffer(paths_file, "paths = []")
 
-        setup_script = appsubconfig["setup_script"]
+    def shell_head(self, job=None, appsubconfig=None):
+        """
+        Define shell operations needed before application is run.
+
+        Returns lines of wrapper script up to, but excluding,
+        the invocation of Python.
 
+        **Parameters:**
+
+        job          : GangaCore.Lib.Job.Job
+            Job object with which application is associated.
+
+        appsubconfig : dict
+            Data structure containing information extracted
+            during application configuration after
+            any job splitting.
+        """
         time_now = time.strftime("%c")
         lines = [
             "#!/bin/bash",
@@ -123,48 +300,355 @@ class SkrtAlgLocal(IRuntimeHandler):
             f"# Created by Ganga - {time_now}",
             "",
         ]
-        if setup_script:
-            lines.extend(
-                [
-                    f"source {setup_script}",
-                    "env",
-                    "",
-                ]
-            )
-        lines.extend(
-            [
-                "python << PYTHON_END",
-                "import importlib",
-                "import multiprocessing",
-                "import platform",
-                "import socket",
-                "import sys",
-                "import time",
-                "",
-                "# from cpuinfo import cpuinfo",
-                f"from {patient_data} import paths",
-                "from skrt import application as skrt_app",
-                "",
-                "job_start_time = f'{time.time(): .6f}'",
-                "time_format = '%a %d %b %Y %T %Z'",
-                "",
-                "hostname = socket.getfqdn()",
-                "# brand = cpuinfo.get_cpu_info()['brand_raw']",
-                "print()",
-                "print()",
-                "print(f'Job running on {hostname}')",
-                "print(f'Processor architecture: {platform.machine()}')",
-                "# print(f'Processor type: {brand}')",
-                "print(f'CPU cores: {multiprocessing.cpu_count()}')",
-                "print()",
-                "print(f'Start time: {time.strftime(time_format)}')",
-                "print()",
-                "work_dir = platform.os.getcwd()",
-                "",
+        lines.extend(self.setup(appsubconfig=appsubconfig))
+
+        return lines
+
+    def python_head(self, patient_data="patient_data"):
+        """
+        Define Python operations needed before application is run.
+
+        Returns initial lines of Python part of wrapper script.
+
+        **Parameter:**
+
+        patient_data : str, default='patient_data'
+            Name of module containing paths to input data.
+        """
+        lines = [
+            "import importlib",
+            "import multiprocessing",
+            "import platform",
+            "import socket",
+            "import sys",
+            "import time",
+            "",
+            "# from cpuinfo import cpuinfo",
+            f"from {patient_data} import paths",
+            "from skrt import application as skrt_app",
+            "",
+            "import SkrtRunner",
+            "",
+            "job_start_time = f'{time.time(): .6f}'",
+            "time_format = '%a %d %b %Y %T %Z'",
+            "",
+            "hostname = socket.getfqdn()",
+            "# brand = cpuinfo.get_cpu_info()['brand_raw']",
+            "print()",
+            "print()",
+            "print(f'Job running on {hostname}')",
+            "print(f'Processor architecture: {platform.machine()}')",
+            "# print(f'Processor type: {brand}')",
+            "print(f'CPU cores: {multiprocessing.cpu_count()}')",
+            "print()",
+            "print(f'Start time: {time.strftime(time_format)}')",
+            "print()",
+            "work_dir = platform.os.getcwd()",
+            "",
+        ]
+
+        return lines
+
+    def setup(self, appsubconfig=None):
+        """
+        Define operations for setting up environment on worker node.
+
+        Returns lines of wrapper script for setting up environment.
+
+        If no setup script is defined, no lines are returned.  If
+        a directory for environment caching is defined, the environment
+        resulting from sourcing the setup script is captured once for
+        each combination of node and setup-script digest, as a list of
+        export statements for the variables that the script sets or
+        modifies.  Later jobs on the same node replay this snapshot
+        instead of sourcing the setup script, until the snapshot is older
+        than the cache lifetime.  Shell functions and aliases defined by
+        the setup script aren't replayed.
+
+        **Parameter:**
+
+        appsubconfig : dict
+            Data structure containing information extracted
+            during application configuration after
+            any job splitting.
+        """
+        setup_script = appsubconfig["setup_script"]
+        if not setup_script:
+            return []
+
+        env_cache = appsubconfig.get("env_cache", "")
+        lifetime = int(appsubconfig.get("env_cache_lifetime", 86400))
+
+        if env_cache:
+            lines = [
+                f'skrt_setup_script="{setup_script}"',
+                f'skrt_env_dir="{env_cache}"',
+                'skrt_env_digest=$(md5sum < "${skrt_setup_script}" '
+                + '| cut -d " " -f 1)',
+                'skrt_env_file="${skrt_env_dir}/skrt_env_$(hostname -s)'
+                + '_${skrt_env_digest}.sh"',
+                'skrt_env_time=$(stat -c %Y "${skrt_env_file}" '
+                + "2> /dev/null || echo 0)",
+                "if [ $(( $(date +%s) - skrt_env_time )) -lt "
+                + f"{lifetime} ]; then",
+                '    source "${skrt_env_file}"',
+                "else",
+                "    declare -A skrt_env_before",
+                '    while IFS= read -r -d "" skrt_env_item; do',
+                '        skrt_env_before["${skrt_env_item%%=*}"]='
+                + '"${skrt_env_item#*=}"',
+                "    done < <(env -0)",
+                '    source "${skrt_setup_script}"',
+                '    skrt_env_tmp="${skrt_env_file}.$$"',
+                '    if mkdir -p "${skrt_env_dir}" 2> /dev/null; then',
+                '        while IFS= read -r -d "" skrt_env_item; do',
+                '            skrt_env_name="${skrt_env_item%%=*}"',
+                '            skrt_env_value="${skrt_env_item#*=}"',
+                '            [[ "${skrt_env_name}" =~ '
+                + "^[A-Za-z][A-Za-z0-9_]*$ ]] || continue",
+                '            [[ "${skrt_env_name}" =~ '
+                + "^(OLDPWD|PWD|SHLVL)$ ]] && continue",
+                "            if [ -z "
+                + '"${skrt_env_before[${skrt_env_name}]+x}" ] \\',
+                '                || [ "${skrt_env_before[${skrt_env_name}]}" '
+                + '!= "${skrt_env_value}" ]; then',
+                "                printf 'export %s=%q\\n' "
+                + '"${skrt_env_name}" "${skrt_env_value}"',
+                "            fi",
+                '        done < <(env -0) > "${skrt_env_tmp}" \\',
+                '            && mv -f "${skrt_env_tmp}" "${skrt_env_file}"',
+                "    fi",
+                "    unset skrt_env_before",
+                "fi",
             ]
+        else:
+            lines = [f"source {setup_script}"]
+
+        if appsubconfig.get("print_env", True):
+            lines.append("env")
+        lines.append("")
+
+        return lines
+
+    def get_alg_opts(self, appsubconfig=None):
+        """
+        Return list of option dictionaries, one for each algorithm.
+
+        **Parameter:**
+
+        appsubconfig : dict
+            Data structure containing information extracted
+            during application configuration after
+            any job splitting.
+        """
+        return [appsubconfig["opts"]]
+
+    def options(self):
+        """
+        Define loading of options on worker node.
+
+        Returns lines of Python code defining alg_opts, a list
+        containing one dictionary of options for each algorithm,
+        and kwargs, a dictionary of options for loading patient datasets,
+        from sidecar files.
+        """
+        return ["alg_opts, kwargs = SkrtRunner.load_options()", ""]
+
+    def get_runner_opts(self, appsubconfig=None):
+        """
+        Return dictionary of options, common to all subjobs, for SkrtRunner.
+
+        **Parameter:**
+
+        appsubconfig : dict
+            Data structure containing information extracted
+            during application configuration.
+        """
+        return {
+            "patient_timeout": appsubconfig.get("patient_timeout", 0),
+            "alg_timeouts": self.get_alg_timeouts(appsubconfig=appsubconfig),
+            "pool": appsubconfig.get("local_pool", {}),
+            "alg_dirs": self.get_alg_dirs(appsubconfig=appsubconfig),
+            "alg_deps": self.get_alg_deps(appsubconfig=appsubconfig),
+            "parallel": appsubconfig.get("parallel", ""),
+            "max_workers": appsubconfig.get("max_workers", 0),
+        }
+
+    def get_alg_timeouts(self, appsubconfig=None):
+        """
+        Return list of time limits (seconds), one for each algorithm.
+
+        **Parameter:**
+
+        appsubconfig : dict
+            Data structure containing information extracted
+            during application configuration.
+        """
+        return [appsubconfig.get("timeout", 0)]
+
+    def get_alg_dirs(self, appsubconfig=None):
+        """
+        Return list of output directories, one for each algorithm.
+
+        **Parameter:**
+
+        appsubconfig : dict
+            Data structure containing information extracted
+            during application configuration.
+        """
+        return [appsubconfig.get("output_dir", "")]
+
+    def get_alg_deps(self, appsubconfig=None):
+        """
+        Return list of dependencies, as lists of indices,
+        one for each algorithm.
+
+        **Parameter:**
+
+        appsubconfig : dict
+            Data structure containing information extracted
+            during application configuration.
+        """
+        return [[]]
+
+    def get_runner_outbox(self, appsubconfig=None):
+        """
+        Return list of items written by SkrtRunner, to be returned
+        after application completes.  These include any output
+        directories of algorithms, returned with their contents.
+
+        **Parameter:**
+
+        appsubconfig : dict
+            Data structure containing information extracted
+            during application configuration.
+        """
+        runner_opts = self.get_runner_opts(appsubconfig=appsubconfig)
+        outbox = []
+        if runner_opts["patient_timeout"] or any(runner_opts["alg_timeouts"]):
+            outbox.append(SkrtRunner.SKIPPED_FILE)
+        if runner_opts["parallel"]:
+            outbox.append(SkrtRunner.TIMING_FILE)
+        for alg_dir in runner_opts["alg_dirs"]:
+            if alg_dir and alg_dir not in outbox:
+                outbox.append(alg_dir)
+        return outbox
+
+    def get_subjob_runner_opts(self, job=None, appsubconfig=None):
+        """
+        Return dictionary of subjob-specific options for SkrtRunner.
+
+        If a checkpoint directory is defined for the application,
+        the checkpoint directory for the subjob is a subdirectory
+        named after the subjob's fully qualified identifier.
+
+        **Parameters:**
+
+        job          : GangaCore.Lib.Job.Job
+            Job object with which application is associated.
+
+        appsubconfig : dict
+            Data structure containing information extracted
+            during application configuration after
+            any job splitting.
+        """
+        runner_opts = {}
+        checkpoint_dir = appsubconfig.get("checkpoint_dir", "")
+        if checkpoint_dir:
+            runner_opts["checkpoint_dir"] = os.path.join(
+                checkpoint_dir, job.getFQID(".")
+            )
+        return runner_opts
+
+    def get_support_files(self):
+        """
+        Return list of modules providing worker-side support:
+        SkrtRunner, for running application's algorithms, and
+        SkrtLoader, providing loaders that may be selected
+        as patient class.
+        """
+        return [File(SkrtRunner.__file__), File(SkrtLoader.__file__)]
+
+    def options_box(
+        self,
+        job=None,
+        appsubconfig=None,
+        appmasterconfig=None,
+        jobmasterconfig=None,
+    ):
+        """
+        Define items for passing options to worker node.
+
+        Returns list of items to be transferred for when application runs,
+        for passing subjob options.  If there has been master-level
+        preparation, the options common to all subjobs are already
+        in the master input sandbox, and the only item is a sidecar
+        file recording differences relative to the master options.
+        Otherwise, the items are a sidecar file of complete options,
+        and the modules providing worker-side support.
+
+        **Parameters:**
+
+        job          : GangaCore.Lib.Job.Job
+            Job object with which application is associated.
+
+        appsubconfig : dict
+            Data structure containing information extracted
+            during application configuration after
+            any job splitting.
+
+        appmasterconfig: dict
+            Data structure containing information extracted
+            during application configuration before
+            any job splitting.
+
+        jobmasterconfig: any
+            Data structure containing information extracted
+            during job configuration before any job splitting.
+        """
+        alg_opts = self.get_alg_opts(appsubconfig=appsubconfig)
+        runner_opts = self.get_subjob_runner_opts(
+            job=job, appsubconfig=appsubconfig
         )
 
-        return (lines, inbox)
+        if jobmasterconfig is None:
+            runner_opts = dict(
+                self.get_runner_opts(appsubconfig=appsubconfig),
+                **runner_opts,
+            )
+            return self.get_support_files() + [
+                FileBuffer(
+                    SkrtRunner.SUBJOB_OPTIONS_FILE,
+                    SkrtRunner.encode_options(
+                        alg_opts, appsubconfig["patient_opts"], runner_opts
+                    ),
+                ),
+            ]
+
+        return [
+            FileBuffer(
+                SkrtRunner.SUBJOB_OPTIONS_FILE,
+                SkrtRunner.encode_option_changes(
+                    self.get_alg_opts(appsubconfig=appmasterconfig),
+                    alg_opts,
+                    runner_opts,
+                ),
+            )
+        ]
+
+    def run_lines(self):
+        """
+        Define running of application's algorithms over patient datasets.
+
+        Returns lines of Python code that create a SkrtRunner
+        for the application, with options loaded from sidecar files,
+        and use it to process the patient datasets.
+        """
+        return [
+            "runner = SkrtRunner.SkrtRunner(",
+            "    app, **SkrtRunner.load_runner_options())",
+            "status = runner.run(paths, PatientClass, **kwargs)",
+        ]
 
     def body(self, appsubconfig=None):
         """
@@ -175,6 +659,10 @@ class SkrtAlgLocal(IRuntimeHandler):
         application runs, and initial list of items to be returned
         after application completes.
 
+        Algorithm options are taken from the list alg_opts, and options
+        for loading patient datasets from the dictionary kwargs,
+        both loaded earlier in the wrapper script from sidecar files.
+
         **Parameters:**
 
         appsubconfig : dict
@@ -189,7 +677,6 @@ class SkrtAlgLocal(IRuntimeHandler):
         else:
             alg_module = ""
         alg_name = appsubconfig["alg_name"]
-        opts = appsubconfig["opts"]
         log_level = appsubconfig["log_level"]
 
         inbox = []
@@ -214,21 +701,20 @@ class SkrtAlgLocal(IRuntimeHandler):
         else:
             lines.append("PatientClass = None")
 
-        lines.extend(
-            [
-                f'kwargs = {appsubconfig["patient_opts"]}',
-                "",
-            ]
-        )
+        lines.append("")
 
         lines.extend(
             [
                 f'SkrtAlgClass = getattr({alg_module_name}, "{alg_class}")',
-                f'skrt_alg = SkrtAlgClass(name="{alg_name}", opts={opts}, '
-                f'log_level="{log_level}")',
+                f'skrt_alg = SkrtAlgClass(name="{alg_name}", '
+                f'opts=alg_opts[0], log_level="{log_level}")',
                 "algs = [skrt_alg]",
                 "app = skrt_app.Application(algs=algs)",
-                "status = app.run(paths, PatientClass, **kwargs)",
+            ]
+        )
+        lines.extend(self.run_lines())
+        lines.extend(
+            [
                 "print()",
                 'print(f"Return code: {status.code}")',
                 "if not status.is_ok():",
@@ -240,12 +726,18 @@ class SkrtAlgLocal(IRuntimeHandler):
 
         return (lines, inbox, outbox)
 
-    def tail(self):
+    def tail(self, heredoc=True):
         """
         Define operations needed after application has run.
 
         Returns tail of wrapper script for handling application, and
         extended list of items to be returned after application completes.
+
+        **Parameter:**
+
+        heredoc : bool, default=True
+            If True, terminate the here document containing
+            the Python part of the wrapper script.
         """
         lines = [
             "",
@@ -257,8 +749,9 @@ class SkrtAlgLocal(IRuntimeHandler):
             # 'run_data.close()',
             "print('End time: %s\\n' % time.strftime( time_format ))",
             "sys.exit( status.code )",
-            "PYTHON_END",
         ]
+        if heredoc:
+            lines.append("PYTHON_END")
 
         # outbox = ['execute.dat']
         outbox = []
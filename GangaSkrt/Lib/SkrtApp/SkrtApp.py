@@ -3,10 +3,15 @@
 Define SkrtApp application.
 """
 
+import copy
+import posixpath
+
+from GangaCore.GPIDev.Base.Proxy import stripProxy
 from GangaCore.GPIDev.Lib.File import ShareDir
 from GangaCore.GPIDev.Schema import Schema, SimpleItem, Version
 from GangaCore.GPIDev.Adapters.IPrepareApp import IPrepareApp
 
+from GangaSkrt.Lib.IncrementalMerger.IncrementalMerger import merge_subjob
 from GangaSkrt.Lib.SkrtAlg.SkrtAlg import SkrtAlg
 
 
@@ -45,6 +50,66 @@ class SkrtApp(IPrepareApp):
                 defvalue="",
                 doc="Bash setup script to be sourced on worker node",
             ),
+            "env_cache": SimpleItem(
+                defvalue="",
+                doc="Directory on worker node for caching environment "
+                + "resulting from sourcing setup_script; if empty, "
+                + "setup_script is sourced for every job",
+            ),
+            "env_cache_lifetime": SimpleItem(
+                defvalue=86400,
+                doc="Time (seconds) after which cached environment "
+                + "is recreated",
+            ),
+            "print_env": SimpleItem(
+                defvalue=True,
+                doc="Flag for printing environment after setup",
+            ),
+            "master_wrapper": SimpleItem(
+                defvalue=False,
+                doc="Flag for generating Python wrapper once, at master "
+                + "level, with subjobs parameterised by small "
+                + "parameter files",
+            ),
+            "patient_timeout": SimpleItem(
+                defvalue=0,
+                doc="Time limit (seconds) for processing of each patient; "
+                + "if zero, no limit",
+            ),
+            "checkpoint_dir": SimpleItem(
+                defvalue="",
+                doc="Directory, accessible from worker nodes, for "
+                + "per-subjob checkpoints of patients processed and "
+                + "algorithm states; if empty, no checkpointing",
+            ),
+            "local_pool": SimpleItem(
+                defvalue={},
+                doc="Dictionary of options for running subjobs under "
+                + "memory-aware admission control, in pool sharing "
+                + "resources of node; keys are pool_dir, cpus, "
+                + "cpus_per_subjob, memory, memory_per_subjob, "
+                + "memory_per_patient, max_requeues, poll_interval; "
+                + "if empty, no admission control",
+            ),
+            "dependencies": SimpleItem(
+                defvalue={},
+                doc="Dictionary where each key is an algorithm name, "
+                + "and the associated value is a list of names of "
+                + "algorithms on which it depends",
+            ),
+            "parallel": SimpleItem(
+                defvalue="",
+                doc="Mode for running concurrently, for each patient, "
+                + "algorithms whose dependencies are satisfied: "
+                + "'threads' or 'processes'; if empty, algorithms "
+                + "are run in sequence; if time limits are defined, "
+                + "'processes' is used instead of 'threads'",
+            ),
+            "max_workers": SimpleItem(
+                defvalue=0,
+                doc="Maximum number of algorithms to run concurrently; "
+                + "if zero, no limit",
+            ),
             "is_prepared": SimpleItem(
                 defvalue=None,
                 strict_sequence=0,
@@ -85,6 +150,16 @@ class SkrtApp(IPrepareApp):
         log_level="",
         patient_class=None,
         patient_opts=None,
+        env_cache="",
+        env_cache_lifetime=None,
+        print_env=None,
+        master_wrapper=None,
+        checkpoint_dir="",
+        patient_timeout=None,
+        local_pool=None,
+        dependencies=None,
+        parallel="",
+        max_workers=None,
     ):
         """
         Create instance of SkrtApp.
@@ -108,6 +183,46 @@ class SkrtApp(IPrepareApp):
         if log_level:
             self.log_level = log_level
 
+        if env_cache:
+            assert isinstance(env_cache, str)
+            self.env_cache = env_cache
+
+        if env_cache_lifetime is not None:
+            assert isinstance(env_cache_lifetime, int)
+            self.env_cache_lifetime = env_cache_lifetime
+
+        if print_env is not None:
+            assert isinstance(print_env, bool)
+            self.print_env = print_env
+
+        if master_wrapper is not None:
+            assert isinstance(master_wrapper, bool)
+            self.master_wrapper = master_wrapper
+
+        if checkpoint_dir:
+            assert isinstance(checkpoint_dir, str)
+            self.checkpoint_dir = checkpoint_dir
+
+        if patient_timeout is not None:
+            assert isinstance(patient_timeout, (int, float))
+            self.patient_timeout = patient_timeout
+
+        if local_pool:
+            assert isinstance(local_pool, dict)
+            self.local_pool = local_pool
+
+        if dependencies:
+            assert isinstance(dependencies, dict)
+            self.dependencies = dependencies
+
+        if parallel:
+            assert parallel in ["threads", "processes"]
+            self.parallel = parallel
+
+        if max_workers is not None:
+            assert isinstance(max_workers, int)
+            self.max_workers = max_workers
+
     @classmethod
     def from_application(
         cls, app=None, setup_script="", patient_class=None, patient_opts=None
@@ -149,6 +264,81 @@ class SkrtApp(IPrepareApp):
 
         return skrt_app
 
+    @classmethod
+    def fuse(cls, apps=None, labels=None):
+        """
+        Create instance of SkrtApp that runs the algorithms of several
+        SkrtApp applications in a single pass over the data.
+
+        Each patient dataset is loaded once, and is passed in turn to
+        the algorithms of every application.  The algorithms of each
+        application are run in a subdirectory named after the label
+        of the application, so that outputs are returned in separate
+        subdirectories of the job's output directory.  Outputs for an
+        application may be merged by a merger for which the names of
+        files to be merged include the subdirectory, for example
+        CsvMerger(files=["dose/dose_metrics.csv"]).
+
+        Algorithm names are prefixed by the label of the application,
+        as "<label>.<name>", so that algorithms of different applications
+        are distinct even if their names are the same.  Dependencies
+        between algorithms of each application are combined, with names
+        prefixed in the same way.  The applications must use the same
+        patient class and options for loading patient datasets.  Other
+        properties of the fused application are taken from the first
+        application.  Processing stops for all applications if any
+        algorithm returns a status that isn't ok.
+
+        **Parameters:**
+
+        apps : list, default=None
+            List of SkrtApp applications to be fused.
+
+        labels : list, default=None
+            List of labels, one for each application, used as names
+            of output subdirectories.  If None, the labels are
+            "app0", "app1", ...
+        """
+        apps = [stripProxy(app) for app in (apps or [])]
+        labels = list(labels or [f"app{idx}" for idx in range(len(apps))])
+        assert len(labels) == len(apps), "Number of labels must match apps"
+        assert len(set(labels)) == len(labels), "Labels must be unique"
+
+        if not apps:
+            return cls()
+
+        first = apps[0]
+        for app in apps[1:]:
+            assert (app.patient_class, str(app.patient_opts)) == (
+                first.patient_class,
+                str(first.patient_opts),
+            ), "Fused applications must use same patient loading"
+
+        algs = []
+        dependencies = {}
+        for label, app in zip(labels, apps):
+            for alg in app.algs:
+                alg = copy.deepcopy(stripProxy(alg))
+                alg.alg_name = f"{label}.{alg.alg_name}"
+                alg.output_dir = (
+                    posixpath.join(label, alg.output_dir)
+                    if alg.output_dir
+                    else label
+                )
+                algs.append(alg)
+            for name, deps in (app.dependencies or {}).items():
+                dependencies[f"{label}.{name}"] = [
+                    f"{label}.{dep}" for dep in deps
+                ]
+
+        fused_app = copy.deepcopy(first)
+        fused_app.is_prepared = None
+        fused_app.hash = None
+        fused_app.algs = algs
+        fused_app.dependencies = dependencies
+
+        return fused_app
+
     def configure(self, master_appconfig):
         """
         Perform configuration that takes place after any job splitting.
@@ -180,6 +370,25 @@ class SkrtApp(IPrepareApp):
             "setup_script": self.setup_script,
             "patient_class": self.patient_class,
             "patient_opts": self.patient_opts,
+            "env_cache": self.env_cache,
+            "env_cache_lifetime": self.env_cache_lifetime,
+            "print_env": self.print_env,
+            "master_wrapper": self.master_wrapper,
+            "checkpoint_dir": self.checkpoint_dir,
+            "patient_timeout": self.patient_timeout,
+            "local_pool": self.local_pool,
+            "dependencies": self.dependencies,
+            "parallel": self.parallel,
+            "max_workers": self.max_workers,
         }
 
         return (False, app)
+
+    def postprocess(self):
+        """
+        Perform postprocessing, on completion of job or subjob.
+
+        For a subjob, outputs are folded into the merged outputs
+        of any incremental mergers of the master job.
+        """
+        merge_subjob(self.getJobObject())
@@ -9,6 +9,7 @@ from GangaCore.GPIDev.Lib.File import File
 from GangaCore.Utility.files import fullpath
 
 from GangaSkrt.Lib.SkrtAlg.SkrtAlgLocal import SkrtAlgLocal
+from GangaSkrt.Lib.SkrtRunner import SkrtRunner
 
 
 class SkrtAppLocal(SkrtAlgLocal):
@@ -19,6 +20,68 @@ class SkrtAppLocal(SkrtAlgLocal):
     GangaCore.GPIDev.Adapters.IRuntimeHandler.IRuntimeHandler
     """
 
+    def get_alg_opts(self, appsubconfig=None):
+        """
+        Return list of option dictionaries, one for each algorithm.
+
+        Parameter
+        ---------
+        appsubconfig : dict
+            Data structure containing information extracted
+            during application configuration after
+            any job splitting.
+        """
+        return [skrt_alg.opts for skrt_alg in appsubconfig["algs"]]
+
+    def get_alg_timeouts(self, appsubconfig=None):
+        """
+        Return list of time limits (seconds), one for each algorithm.
+
+        Parameter
+        ---------
+        appsubconfig : dict
+            Data structure containing information extracted
+            during application configuration.
+        """
+        return [
+            getattr(skrt_alg, "timeout", 0)
+            for skrt_alg in appsubconfig["algs"]
+        ]
+
+    def get_alg_dirs(self, appsubconfig=None):
+        """
+        Return list of output directories, one for each algorithm.
+
+        Parameter
+        ---------
+        appsubconfig : dict
+            Data structure containing information extracted
+            during application configuration.
+        """
+        return [
+            getattr(skrt_alg, "output_dir", "")
+            for skrt_alg in appsubconfig["algs"]
+        ]
+
+    def get_alg_deps(self, appsubconfig=None):
+        """
+        Return list of dependencies, as lists of indices,
+        one for each algorithm.
+
+        Raises ValueError if the declared dependencies can't be
+        satisfied, so that errors are reported at submission.
+
+        Parameter
+        ---------
+        appsubconfig : dict
+            Data structure containing information extracted
+            during application configuration.
+        """
+        return SkrtRunner.get_alg_deps(
+            [skrt_alg.alg_name for skrt_alg in appsubconfig["algs"]],
+            appsubconfig.get("dependencies", {}),
+        )
+
     def body(self, appsubconfig=None):
         """
         Define operations needed to run application.
@@ -66,14 +129,9 @@ class SkrtAppLocal(SkrtAlgLocal):
         else:
             lines.append("PatientClass = None")
 
-        lines.extend(
-            [
-                f'kwargs = {appsubconfig["patient_opts"]}',
-                "",
-            ]
-        )
+        lines.append("")
 
-        for skrt_alg in algs:
+        for idx, skrt_alg in enumerate(algs):
             if skrt_alg.alg_module:
                 alg_module_name = os.path.splitext(
                     os.path.basename(skrt_alg.alg_module)
@@ -86,7 +144,7 @@ class SkrtAppLocal(SkrtAlgLocal):
                     f"SkrtAlgClass = getattr({alg_module_name}, "
                     + f'"{skrt_alg.alg_class}")',
                     f'skrt_alg = SkrtAlgClass(name="{skrt_alg.alg_name}", '
-                    + f"opts = {skrt_alg.opts}, "
+                    + f"opts = alg_opts[{idx}], "
                     + f'log_level="{skrt_alg.log_level}")',
                     "algs.append(skrt_alg)",
                 ]
@@ -96,7 +154,11 @@ class SkrtAppLocal(SkrtAlgLocal):
                 "",
                 "app = skrt_app.Application"
                 + f'(algs=algs, log_level="{log_level}")',
-                "status = app.run(paths, PatientClass, **kwargs)",
+            ]
+        )
+        lines.extend(self.run_lines())
+        lines.extend(
+            [
                 "print()",
                 'print(f"Return code: {status.code}")',
                 "if not status.is_ok():",
@@ -0,0 +1,1119 @@
+# File: GangaSkrt/Lib/SkrtLoader/SkrtLoader.py
+"""
+Provide worker-side loaders of patient datasets.
+
+This module has no dependency on Ganga, and is shipped in the input
+sandbox of jobs for SkrtAlg and SkrtApp applications, alongside the
+SkrtRunner module.  Its loaders are selected by setting an application's
+patient_class to the qualified name of a loader class, for example
+"SkrtLoader.PrefetchPatient", with options for the loader given in
+patient_opts.
+
+Each loader wraps another patient class, identified by the qualified
+name given as the "patient_class" item of patient_opts, and defaulting
+to skrt.patient.Patient.  Options not used by the loader are passed to
+the constructor of the wrapped class.  Creating an instance of a loader
+returns an instance of the wrapped class, so that algorithms receive
+the same patient objects as without the loader.  Loaders may be nested,
+by setting the wrapped class of one loader to be another loader.
+
+A loader may define a class method schedule(paths, **kwargs), which
+SkrtRunner calls, with the paths of the patient datasets to be processed,
+before processing of the first dataset.
+
+The loaders provided are:
+    - PrefetchPatient: reads ahead files of upcoming patient datasets;
+    - CachedPatient: caches decoded images on node-local disk;
+    - IndexedPatient: reads DICOM headers from a header index,
+      built ahead of time.
+
+NumPy, pydicom and scikit-rt are imported only when needed, so that the module
+can be imported by the runtime handlers without them.
+"""
+
+import copy
+import gzip
+import hashlib
+import importlib
+import inspect
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+import weakref
+
+# Suffixes of sizes, in order of increasing powers of 1024.
+SIZE_UNITS = "KMGT"
+
+# Name of header index, when kept in patient dataset's directory.
+INDEX_FILE = ".skrt_header_index.pkl.gz"
+
+# Version of header-index format.
+INDEX_VERSION = 1
+
+# Prefetchers created, which are paused while processes are forked,
+# and prefetchers paused for a fork in progress.
+PREFETCHERS = weakref.WeakSet()
+PAUSED = []
+
+
+def parse_size(size=0):
+    """
+    Return number of bytes represented by a size.
+
+    Parameter
+    ---------
+    size : int/float/str, default=0
+        Size in bytes, or string giving size with optional suffix
+        "K", "M", "G" or "T" (powers of 1024), for example "4G".
+    """
+    if isinstance(size, str):
+        size = size.strip().upper().rstrip("B")
+        factor = 1
+        if size and size[-1] in SIZE_UNITS:
+            factor = 1024 ** (SIZE_UNITS.index(size[-1]) + 1)
+            size = size[:-1]
+        return int(float(size or 0) * factor)
+    return int(size or 0)
+
+
+def get_class(patient_class=None):
+    """
+    Return class identified by qualified name.
+
+    Parameter
+    ---------
+    patient_class : str/class, default=None
+        Qualified name of class, or class.  If None,
+        skrt.patient.Patient is returned.
+    """
+    if patient_class is None:
+        from skrt.patient import Patient
+
+        return Patient
+
+    if isinstance(patient_class, str):
+        module_name, class_name = patient_class.rsplit(".", 1)
+        return getattr(importlib.import_module(module_name), class_name)
+
+    return patient_class
+
+
+def get_files(path=""):
+    """
+    Return sorted list of paths to files at or below a path.
+
+    Parameter
+    ---------
+    path : str, default=""
+        Path to file or directory.
+    """
+    path = str(path)
+    if not os.path.isdir(path):
+        return [path] if os.path.isfile(path) else []
+
+    files = []
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        files.extend(os.path.join(dirpath, name) for name in sorted(filenames))
+    return files
+
+
+class Prefetcher:
+    """
+    Background reader of files of upcoming patient datasets.
+
+    While the current dataset is processed, a daemon thread reads
+    the files of the next datasets, so that they're in the page cache
+    when needed.  On network filesystems, this allows the latency
+    of file reads to overlap with processing.  Data read are discarded,
+    so that the memory used by the thread itself is only that of
+    a read buffer.
+
+    Reading stops at a configurable depth, in number of datasets, ahead
+    of the current dataset, and when the amount of data read ahead of
+    the current dataset reaches a configurable limit, beyond which
+    data read ahead would risk being evicted from the page cache
+    before use.
+
+    The reading thread is paused while the process is forked, for
+    example when SkrtRunner runs algorithms in child processes, so that
+    the thread holds no lock when the child process is created.  Reading
+    ahead doesn't continue in the child process.
+    """
+
+    def __init__(
+        self,
+        paths=None,
+        depth=1,
+        memory=0,
+        mode="read",
+        header_size="64K",
+        chunk_size="1M",
+    ):
+        """
+        Create instance of Prefetcher, and start reading thread.
+
+        Parameters
+        ----------
+        paths : list, default=None
+            Paths to patient datasets, in order of processing.
+
+        depth : int, default=1
+            Number of datasets to be read ahead of current dataset.
+
+        memory : int/str, default=0
+            Maximum amount of data (bytes, or string with unit suffix)
+            to be read ahead of current dataset.  If zero, no limit
+            is applied.
+
+        mode : str, default="read"
+            Mode of reading ahead: "read" to read files in full;
+            "headers" to read only the first header_size bytes of
+            each file, where DICOM headers are found.
+
+        header_size : int/str, default="64K"
+            Number of bytes to read from each file in "headers" mode.
+
+        chunk_size : int/str, default="1M"
+            Size of read buffer.
+        """
+        self.paths = [str(path) for path in (paths or [])]
+        self.index = {path: idx for idx, path in enumerate(self.paths)}
+        self.depth = depth
+        self.memory = parse_size(memory)
+        self.mode = mode
+        self.header_size = parse_size(header_size)
+        self.buffer = bytearray(parse_size(chunk_size))
+        self.current = -1
+        self.warmed = {}
+        self.partial = {}
+        self.blocked = False
+        self.stopped = False
+        self.condition = threading.Condition()
+        self.fork_lock = threading.Lock()
+        self.thread = threading.Thread(
+            target=self.loop, name="SkrtPrefetcher", daemon=True
+        )
+        PREFETCHERS.add(self)
+        self.thread.start()
+
+    def advance(self, path=""):
+        """
+        Record that dataset is now being processed.
+
+        Parameter
+        ---------
+        path : str, default=""
+            Path to dataset being processed.
+        """
+        with self.condition:
+            self.current = self.index.get(str(path), self.current)
+            for idx in list(self.warmed):
+                if idx <= self.current:
+                    del self.warmed[idx]
+                    self.partial.pop(idx, None)
+            self.blocked = False
+            self.condition.notify()
+
+    def stop(self):
+        """
+        Stop reading thread.
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.thread.join()
+
+    def get_in_flight(self):
+        """
+        Return amount of data (bytes) read ahead of current dataset.
+
+        To be called with condition acquired.
+        """
+        return sum(self.warmed.values())
+
+    def get_next(self):
+        """
+        Return index of next dataset to be read, or None.
+
+        To be called with condition acquired.
+        """
+        if self.blocked:
+            return None
+        last = min(len(self.paths), self.current + 1 + self.depth)
+        for idx in range(self.current + 1, last):
+            if idx not in self.warmed or idx in self.partial:
+                return idx
+        return None
+
+    def loop(self):
+        """
+        Read datasets ahead of current dataset, until stopped.
+        """
+        while True:
+            with self.condition:
+                idx = self.get_next()
+                while idx is None and not self.stopped:
+                    self.condition.wait()
+                    idx = self.get_next()
+                if self.stopped:
+                    return
+                self.warmed.setdefault(idx, 0)
+                start = self.partial.pop(idx, 0)
+            self.warm(idx, start)
+
+    def warm(self, idx=0, start=0):
+        """
+        Read files of dataset, stopping if dataset is reached by
+        processing, or if limit on data read ahead is reached.
+        In the latter case, reading is blocked until processing
+        moves on, then resumes from the first file not read.
+
+        Parameters
+        ----------
+        idx : int, default=0
+            Index of dataset to be read.
+
+        start : int, default=0
+            Index of first file of dataset to be read.
+        """
+        with self.fork_lock:
+            files = get_files(self.paths[idx])
+        for pos in range(start, len(files)):
+            try:
+                size = os.path.getsize(files[pos])
+            except OSError:
+                continue
+            if "headers" == self.mode:
+                size = min(size, self.header_size)
+
+            with self.condition:
+                if self.stopped or idx <= self.current:
+                    return
+                in_flight = self.get_in_flight()
+                if self.memory and in_flight and (
+                    in_flight + size > self.memory
+                ):
+                    self.partial[idx] = pos
+                    self.blocked = True
+                    return
+                self.warmed[idx] += size
+
+            self.read(files[pos], size)
+
+    def read(self, path="", size=0):
+        """
+        Read bytes from file, discarding data read.
+
+        Parameters
+        ----------
+        path : str, default=""
+            Path to file.
+
+        size : int, default=0
+            Number of bytes to read.
+        """
+        view = memoryview(self.buffer)
+        try:
+            with open(path, "rb", buffering=0) as in_file:
+                while size > 0:
+                    with self.fork_lock:
+                        n_read = in_file.readinto(
+                            view[: min(size, len(view))]
+                        )
+                    if not n_read:
+                        break
+                    size -= n_read
+        except OSError:
+            pass
+
+
+def pause_prefetchers():
+    """
+    Pause reading threads of prefetchers, before process is forked.
+
+    Each thread is allowed to complete any read in progress, so that
+    it holds no lock when the process is forked.
+    """
+    PAUSED[:] = list(PREFETCHERS)
+    for prefetcher in PAUSED:
+        prefetcher.fork_lock.acquire()
+        prefetcher.condition.acquire()
+
+
+def resume_prefetchers(child=False):
+    """
+    Resume reading threads of prefetchers, after process is forked.
+
+    Parameter
+    ---------
+    child : bool, default=False
+        If True, prefetchers are being resumed in the child process,
+        where reading threads don't exist, so are marked as stopped.
+    """
+    for prefetcher in PAUSED:
+        if child:
+            prefetcher.stopped = True
+        prefetcher.condition.release()
+        prefetcher.fork_lock.release()
+    PAUSED.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(
+        before=pause_prefetchers,
+        after_in_parent=resume_prefetchers,
+        after_in_child=lambda: resume_prefetchers(child=True),
+    )
+
+
+class PrefetchPatient:
+    """
+    Loader that reads ahead files of upcoming patient datasets.
+
+    Options, given in patient_opts, are:
+        - patient_class: qualified name of wrapped patient class;
+        - prefetch_depth: number of datasets to read ahead (default 1);
+        - prefetch_memory: maximum amount of data to read ahead, as
+          number of bytes, or string with unit suffix (default 0,
+          meaning no limit);
+        - prefetch_mode: "read" to read files in full (default), or
+          "headers" to read only the start of each file.
+    Reading ahead starts when schedule() is called with the paths
+    to be processed.  When run via Ganga, this is done by SkrtRunner.
+    """
+
+    # Prefetcher for the datasets scheduled.
+    prefetcher = None
+
+    @classmethod
+    def schedule(
+        cls,
+        paths=None,
+        prefetch_depth=1,
+        prefetch_memory=0,
+        prefetch_mode="read",
+        **kwargs,
+    ):
+        """
+        Start reading ahead files of patient datasets.
+
+        Parameters
+        ----------
+        paths : list, default=None
+            Paths to patient datasets, in order of processing.
+
+        prefetch_depth, prefetch_memory, prefetch_mode
+            Options for reading ahead, as described for class.
+
+        **kwargs
+            Options for wrapped patient class.  If this defines
+            a schedule() method, this is also called.
+        """
+        if cls.prefetcher is not None:
+            cls.prefetcher.stop()
+        cls.prefetcher = Prefetcher(
+            paths, prefetch_depth, prefetch_memory, prefetch_mode
+        )
+
+        patient_class = get_class(kwargs.pop("patient_class", None))
+        if hasattr(patient_class, "schedule"):
+            patient_class.schedule(paths, **kwargs)
+
+    def __new__(
+        cls,
+        path="",
+        patient_class=None,
+        prefetch_depth=1,
+        prefetch_memory=0,
+        prefetch_mode="read",
+        **kwargs,
+    ):
+        """
+        Return instance of wrapped patient class for dataset,
+        after signalling to prefetcher that dataset is being processed.
+
+        Parameters
+        ----------
+        path : str, default=""
+            Path to patient dataset.
+
+        patient_class : str, default=None
+            Qualified name of wrapped patient class.  If None,
+            skrt.patient.Patient is used.
+
+        prefetch_depth, prefetch_memory, prefetch_mode
+            Options for reading ahead, used in call to schedule().
+
+        **kwargs
+            Options to be passed to constructor of wrapped patient class.
+        """
+        if cls.prefetcher is not None:
+            cls.prefetcher.advance(path)
+        return get_class(patient_class)(path, **kwargs)
+
+
+def get_digest(path="", exclude=""):
+    """
+    Return digest of names, sizes and modification times of files
+    at or below a path, or None if there are no files.
+
+    Parameters
+    ----------
+    path : str, default=""
+        Path to file or directory.
+
+    exclude : str, default=""
+        Path to file to be excluded from digest.
+    """
+    files = [
+        file_path
+        for file_path in get_files(path)
+        if not exclude or os.path.abspath(file_path) != exclude
+    ]
+    if not files:
+        return None
+
+    digest = hashlib.md5()
+    for file_path in files:
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        digest.update(
+            f"{file_path}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode()
+        )
+    return digest.hexdigest()
+
+
+class ImageCache:
+    """
+    Node-local cache of decoded images.
+
+    Each entry of the cache is a directory, named after a key derived
+    from the path of an image's source files, and from their sizes and
+    modification times, so that entries for modified sources are never
+    used.  An entry holds:
+        - one NumPy file for each array attribute set on loading,
+          for example the voxel data;
+        - META_FILE, a pickle of the other attributes set on loading,
+          such as geometry metadata.
+    When an entry is used, arrays are opened as copy-on-write memory
+    maps, so that no data are copied until accessed, and modifications
+    made by algorithms aren't written to the cache.
+
+    The modification time of an entry's directory is updated on use.
+    When the size of the cache exceeds a limit, entries are removed
+    in order of least-recent use.  Entries are written to a temporary
+    directory, then renamed, so that subjobs sharing a node may use
+    the cache concurrently.
+    """
+
+    # Name of file of non-array attributes, in each cache entry.
+    META_FILE = "meta.pkl"
+
+    def __init__(self, cache_dir="", cache_size="20G"):
+        """
+        Create instance of ImageCache.
+
+        Parameters
+        ----------
+        cache_dir : str, default=""
+            Node-local directory for cache.  If empty, the
+            subdirectory "skrt_image_cache" of the system's
+            temporary directory is used.
+
+        cache_size : int/str, default="20G"
+            Maximum size of cache (bytes, or string with unit suffix).
+            If zero, no limit is applied.
+        """
+        self.cache_dir = os.path.expanduser(
+            cache_dir
+            or os.path.join(tempfile.gettempdir(), "skrt_image_cache")
+        )
+        self.cache_size = parse_size(cache_size)
+        self.hits = 0
+        self.misses = 0
+
+    def get_key(self, path=""):
+        """
+        Return key for image with source files at path, or None
+        if there are no source files.
+
+        Parameter
+        ---------
+        path : str, default=""
+            Path to image's source files.
+        """
+        if not isinstance(path, (str, os.PathLike)):
+            return None
+        path = os.path.abspath(path)
+        digest = get_digest(path)
+        if digest is None:
+            return None
+        return hashlib.md5(f"{path}\0{digest}".encode()).hexdigest()
+
+    def restore(self, key="", image=None):
+        """
+        Set attributes of image from cache entry.
+
+        Returns True if the entry exists and is read, or False otherwise.
+
+        Parameters
+        ----------
+        key : str, default=""
+            Key of cache entry.
+
+        image : skrt.image.Image, default=None
+            Image for which attributes are to be set.
+        """
+        import numpy as np
+
+        entry = os.path.join(self.cache_dir, key)
+        try:
+            with open(os.path.join(entry, self.META_FILE), "rb") as in_file:
+                attributes = pickle.load(in_file)
+            for name in os.listdir(entry):
+                if name.endswith(".npy"):
+                    attributes[name[:-4]] = np.load(
+                        os.path.join(entry, name), mmap_mode="c"
+                    )
+            os.utime(entry)
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            return False
+
+        for attribute, value in attributes.items():
+            setattr(image, attribute, value)
+        self.hits += 1
+
+        return True
+
+    def store(self, key="", attributes=None):
+        """
+        Write attributes to cache entry, then apply size limit.
+
+        Parameters
+        ----------
+        key : str, default=""
+            Key of cache entry.
+
+        attributes : dict, default=None
+            Dictionary of attributes to be cached.
+        """
+        import numpy as np
+
+        self.misses += 1
+        entry = os.path.join(self.cache_dir, key)
+        if os.path.exists(entry):
+            return
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_entry = tempfile.mkdtemp(prefix=f".{key}.", dir=self.cache_dir)
+        try:
+            meta = {}
+            for attribute, value in (attributes or {}).items():
+                if isinstance(value, np.ndarray) and value.dtype != object:
+                    np.save(
+                        os.path.join(tmp_entry, f"{attribute}.npy"),
+                        np.ascontiguousarray(value),
+                    )
+                else:
+                    meta[attribute] = value
+            with open(os.path.join(tmp_entry, self.META_FILE), "wb") as out:
+                pickle.dump(meta, out, protocol=pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_entry, entry)
+        except (OSError, AttributeError, pickle.PicklingError, TypeError):
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            return
+
+        self.evict()
+
+    def evict(self):
+        """
+        Remove least-recently used entries until cache is within size limit.
+        """
+        if not self.cache_size:
+            return
+
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir, name)
+            if name.startswith("."):
+                continue
+            try:
+                size = sum(
+                    os.path.getsize(os.path.join(entry, item))
+                    for item in os.listdir(entry)
+                )
+                entries.append((os.path.getmtime(entry), size, entry))
+            except OSError:
+                continue
+            total += size
+
+        for _, size, entry in sorted(entries):
+            if total <= self.cache_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def install(self):
+        """
+        Replace load() method of skrt.image.Image by a method
+        that uses the cache.  Subclasses that don't override
+        load() also use the cache.
+        """
+        from skrt.image import Image
+
+        load = getattr(Image.load, "uncached_load", Image.load)
+        cache = self
+
+        def cached_load(image, *args, **kwargs):
+            force = kwargs.get("force", args[0] if args else False)
+            if getattr(image, "data", None) is not None and not force:
+                return load(image, *args, **kwargs)
+
+            key = cache.get_key(getattr(image, "path", None))
+            if key is not None and cache.restore(key, image):
+                return None
+
+            before = dict(vars(image))
+            result = load(image, *args, **kwargs)
+            if key is not None and getattr(image, "data", None) is not None:
+                cache.store(
+                    key,
+                    {
+                        attribute: value
+                        for attribute, value in vars(image).items()
+                        if attribute not in before
+                        or before[attribute] is not value
+                    },
+                )
+            return result
+
+        cached_load.uncached_load = load
+        Image.load = cached_load
+
+
+class CachedPatient:
+    """
+    Loader that caches decoded images on node-local disk.
+
+    Options, given in patient_opts, are:
+        - patient_class: qualified name of wrapped patient class;
+        - cache_dir: node-local directory for cache (default:
+          subdirectory "skrt_image_cache" of system's temporary
+          directory);
+        - cache_size: maximum size of cache, as number of bytes,
+          or string with unit suffix (default "20G").
+    When an image of a patient dataset is loaded, the attributes set
+    by decoding are stored in the cache, and later loads of the same
+    source files, by any job on the node, use memory maps of the cached
+    arrays instead of decoding.  See ImageCache for details.
+    """
+
+    # Cache in use.
+    cache = None
+
+    @classmethod
+    def schedule(cls, paths=None, **kwargs):
+        """
+        Prepare cache, and pass paths to wrapped patient class,
+        if this defines a schedule() method.
+
+        Parameters
+        ----------
+        paths : list, default=None
+            Paths to patient datasets, in order of processing.
+
+        **kwargs
+            Options for loader and for wrapped patient class,
+            as for constructor.
+        """
+        kwargs = cls.get_cache(**kwargs)
+        patient_class = get_class(kwargs.pop("patient_class", None))
+        if hasattr(patient_class, "schedule"):
+            patient_class.schedule(paths, **kwargs)
+
+    @classmethod
+    def get_cache(cls, cache_dir="", cache_size="20G", **kwargs):
+        """
+        Create and install cache, if not already done.
+
+        Returns dictionary of options not used for cache.
+
+        Parameters
+        ----------
+        cache_dir, cache_size
+            Options for cache, as described for class.
+
+        **kwargs
+            Options for wrapped patient class.
+        """
+        if cls.cache is None:
+            cls.cache = ImageCache(cache_dir, cache_size)
+            cls.cache.install()
+        return kwargs
+
+    def __new__(cls, path="", patient_class=None, **kwargs):
+        """
+        Return instance of wrapped patient class for dataset,
+        after ensuring that cache is installed.
+
+        Parameters
+        ----------
+        path : str, default=""
+            Path to patient dataset.
+
+        patient_class : str, default=None
+            Qualified name of wrapped patient class.  If None,
+            skrt.patient.Patient is used.
+
+        **kwargs
+            Options for cache, as described for class, and options
+            to be passed to constructor of wrapped patient class.
+        """
+        kwargs = cls.get_cache(**kwargs)
+        return get_class(patient_class)(path, **kwargs)
+
+
+def get_index_path(path="", index_dir=""):
+    """
+    Return path to header index for patient dataset.
+
+    Parameters
+    ----------
+    path : str, default=""
+        Path to patient dataset.
+
+    index_dir : str, default=""
+        Directory where header indexes are kept.  If empty, the index
+        is kept in the dataset directory, as INDEX_FILE.
+    """
+    path = os.path.abspath(str(path))
+    if not index_dir:
+        return os.path.join(path, INDEX_FILE)
+    name = hashlib.md5(path.encode()).hexdigest()
+    return os.path.join(os.path.expanduser(index_dir), f"{name}.pkl.gz")
+
+
+def build_index(path="", tags=None, index_dir=""):
+    """
+    Build header index for patient dataset.
+
+    The index records, in file order, the DICOM header of each file
+    of the dataset, read without pixel data, and optionally restricted
+    to selected tags, together with a digest of the names, sizes and
+    modification times of the dataset's files, used to detect that
+    the index is stale.  Files that can't be read as DICOM aren't
+    indexed.  Returns tuple of path to index, and numbers of files
+    indexed and not indexed.
+
+    Parameters
+    ----------
+    path : str, default=""
+        Path to patient dataset.
+
+    tags : list, default=None
+        Keywords of tags to be included in index, for example
+        ["Modality", "SeriesInstanceUID"].  If None, all tags are
+        included.
+
+    index_dir : str, default=""
+        Directory where header indexes are kept.  If empty, the index
+        is written in the dataset directory, as INDEX_FILE.
+    """
+    import pydicom
+
+    path = os.path.abspath(str(path))
+    index_path = get_index_path(path, index_dir)
+    files = [
+        file_path
+        for file_path in get_files(path)
+        if os.path.abspath(file_path) != index_path
+    ]
+    headers = []
+    n_skipped = 0
+    for file_path in files:
+        try:
+            header = pydicom.dcmread(
+                file_path,
+                stop_before_pixels=True,
+                specific_tags=tags or None,
+            )
+        except (OSError, pydicom.errors.InvalidDicomError):
+            n_skipped += 1
+            continue
+        headers.append((os.path.relpath(file_path, path), header))
+
+    index = {
+        "version": INDEX_VERSION,
+        "path": path,
+        "digest": get_digest(path, exclude=index_path),
+        "tags": list(tags or []),
+        "headers": headers,
+    }
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    tmp_path = f"{index_path}.{os.getpid()}"
+    with gzip.open(tmp_path, "wb", compresslevel=1) as out_file:
+        pickle.dump(index, out_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, index_path)
+
+    return (index_path, len(headers), n_skipped)
+
+
+def build_indexes(paths=None, tags=None, index_dir="", workers=0):
+    """
+    Build header indexes for patient datasets, in parallel.
+
+    Returns list of tuples, one for each dataset, as returned
+    by build_index(), or with error message in place of numbers
+    of files if indexing fails.
+
+    Parameters
+    ----------
+    paths : list, default=None
+        Paths to patient datasets.
+
+    tags, index_dir
+        Options for indexing, as for build_index().
+
+    workers : int, default=0
+        Number of worker processes.  If zero, the number of CPUs
+        is used.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    paths = list(paths or [])
+    results = []
+    with ProcessPoolExecutor(max_workers=workers or None) as executor:
+        futures = [
+            executor.submit(build_index, path, tags, index_dir)
+            for path in paths
+        ]
+        for path, future in zip(paths, futures):
+            try:
+                results.append(future.result())
+            except Exception as error:
+                results.append((get_index_path(path, index_dir), str(error)))
+
+    return results
+
+
+def load_index(path="", index_dir=""):
+    """
+    Return tuple of dictionary mapping absolute file paths to DICOM
+    headers, from header index for patient dataset, and list of keywords
+    of tags indexed (empty if all tags are indexed), or None if there's
+    no index, or if the index is stale.
+
+    Parameters
+    ----------
+    path : str, default=""
+        Path to patient dataset.
+
+    index_dir : str, default=""
+        Directory where header indexes are kept, as for build_index().
+    """
+    path = os.path.abspath(str(path))
+    index_path = get_index_path(path, index_dir)
+    try:
+        with gzip.open(index_path, "rb") as in_file:
+            index = pickle.load(in_file)
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+        return None
+
+    if (
+        index.get("version") != INDEX_VERSION
+        or index.get("path") != path
+        or index.get("digest") != get_digest(path, exclude=index_path)
+    ):
+        return None
+
+    headers = {
+        os.path.join(path, rel_path): header
+        for rel_path, header in index["headers"]
+    }
+    return (headers, index["tags"])
+
+
+def get_keywords(tags=None):
+    """
+    Return set of keywords for DICOM tags, or None if a tag is unknown.
+
+    Parameters
+    ----------
+    tags : list, default=None
+        Tags, each given as a keyword, or in any form accepted
+        by pydicom.tag.Tag(), such as an integer or a tuple of
+        group and element numbers.
+    """
+    import pydicom
+
+    keywords = set()
+    for tag in tags or []:
+        if not isinstance(tag, str):
+            try:
+                tag = pydicom.datadict.keyword_for_tag(pydicom.tag.Tag(tag))
+            except (OverflowError, TypeError, ValueError):
+                return None
+        if not tag:
+            return None
+        keywords.add(tag)
+    return keywords
+
+
+class IndexedPatient:
+    """
+    Loader that reads DICOM headers from a header index.
+
+    Header indexes are built ahead of time, for example using the script
+    create_header_index, which calls build_indexes().  While an instance
+    of the wrapped patient class is created, calls to pydicom.dcmread()
+    for files in the index return a copy of the indexed header, instead
+    of reading the file, if the call is one that the header can satisfy:
+    with stop_before_pixels set, and, if the index is restricted to
+    selected tags, with specific_tags all included in the index.  Other
+    calls, for example to read pixel data when an image is loaded,
+    read the file.  If the index for a dataset
+    is missing or stale, the patient object is created by normal loading.
+
+    Options, given in patient_opts, are:
+        - patient_class: qualified name of wrapped patient class;
+        - index_dir: directory where header indexes are kept (default:
+          each index kept in the dataset directory).
+    """
+
+    # Headers of current dataset, mapped from absolute file paths,
+    # and keywords of tags indexed (empty if all tags are indexed).
+    headers = None
+    tags = []
+
+    # Numbers of datasets loaded with and without index.
+    n_indexed = 0
+    n_unindexed = 0
+
+    @classmethod
+    def schedule(cls, paths=None, index_dir="", **kwargs):
+        """
+        Install reader of indexed headers, and pass paths to wrapped
+        patient class, if this defines a schedule() method.
+
+        Parameters
+        ----------
+        paths : list, default=None
+            Paths to patient datasets, in order of processing.
+
+        index_dir : str, default=""
+            Directory where header indexes are kept.
+
+        **kwargs
+            Options for wrapped patient class.
+        """
+        cls.install()
+        patient_class = get_class(kwargs.pop("patient_class", None))
+        if hasattr(patient_class, "schedule"):
+            patient_class.schedule(paths, **kwargs)
+
+    @classmethod
+    def install(cls):
+        """
+        Replace pydicom.dcmread(), including references to it imported
+        by scikit-rt modules, by a function that reads indexed headers
+        where available, and where the call can be satisfied
+        by an indexed header.
+        """
+        import pydicom
+
+        dcmread = getattr(
+            pydicom.dcmread, "unindexed_dcmread", pydicom.dcmread
+        )
+        if dcmread is not pydicom.dcmread:
+            return
+
+        signature = inspect.signature(dcmread)
+
+        def indexed_dcmread(fp, *args, **kwargs):
+            if cls.headers and isinstance(fp, (str, os.PathLike)):
+                header = cls.headers.get(os.path.abspath(fp))
+                if header is not None and cls.is_indexed(
+                    signature, fp, *args, **kwargs
+                ):
+                    return copy.deepcopy(header)
+            return dcmread(fp, *args, **kwargs)
+
+        indexed_dcmread.unindexed_dcmread = dcmread
+        pydicom.dcmread = indexed_dcmread
+        pydicom.filereader.dcmread = indexed_dcmread
+        for name, module in list(sys.modules.items()):
+            if name.split(".")[0] == "skrt" and (
+                getattr(module, "dcmread", None) is dcmread
+            ):
+                module.dcmread = indexed_dcmread
+
+    @classmethod
+    def is_indexed(cls, signature=None, *args, **kwargs):
+        """
+        Return True if call to pydicom.dcmread() can be satisfied by
+        an indexed header, and False otherwise.
+
+        Parameters
+        ----------
+        signature : inspect.Signature, default=None
+            Signature of pydicom.dcmread().
+
+        *args, **kwargs
+            Arguments of call to pydicom.dcmread().
+        """
+        try:
+            arguments = signature.bind(*args, **kwargs).arguments
+        except TypeError:
+            return False
+        if not arguments.get("stop_before_pixels"):
+            return False
+        if not cls.tags:
+            return True
+
+        # Index restricted to selected tags: only requests for a subset
+        # of these tags can be satisfied.
+        specific_tags = arguments.get("specific_tags")
+        if not specific_tags:
+            return False
+        keywords = get_keywords(specific_tags)
+        return keywords is not None and keywords.issubset(cls.tags)
+
+    def __new__(cls, path="", patient_class=None, index_dir="", **kwargs):
+        """
+        Return instance of wrapped patient class for dataset,
+        created using header index if available and up to date.
+
+        Parameters
+        ----------
+        path : str, default=""
+            Path to patient dataset.
+
+        patient_class : str, default=None
+            Qualified name of wrapped patient class.  If None,
+            skrt.patient.Patient is used.
+
+        index_dir : str, default=""
+            Directory where header indexes are kept.
+
+        **kwargs
+            Options to be passed to constructor of wrapped patient class.
+        """
+        cls.install()
+        cls.headers, cls.tags = load_index(path, index_dir) or (None, [])
+        if cls.headers is None:
+            cls.n_unindexed += 1
+            print(f"No up-to-date header index for {path}: normal loading")
+        else:
+            cls.n_indexed += 1
+        try:
+            return get_class(patient_class)(path, **kwargs)
+        finally:
+            cls.headers = None
+            cls.tags = []
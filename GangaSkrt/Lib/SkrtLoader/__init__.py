@@ -0,0 +1,4 @@
+# File: GangaSkrt/Lib/SkrtLoader/__init__.py
+"""Provide worker-side loaders of patient datasets."""
+
+from GangaSkrt.Lib.SkrtLoader import SkrtLoader
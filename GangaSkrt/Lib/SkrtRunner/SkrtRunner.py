@@ -0,0 +1,2007 @@
+# File: GangaSkrt/Lib/SkrtRunner/SkrtRunner.py
+"""
+Provide worker-side support for running scikit-rt applications.
+
+This module has no dependency on Ganga, and is shipped in the input
+sandbox of jobs for SkrtAlg and SkrtApp applications, where it is imported
+by the wrapper script.  It is also imported by the runtime handlers,
+so that options are written and read by the same code.
+
+Algorithm options and options for patient loading are passed
+to the worker node as compact JSON sidecar files, rather than as
+literals in the wrapper script:
+    - OPTIONS_FILE holds the options common to all subjobs, and is
+      shipped once, in the master input sandbox;
+    - SUBJOB_OPTIONS_FILE holds, for each algorithm, only the options
+      that differ from those in OPTIONS_FILE, such as the images
+      assigned to a subjob by a splitter.
+
+Values that JSON doesn't represent natively (tuples, sets, dictionaries
+with non-string keys, paths, NumPy scalars and arrays) are tagged
+on encoding, so that they're restored faithfully on decoding.
+
+The sidecar files also hold options for SkrtRunner, which runs
+an application's algorithms over a list of patient datasets.
+"""
+
+import ast
+import contextlib
+import copy
+import hashlib
+import json
+import os
+import pickle
+import selectors
+import shutil
+import signal
+import sys
+import tempfile
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import PurePath
+
+# Name of file of options common to all subjobs.
+OPTIONS_FILE = "skrt_opts.json"
+
+# Name of file of subjob-specific options.
+SUBJOB_OPTIONS_FILE = "skrt_subjob_opts.json"
+
+# Key used to tag values not represented natively by JSON.
+TYPE_KEY = "__skrt_type__"
+
+# Name of checkpoint file, written in subjob's checkpoint directory.
+CHECKPOINT_FILE = "skrt_checkpoint.pkl"
+
+# Name of directory, in subjob's checkpoint directory, where copies
+# of algorithm outputs are kept.
+CHECKPOINT_OUTPUTS_DIR = "skrt_checkpoint_outputs"
+
+# Name of file summarising patient datasets skipped after timeout.
+SKIPPED_FILE = "skrt_skipped.json"
+
+# Name of ledger file, and associated lock file, in pool directory.
+POOL_FILE = "skrt_pool.json"
+POOL_LOCK_FILE = "skrt_pool.lock"
+
+# Name of file of execution times, for parallel running of algorithms.
+TIMING_FILE = "skrt_timing.json"
+
+# Suffixes of sizes, in order of increasing powers of 1024.
+SIZE_UNITS = "KMGT"
+
+
+def tag(value):
+    """
+    Return representation of value using only JSON-native types.
+
+    Parameter
+    ---------
+    value : any
+        Value to be represented.
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+
+    if isinstance(value, PurePath):
+        return str(value)
+
+    if isinstance(value, tuple):
+        return {TYPE_KEY: "tuple", "items": [tag(item) for item in value]}
+
+    if isinstance(value, (set, frozenset)):
+        items = [tag(item) for item in value]
+        try:
+            items.sort()
+        except TypeError:
+            pass
+        return {TYPE_KEY: "set", "items": items}
+
+    if hasattr(value, "items"):
+        items = dict(value.items())
+        str_keys = all(isinstance(key, str) for key in items)
+        if str_keys and TYPE_KEY not in items:
+            return {key: tag(item) for key, item in items.items()}
+        return {
+            TYPE_KEY: "dict",
+            "items": [[tag(key), tag(item)] for key, item in items.items()],
+        }
+
+    # NumPy scalars and arrays.
+    if hasattr(value, "tolist"):
+        return tag(value.tolist())
+
+    # Other sequences, including Ganga lists.
+    if hasattr(value, "__iter__"):
+        return [tag(item) for item in value]
+
+    raise TypeError(
+        f"Option value {value!r} of type {type(value).__name__} "
+        "can't be passed to worker node"
+    )
+
+
+def untag(value):
+    """
+    Restore value from representation using only JSON-native types.
+
+    This function is suitable for use as object_hook in json.load().
+
+    Parameter
+    ---------
+    value : dict
+        Dictionary decoded from JSON.
+    """
+    value_type = value.get(TYPE_KEY, None)
+    if value_type == "tuple":
+        return tuple(value["items"])
+    if value_type == "set":
+        return set(value["items"])
+    if value_type == "dict":
+        return {hashable(key): item for key, item in value["items"]}
+    return value
+
+
+def hashable(value):
+    """
+    Return hashable equivalent of decoded value, for use as dictionary key.
+
+    Parameter
+    ---------
+    value : any
+        Value to be used as dictionary key.
+    """
+    if isinstance(value, list):
+        return tuple(hashable(item) for item in value)
+    if isinstance(value, set):
+        return frozenset(value)
+    return value
+
+
+def as_dict(opts):
+    """
+    Return dictionary of options, converting from string if needed.
+
+    Parameter
+    ---------
+    opts : dict/str/None
+        Dictionary of options, or string representation of dictionary.
+    """
+    if not opts:
+        return {}
+    if isinstance(opts, str):
+        return ast.literal_eval(opts)
+    return dict(opts)
+
+
+def encode_options(alg_opts=None, patient_opts=None, runner_opts=None):
+    """
+    Return JSON string encoding algorithm and patient-loading options.
+
+    Parameters
+    ----------
+    alg_opts : list, default=None
+        List containing one dictionary of options for each algorithm.
+
+    patient_opts : dict/str, default=None
+        Dictionary of options to be passed to constructor
+        of class for loading patient datasets.
+
+    runner_opts : dict, default=None
+        Dictionary of options to be passed to constructor of SkrtRunner.
+    """
+    options = {
+        "alg_opts": [tag(as_dict(opts)) for opts in alg_opts or []],
+        "patient_opts": tag(as_dict(patient_opts)),
+        "runner_opts": tag(as_dict(runner_opts)),
+    }
+    return json.dumps(options, separators=(",", ":"))
+
+
+def encode_option_changes(
+    master_alg_opts=None, alg_opts=None, runner_opts=None
+):
+    """
+    Return JSON string encoding changes in algorithm options.
+
+    For each algorithm, the options recorded are those that have been
+    added or modified relative to the master options, together with
+    the names of any options that have been removed.
+
+    Parameters
+    ----------
+    master_alg_opts : list, default=None
+        List containing one dictionary of master options
+        for each algorithm.
+
+    alg_opts : list, default=None
+        List containing one dictionary of subjob options
+        for each algorithm.
+
+    runner_opts : dict, default=None
+        Dictionary of subjob-specific options to be passed
+        to constructor of SkrtRunner, overriding master options.
+    """
+    changes = []
+    for master_opts, opts in zip(master_alg_opts or [], alg_opts or []):
+        master_opts = tag(as_dict(master_opts))
+        opts = tag(as_dict(opts))
+        changes.append(
+            {
+                "set": {
+                    key: value
+                    for key, value in opts.items()
+                    if key not in master_opts or master_opts[key] != value
+                },
+                "unset": [key for key in master_opts if key not in opts],
+            }
+        )
+    return json.dumps(
+        {"changes": changes, "runner_opts": tag(as_dict(runner_opts))},
+        separators=(",", ":"),
+    )
+
+
+def load_options(
+    options_file=OPTIONS_FILE, subjob_options_file=SUBJOB_OPTIONS_FILE
+):
+    """
+    Load algorithm and patient-loading options from sidecar files.
+
+    Returns list of dictionaries of algorithm options, and dictionary
+    of options for loading patient datasets.
+
+    Parameters
+    ----------
+    options_file : str, default=OPTIONS_FILE
+        Path to file of options common to all subjobs.
+
+    subjob_options_file : str, default=SUBJOB_OPTIONS_FILE
+        Path to file of subjob-specific options.  If this defines
+        complete options, rather than changes, options_file is ignored.
+    """
+    subjob_options = {}
+    if os.path.exists(subjob_options_file):
+        with open(subjob_options_file, encoding="utf-8") as in_file:
+            subjob_options = json.load(in_file, object_hook=untag)
+
+    if "alg_opts" in subjob_options:
+        return (subjob_options["alg_opts"], subjob_options["patient_opts"])
+
+    with open(options_file, encoding="utf-8") as in_file:
+        options = json.load(in_file, object_hook=untag)
+
+    alg_opts = options["alg_opts"]
+    for opts, changes in zip(alg_opts, subjob_options.get("changes", [])):
+        opts.update(changes["set"])
+        for key in changes["unset"]:
+            opts.pop(key, None)
+
+    return (alg_opts, options["patient_opts"])
+
+
+def load_runner_options(
+    options_file=OPTIONS_FILE, subjob_options_file=SUBJOB_OPTIONS_FILE
+):
+    """
+    Load options for SkrtRunner from sidecar files.
+
+    Returns dictionary of options, where subjob-specific values
+    override values common to all subjobs.
+
+    Parameters
+    ----------
+    options_file : str, default=OPTIONS_FILE
+        Path to file of options common to all subjobs.
+
+    subjob_options_file : str, default=SUBJOB_OPTIONS_FILE
+        Path to file of subjob-specific options.
+    """
+    runner_opts = {}
+    for path in [options_file, subjob_options_file]:
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as in_file:
+                runner_opts.update(
+                    json.load(in_file, object_hook=untag).get(
+                        "runner_opts", {}
+                    )
+                )
+    return runner_opts
+
+
+def get_alg_deps(names=None, dependencies=None):
+    """
+    Return list of dependencies, as lists of indices, one for each
+    algorithm, checking that dependencies can be satisfied.
+
+    Raises ValueError if algorithm names aren't unique when dependencies
+    are declared, if a dependency refers to an unknown algorithm, or if
+    dependencies are circular.
+
+    Parameters
+    ----------
+    names : list, default=None
+        List of algorithm names, in order of execution.
+
+    dependencies : dict, default=None
+        Dictionary where each key is the name of an algorithm, and
+        the associated value is a list of names of algorithms
+        on which it depends.
+    """
+    names = list(names or [])
+    dependencies = dict(dependencies or {})
+    alg_deps = [[] for name in names]
+    if not dependencies:
+        return alg_deps
+
+    if len(set(names)) != len(names):
+        raise ValueError(
+            f"Algorithm names must be unique for dependencies: {names}"
+        )
+
+    for name, deps in dependencies.items():
+        for dep in [name] + list(deps):
+            if dep not in names:
+                raise ValueError(f"Unknown algorithm in dependencies: {dep}")
+        alg_deps[names.index(name)] = sorted(
+            {names.index(dep) for dep in deps}
+        )
+
+    done = set()
+    while len(done) < len(names):
+        ready = [
+            idx
+            for idx, deps in enumerate(alg_deps)
+            if idx not in done and set(deps) <= done
+        ]
+        if not ready:
+            circular = [
+                names[idx] for idx in range(len(names)) if idx not in done
+            ]
+            raise ValueError(f"Circular dependencies between: {circular}")
+        done.update(ready)
+
+    return alg_deps
+
+
+def get_critical_path(alg_deps=None, durations=None):
+    """
+    Return tuple of critical path, as list of algorithm indices,
+    and its duration.
+
+    The critical path is the chain of dependent algorithms with
+    the longest total duration, which sets the minimum time
+    for processing a patient dataset, however many algorithms
+    run concurrently.
+
+    Parameters
+    ----------
+    alg_deps : list, default=None
+        List of dependencies, as lists of indices, one for each
+        algorithm, as returned by get_alg_deps().
+
+    durations : dict, default=None
+        Dictionary mapping algorithm indices to execution times.
+        Algorithms not included are ignored.
+    """
+    alg_deps = alg_deps or []
+    durations = durations or {}
+    paths = {}
+
+    def get_path(idx):
+        if idx not in paths:
+            best = ([], 0)
+            for dep in alg_deps[idx]:
+                if dep in durations:
+                    path = get_path(dep)
+                    if path[1] > best[1]:
+                        best = path
+            paths[idx] = (best[0] + [idx], best[1] + durations[idx])
+        return paths[idx]
+
+    return max(
+        (get_path(idx) for idx in durations),
+        key=lambda path: path[1],
+        default=([], 0),
+    )
+
+
+class PatientTimeout(BaseException):
+    """
+    Exception raised when time limit for processing patient is reached.
+
+    This derives from BaseException, rather than from Exception,
+    so that it isn't caught by generic exception handling
+    in algorithm code.
+    """
+
+
+def raise_patient_timeout(signum, frame):
+    """
+    Raise PatientTimeout; for use as handler of SIGALRM.
+
+    Parameters
+    ----------
+    signum : int
+        Number of signal received.
+
+    frame : frame
+        Current stack frame.
+    """
+    raise PatientTimeout()
+
+
+def parse_size(size=0):
+    """
+    Return number of bytes represented by a size.
+
+    Parameter
+    ---------
+    size : int/float/str, default=0
+        Size in bytes, or string giving size with optional suffix
+        "K", "M", "G" or "T" (powers of 1024), for example "4G".
+    """
+    if isinstance(size, str):
+        size = size.strip().upper().rstrip("B")
+        factor = 1
+        if size and size[-1] in SIZE_UNITS:
+            factor = 1024 ** (SIZE_UNITS.index(size[-1]) + 1)
+            size = size[:-1]
+        return int(float(size or 0) * factor)
+    return int(size or 0)
+
+
+def read_meminfo(field="MemAvailable"):
+    """
+    Return value (bytes) of field of /proc/meminfo, or None if unavailable.
+
+    Parameter
+    ---------
+    field : str, default="MemAvailable"
+        Name of field whose value is to be returned.
+    """
+    try:
+        with open("/proc/meminfo", encoding="utf-8") as in_file:
+            for line in in_file:
+                name, value = line.split(":", 1)
+                if name == field:
+                    return parse_size(value.split()[0] + "K")
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def get_descendants(pid=0):
+    """
+    Return list of identifiers of descendants of a process.
+
+    Parameter
+    ---------
+    pid : int, default=0
+        Identifier of process whose descendants are to be found.
+    """
+    descendants = []
+    parents = [pid]
+    while parents:
+        parent = parents.pop()
+        try:
+            tids = os.listdir(f"/proc/{parent}/task")
+        except OSError:
+            continue
+        for tid in tids:
+            try:
+                with open(
+                    f"/proc/{parent}/task/{tid}/children", encoding="utf-8"
+                ) as in_file:
+                    children = [int(child) for child in in_file.read().split()]
+            except (OSError, ValueError):
+                continue
+            descendants.extend(children)
+            parents.extend(children)
+    return descendants
+
+
+def get_rss(pid=0):
+    """
+    Return resident set size (bytes) of a process and its descendants.
+
+    Parameter
+    ---------
+    pid : int, default=0
+        Identifier of process whose memory use is to be returned.
+    """
+    rss = 0
+    for proc in [pid] + get_descendants(pid):
+        try:
+            with open(f"/proc/{proc}/status", encoding="utf-8") as in_file:
+                for line in in_file:
+                    if line.startswith("VmRSS:"):
+                        rss += parse_size(line.split()[1] + "K")
+                        break
+        except OSError:
+            continue
+    return rss
+
+
+def is_alive(pid=0):
+    """
+    Return True if process with given identifier exists, or False otherwise.
+
+    Parameter
+    ---------
+    pid : int, default=0
+        Identifier of process.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SkrtPool:
+    """
+    Admission control for subjobs sharing the resources of a node.
+
+    Subjobs running on the same node, for example all subjobs of a job
+    submitted to the Local backend, share a ledger, POOL_FILE, in
+    a node-local pool directory.  Access to the ledger is serialised
+    using a lock on POOL_LOCK_FILE.  The ledger records:
+        - the subjobs waiting for admission, in order of arrival;
+        - the subjobs admitted, with the CPUs and memory reserved;
+        - the peak memory use observed for subjobs of each application.
+
+    A subjob is admitted, in order of arrival, when the CPUs that
+    it needs are free, and its estimated memory footprint fits both
+    within the part of the memory budget not reserved by other subjobs
+    and within the memory that the system reports as available.
+    A subjob is always admitted if no other subjob is running, so that
+    a subjob with a footprint larger than the budget isn't blocked
+    indefinitely.  Entries for processes that no longer exist are
+    discarded whenever the ledger is read.
+
+    A subjob's estimated footprint is the peak memory use recorded
+    for earlier subjobs of the same application, if any, or otherwise
+    is obtained from the split plan, as the product of the number of
+    patient datasets assigned to the subjob and the memory per patient,
+    or from a fixed memory per subjob.
+    """
+
+    def __init__(
+        self,
+        pool_dir="",
+        cpus=0,
+        cpus_per_subjob=1,
+        memory=0,
+        memory_per_subjob="2G",
+        memory_per_patient=0,
+        max_requeues=3,
+        poll_interval=1,
+        key="",
+    ):
+        """
+        Create instance of SkrtPool.
+
+        Parameters
+        ----------
+        pool_dir : str, default=""
+            Node-local directory for pool ledger.  If empty, the
+            subdirectory "skrt_pool" of the system's temporary
+            directory is used.
+
+        cpus : int, default=0
+            Number of CPUs that may be reserved by subjobs.  If zero,
+            the number of CPUs of the node is used.
+
+        cpus_per_subjob : int, default=1
+            Number of CPUs to be reserved by each subjob.
+
+        memory : int/str, default=0
+            Memory budget (bytes, or string with unit suffix) that may be
+            reserved by subjobs.  If zero, the total memory of the node
+            is used.
+
+        memory_per_subjob : int/str, default="2G"
+            Estimated memory footprint of a subjob, used when there's
+            no history, and memory_per_patient is zero.
+
+        memory_per_patient : int/str, default=0
+            Estimated memory footprint per patient dataset, used when
+            there's no history.
+
+        max_requeues : int, default=3
+            Maximum number of times that a subjob exceeding its
+            estimated memory footprint is stopped and re-queued.  After
+            this, the subjob runs to completion regardless of footprint.
+
+        poll_interval : float, default=1
+            Interval (seconds) between checks on ledger while waiting
+            for admission, and between checks on memory use while running.
+
+        key : str, default=""
+            Key identifying application, for recording history
+            of peak memory use.
+        """
+        self.pool_dir = os.path.expanduser(
+            pool_dir or os.path.join(tempfile.gettempdir(), "skrt_pool")
+        )
+        self.cpus = cpus or os.cpu_count() or 1
+        self.cpus_per_subjob = min(cpus_per_subjob, self.cpus)
+        self.memory = parse_size(memory) or read_meminfo("MemTotal") or 0
+        self.memory_per_subjob = parse_size(memory_per_subjob)
+        self.memory_per_patient = parse_size(memory_per_patient)
+        self.max_requeues = max_requeues
+        self.poll_interval = poll_interval
+        self.key = key
+        self.pid = os.getpid()
+        self.arrival = None
+
+    @contextlib.contextmanager
+    def ledger(self):
+        """
+        Context manager giving exclusive access to pool ledger.
+
+        The ledger is yielded as a dictionary, and is written back
+        on exit from the context.  Entries for processes that no longer
+        exist are removed.
+        """
+        import fcntl
+
+        os.makedirs(self.pool_dir, exist_ok=True)
+        path = os.path.join(self.pool_dir, POOL_FILE)
+        with open(os.path.join(self.pool_dir, POOL_LOCK_FILE), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(path, encoding="utf-8") as in_file:
+                        ledger = json.load(in_file)
+                except (OSError, ValueError):
+                    ledger = {}
+                for section in ["waiting", "running", "history"]:
+                    ledger.setdefault(section, {})
+                for section in ["waiting", "running"]:
+                    for pid in list(ledger[section]):
+                        if not is_alive(int(pid)):
+                            del ledger[section][pid]
+
+                yield ledger
+
+                tmp_path = f"{path}.{self.pid}"
+                with open(tmp_path, "w", encoding="utf-8") as out_file:
+                    json.dump(ledger, out_file)
+                os.replace(tmp_path, path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def estimate(self, n_patient=0):
+        """
+        Return estimated memory footprint (bytes) of a subjob.
+
+        Parameter
+        ---------
+        n_patient : int, default=0
+            Number of patient datasets assigned to subjob.
+        """
+        with self.ledger() as ledger:
+            peak = ledger["history"].get(self.key, 0)
+        if peak:
+            return peak
+        if self.memory_per_patient and n_patient:
+            return self.memory_per_patient * n_patient
+        return self.memory_per_subjob
+
+    def acquire(self, memory=0):
+        """
+        Wait until admitted to pool, then reserve CPUs and memory.
+
+        Parameter
+        ---------
+        memory : int, default=0
+            Memory (bytes) to be reserved.
+        """
+        pid = str(self.pid)
+        if self.arrival is None:
+            self.arrival = time.time()
+        waiting = False
+        while True:
+            with self.ledger() as ledger:
+                ledger["waiting"][pid] = self.arrival
+                running = ledger["running"].values()
+                free_cpus = self.cpus - sum(slot["cpus"] for slot in running)
+                free_memory = self.memory - sum(
+                    slot["memory"] for slot in running
+                )
+                available = read_meminfo()
+                if available is not None:
+                    free_memory = min(free_memory, available)
+                first = min(
+                    ledger["waiting"], key=lambda key: ledger["waiting"][key]
+                )
+                if first == pid and (
+                    not running
+                    or (
+                        self.cpus_per_subjob <= free_cpus
+                        and memory <= free_memory
+                    )
+                ):
+                    del ledger["waiting"][pid]
+                    ledger["running"][pid] = {
+                        "cpus": self.cpus_per_subjob,
+                        "memory": memory,
+                        "start": time.time(),
+                    }
+                    break
+            if not waiting:
+                print(
+                    f"Waiting for admission to pool in {self.pool_dir}: "
+                    f"{self.cpus_per_subjob} CPU(s), "
+                    f"{memory / 1024**3:.2f} GiB"
+                )
+                sys.stdout.flush()
+                waiting = True
+            time.sleep(self.poll_interval)
+
+        print(
+            f"Admitted to pool: {self.cpus_per_subjob} CPU(s), "
+            f"{memory / 1024**3:.2f} GiB, "
+            f"after {time.time() - self.arrival:.1f} s"
+        )
+        sys.stdout.flush()
+
+    def release(self, peak=0):
+        """
+        Release CPUs and memory reserved, and record peak memory use.
+
+        Parameter
+        ---------
+        peak : int, default=0
+            Peak memory use (bytes) to be recorded.  If zero,
+            history isn't updated.
+        """
+        with self.ledger() as ledger:
+            ledger["running"].pop(str(self.pid), None)
+            if peak and self.key:
+                ledger["history"][self.key] = max(
+                    peak, ledger["history"].get(self.key, 0)
+                )
+
+
+def get_digests(state=None):
+    """
+    Return dictionary mapping attribute names to digests of serialised
+    attribute values, or to None for values that can't be serialised.
+
+    Parameter
+    ---------
+    state : dict, default=None
+        Dictionary of attributes, such as an object's __dict__.
+    """
+    digests = {}
+    for name, value in (state or {}).items():
+        try:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            digests[name] = None
+            continue
+        digests[name] = hashlib.blake2b(data, digest_size=16).digest()
+    return digests
+
+
+def copy_file(in_path="", out_path=""):
+    """
+    Copy file, with its modification time, replacing any existing file.
+
+    The file is copied to a temporary path, synced to disk, then renamed,
+    so that a complete copy exists at all times.
+
+    Parameters
+    ----------
+    in_path : str, default=""
+        Path to file to be copied.
+
+    out_path : str, default=""
+        Path where copy is to be created.
+    """
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    tmp_path = f"{out_path}.{os.getpid()}"
+    shutil.copy2(in_path, tmp_path)
+    with open(tmp_path, "rb") as tmp_file:
+        os.fsync(tmp_file.fileno())
+    os.replace(tmp_path, out_path)
+
+
+class SkrtRunner:
+    """
+    Runner of scikit-rt application over list of patient datasets.
+
+    The algorithms of the application are run as by the run() method
+    of skrt.application.Application:
+        - the initialise() method of each algorithm is called
+          before processing any datasets;
+        - for each dataset in turn, a patient object is created, and
+          is passed to the execute() method of each algorithm;
+        - the finalise() method of each algorithm is called
+          after processing all datasets.
+    Processing stops if an algorithm returns a status that isn't ok.
+
+    If a checkpoint directory is defined, then after each patient
+    dataset is processed, the paths of datasets processed so far and
+    the states of all algorithms are written to a checkpoint file.
+    When a run is restarted, for example after a subjob is resubmitted,
+    algorithm states are restored from the checkpoint file, and
+    datasets already processed are skipped.  Datasets skipped after
+    timeout aren't recorded as processed, so are tried again when
+    a run is restarted.  The initialise() method
+    of each algorithm is called only when there's no checkpoint
+    from which to resume.  If the checkpointed run had stopped on
+    a status that isn't ok, the recorded status is returned
+    without further processing.
+
+    With checkpointing, files written by algorithms in their output
+    directories, or in the working directory for algorithms without
+    output directories, including subdirectories, are copied to the
+    checkpoint directory before each checkpoint file is written, and
+    are restored to the working directory on resuming.  Only files that
+    are new or modified since the last checkpoint are copied.  Copies are kept
+    under names that include file size and modification time, and
+    earlier copies are deleted only once a new checkpoint file has
+    been written, so that the copies restored always match the
+    checkpointed state.  Files already present in the working
+    directory when the runner is created are treated as inputs,
+    and aren't copied.
+
+    If time limits are defined, for processing of a patient dataset
+    (creation of patient object and execution of all algorithms), or
+    for execution of individual algorithms, they're enforced using
+    SIGALRM, or, when algorithms are run in processes, by the parent
+    process, which kills all running child processes when a limit
+    is reached.  When a limit is reached, the patient dataset is skipped:
+    algorithm states are restored to their values before processing
+    of the dataset started, output files created for the dataset are
+    deleted, output files modified are restored, and processing moves on
+    to the next dataset.  Output files are restored from the copies kept
+    for checkpointing or, without checkpointing, from copies kept in
+    a temporary directory for the duration of the run.
+    Skipped datasets are listed, with the limit reached, in SKIPPED_FILE,
+    so that they can be resubmitted separately.  Time limits can't
+    interrupt a process blocked in an uninterruptible system call.
+
+    If output directories are defined for algorithms, each algorithm's
+    methods are called with its output directory as current directory.
+    This allows the algorithms of several applications to be run
+    in a single pass over the data, with the outputs of each application
+    kept separate.
+    """
+
+    def __init__(
+        self,
+        app=None,
+        checkpoint_dir="",
+        patient_timeout=0,
+        alg_timeouts=None,
+        pool=None,
+        alg_dirs=None,
+        alg_deps=None,
+        parallel="",
+        max_workers=0,
+    ):
+        """
+        Create instance of SkrtRunner.
+
+        Parameters
+        ----------
+        app : skrt.application.Application, default=None
+            Application whose algorithms are to be run.
+
+        checkpoint_dir : str, default=""
+            Directory where checkpoint file is to be written.  If empty,
+            no checkpointing is performed.
+
+        patient_timeout : float, default=0
+            Time limit (seconds) for processing of each patient dataset.
+            If zero, no limit is applied.
+
+        alg_timeouts : list, default=None
+            List of time limits (seconds), one for each algorithm,
+            for execution for a single patient dataset.  A value
+            of zero means that no limit is applied.
+
+        pool : dict, default=None
+            Dictionary of options for creating SkrtPool instance,
+            for running under admission control in pool of subjobs
+            sharing node resources.  If None or empty, the application
+            is run without admission control.
+
+        alg_dirs : list, default=None
+            List of output directories, one for each algorithm,
+            relative to the working directory.  The methods of
+            an algorithm are called with its output directory as
+            current directory, so that the outputs of different
+            algorithms may be kept separate.  An empty string means
+            that the working directory is used.
+
+        alg_deps : list, default=None
+            List of dependencies, as lists of indices, one for each
+            algorithm, as returned by get_alg_deps().
+
+        parallel : str, default=""
+            Mode for running independent algorithms concurrently
+            for each patient dataset: "threads" or "processes".
+            If empty, algorithms are run in sequence.  Threads can't
+            be interrupted, so "processes" is used instead of "threads"
+            if time limits are defined.
+
+        max_workers : int, default=0
+            Maximum number of algorithms to be run concurrently.
+            If zero, there's no limit.
+        """
+        self.app = app
+        self.algs = list(app.algs) if app is not None else []
+        self.status = getattr(app, "status", None)
+        self.checkpoint_path = (
+            os.path.abspath(
+                os.path.join(
+                    os.path.expanduser(checkpoint_dir), CHECKPOINT_FILE
+                )
+            )
+            if checkpoint_dir
+            else ""
+        )
+        self.work_dir = os.getcwd()
+        self.copies_dir = (
+            os.path.join(
+                os.path.dirname(self.checkpoint_path), CHECKPOINT_OUTPUTS_DIR
+            )
+            if self.checkpoint_path
+            else ""
+        )
+        self.patient_timeout = patient_timeout or 0
+        self.alg_timeouts = list(alg_timeouts or [])
+        self.alg_timeouts.extend(
+            [0] * (len(self.algs) - len(self.alg_timeouts))
+        )
+        self.deadline = None
+        self.limit = "patient"
+        self.done = []
+        self.skipped = []
+        self.alg_dirs = list(alg_dirs or [])
+        self.outputs = {}
+        self.inputs = set()
+        if self.checkpoint_path or self.has_timeouts():
+            self.inputs = set(self.get_outputs())
+        self.alg_deps = [list(deps) for deps in (alg_deps or [])]
+        self.alg_deps.extend([[]] * (len(self.algs) - len(self.alg_deps)))
+        self.parallel = parallel or ""
+        self.max_workers = max_workers or len(self.algs) or 1
+        self.timings = []
+        if "threads" == self.parallel and self.has_timeouts():
+            sys.stderr.write(
+                "Time limits defined: algorithms run in processes "
+                "rather than threads, which can't be interrupted\n"
+            )
+            self.parallel = "processes"
+        if "threads" == self.parallel and any(self.alg_dirs):
+            sys.stderr.write(
+                "Output directories defined: algorithms run "
+                "in processes rather than threads\n"
+            )
+            self.parallel = "processes"
+        self.pool = dict(pool or {})
+        if self.pool:
+            self.pool.setdefault(
+                "key", "-".join(type(alg).__name__ for alg in self.algs)
+            )
+
+    def has_timeouts(self):
+        """
+        Return True if any time limit is defined, or False otherwise.
+        """
+        return bool(self.patient_timeout or any(self.alg_timeouts))
+
+    def run(self, paths=None, PatientClass=None, **kwargs):
+        """
+        Run application's algorithms over patient datasets.
+
+        Returns final status.
+
+        Parameters
+        ----------
+        paths : list, default=None
+            List of paths to patient datasets.
+
+        PatientClass : class, default=None
+            Class to be used for loading patient datasets.  If None,
+            skrt.patient.Patient is used.
+
+        **kwargs
+            Keyword arguments to be passed to constructor of PatientClass.
+        """
+        if self.pool:
+            return self.run_in_pool(paths, PatientClass, **kwargs)
+        return self.run_here(paths, PatientClass, **kwargs)
+
+    def run_here(self, paths=None, PatientClass=None, **kwargs):
+        """
+        Run application's algorithms over patient datasets,
+        in the current process.
+
+        Returns final status.  Parameters are as for run().
+        """
+        if PatientClass is None:
+            from skrt.patient import Patient as PatientClass
+
+        resumed = self.resume()
+        if resumed and not self.is_ok():
+            return self.status
+        if not resumed:
+            self.call_all("initialise")
+
+        schedule = getattr(PatientClass, "schedule", None)
+        if self.is_ok() and callable(schedule):
+            schedule(
+                [path for path in paths or [] if path not in self.done],
+                **kwargs,
+            )
+
+        tmp_dir = ""
+        if self.has_timeouts():
+            handler = signal.signal(signal.SIGALRM, raise_patient_timeout)
+            if not self.copies_dir:
+                tmp_dir = tempfile.mkdtemp(prefix="skrt_outputs_")
+                self.copies_dir = tmp_dir
+
+        if self.is_ok():
+            for path in paths or []:
+                if path in self.done:
+                    continue
+                if self.process(path, PatientClass, **kwargs):
+                    self.done.append(path)
+                if self.checkpoint_path:
+                    self.checkpoint()
+                elif self.has_timeouts():
+                    self.keep_outputs()
+                if not self.is_ok():
+                    break
+
+        if self.has_timeouts():
+            signal.signal(signal.SIGALRM, handler)
+            self.write_skipped()
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            self.copies_dir = ""
+
+        if self.is_ok():
+            self.call_all("finalise")
+
+        return self.status
+
+    def run_in_pool(self, paths=None, PatientClass=None, **kwargs):
+        """
+        Run application's algorithms over patient datasets,
+        under admission control in pool of subjobs sharing node resources.
+
+        Returns final status.  Parameters are as for run().
+
+        After admission, the algorithms are run in a child process,
+        the memory use of which is monitored.  If memory use exceeds
+        the estimated footprint, the child process is stopped, and
+        the subjob is re-queued with a larger estimate, keeping its
+        original place in the queue.  As each attempt starts from
+        a copy of the unmodified parent process, algorithm states are
+        those from before any processing, or are restored from the
+        checkpoint file if a checkpoint directory is defined.
+        """
+        pool = SkrtPool(**self.pool)
+        estimate = pool.estimate(len(paths or []))
+        for attempt in range(pool.max_requeues + 1):
+            limit = estimate if attempt < pool.max_requeues else 0
+            pool.acquire(estimate)
+            try:
+                result, peak = self.run_child(
+                    limit, pool.poll_interval, paths, PatientClass, **kwargs
+                )
+            except BaseException:
+                pool.release()
+                raise
+            if result is not None or not limit:
+                break
+            print(
+                f"Memory use ({peak / 1024**3:.2f} GiB) exceeded "
+                f"estimate ({estimate / 1024**3:.2f} GiB): re-queued"
+            )
+            pool.release(peak)
+            estimate = max(int(1.5 * estimate), peak)
+
+        pool.release(peak)
+        print(f"Peak memory use: {peak / 1024**3:.2f} GiB")
+
+        if self.status is not None:
+            if isinstance(result, dict):
+                for attribute, value in result.items():
+                    setattr(self.status, attribute, value)
+            else:
+                self.status.code = 1
+                self.status.name = "Failed"
+                self.status.reason = (
+                    f"Subjob process ended with exit status {result}"
+                )
+
+        return self.status
+
+    def run_child(
+        self, limit=0, poll_interval=1, paths=None, PatientClass=None, **kwargs
+    ):
+        """
+        Run application's algorithms in child process, monitoring memory use.
+
+        Returns tuple of result and peak memory use (bytes).  The result
+        is a dictionary of the attributes of the final status, or is the
+        child's exit status if no status is returned, or is None if
+        the child process is stopped for exceeding memory limit.
+
+        Parameters
+        ----------
+        limit : int, default=0
+            Memory limit (bytes) for child process and its descendants.
+            If zero, no limit is applied.
+
+        poll_interval : float, default=1
+            Interval (seconds) between checks on memory use.
+
+        paths, PatientClass, **kwargs
+            As for run().
+        """
+        sys.stdout.flush()
+        sys.stderr.flush()
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+
+        if not pid:
+            os.close(read_fd)
+            exit_code = 1
+            try:
+                status = self.run_here(paths, PatientClass, **kwargs)
+                result = {
+                    attribute: getattr(status, attribute)
+                    for attribute in ["code", "name", "reason"]
+                    if hasattr(status, attribute)
+                }
+                with os.fdopen(write_fd, "w", encoding="utf-8") as out_file:
+                    json.dump(tag(result), out_file)
+                exit_code = 0
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(exit_code)
+
+        os.close(write_fd)
+        peak = 0
+        while True:
+            done, wait_status = os.waitpid(pid, os.WNOHANG)
+            if done:
+                break
+            rss = get_rss(pid)
+            peak = max(peak, rss)
+            if limit and rss > limit:
+                for proc in get_descendants(pid) + [pid]:
+                    try:
+                        os.kill(proc, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+                os.waitpid(pid, 0)
+                os.close(read_fd)
+                return (None, peak)
+            time.sleep(poll_interval)
+
+        with os.fdopen(read_fd, encoding="utf-8") as in_file:
+            data = in_file.read()
+        if data:
+            return (json.loads(data, object_hook=untag), peak)
+        return (os.waitstatus_to_exitcode(wait_status), peak)
+
+    def process(self, path="", PatientClass=None, **kwargs):
+        """
+        Process a single patient dataset.
+
+        Returns True if the dataset is processed, or False if it's
+        skipped after timeout.
+
+        If time limits are defined, and a limit is reached, algorithm
+        states and output files are restored to their versions before
+        processing started, and the dataset is recorded as skipped.
+
+        Parameters
+        ----------
+        path : str, default=""
+            Path to patient dataset.
+
+        PatientClass : class, default=None
+            Class to be used for loading patient dataset.
+
+        **kwargs
+            Keyword arguments to be passed to constructor of PatientClass.
+        """
+        if not self.has_timeouts():
+            self.execute(PatientClass(path, **kwargs))
+            return True
+
+        # Forget any earlier timeout, from before a restart.
+        self.skipped = [
+            skipped for skipped in self.skipped if skipped["path"] != path
+        ]
+        state = self.get_state()
+        status = self.status
+        start = time.monotonic()
+        self.deadline = (
+            start + self.patient_timeout if self.patient_timeout else None
+        )
+        self.limit = "patient"
+        try:
+            self.set_timer(self.get_remaining())
+            patient = PatientClass(path, **kwargs)
+            self.execute(patient)
+            self.set_timer(0)
+        except PatientTimeout:
+            self.set_timer(0)
+            self.set_state(state)
+            self.status = status
+            self.revert_outputs()
+            self.skipped.append(
+                {
+                    "path": path,
+                    "status": "timeout",
+                    "limit": self.limit,
+                    "elapsed": round(time.monotonic() - start, 3),
+                }
+            )
+            sys.stderr.write(
+                f"Time limit ({self.limit}) reached for {path}: skipped\n"
+            )
+            return False
+        finally:
+            self.set_timer(0)
+            self.deadline = None
+
+        return True
+
+    def get_remaining(self):
+        """
+        Return time remaining (seconds) before patient deadline, or None.
+        """
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def set_timer(self, seconds=None):
+        """
+        Set timer for raising PatientTimeout.
+
+        Parameter
+        ---------
+        seconds : float, default=None
+            Time (seconds) after which PatientTimeout is to be raised.
+            If None or zero, timer is cancelled.  If negative,
+            PatientTimeout is raised immediately.
+        """
+        if not seconds:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        elif seconds < 0:
+            raise PatientTimeout()
+        else:
+            signal.setitimer(signal.ITIMER_REAL, seconds)
+
+    def write_skipped(self):
+        """
+        Write and print summary of patient datasets skipped after timeout.
+        """
+        with open(SKIPPED_FILE, "w", encoding="utf-8") as out_file:
+            json.dump(self.skipped, out_file, indent=1)
+
+        print()
+        print(f"Patient datasets skipped after timeout: {len(self.skipped)}")
+        for skipped in self.skipped:
+            print(f"    {skipped['path']} (limit: {skipped['limit']})")
+
+    def is_ok(self):
+        """
+        Return True if there's no status or status is ok, or False otherwise.
+        """
+        return self.status is None or self.status.is_ok()
+
+    def call_all(self, method=""):
+        """
+        Call named method of each algorithm, stopping if status isn't ok.
+
+        Parameter
+        ---------
+        method : str, default=""
+            Name of method to be called.
+        """
+        for idx, alg in enumerate(self.algs):
+            with self.in_alg_dir(idx):
+                self.status = getattr(alg, method)()
+            if not self.is_ok():
+                break
+
+    def execute(self, patient=None):
+        """
+        Pass patient object to execute() method of each algorithm.
+
+        Parameter
+        ---------
+        patient : skrt.patient.Patient, default=None
+            Object representing patient dataset.
+        """
+        if self.parallel:
+            self.execute_parallel(patient)
+            return
+
+        for idx, (alg, alg_timeout) in enumerate(
+            zip(self.algs, self.alg_timeouts)
+        ):
+            if self.has_timeouts():
+                remaining = self.get_remaining()
+                if alg_timeout and (
+                    remaining is None or alg_timeout < remaining
+                ):
+                    self.limit = alg.name
+                    self.set_timer(alg_timeout)
+                else:
+                    self.limit = "patient"
+                    self.set_timer(remaining)
+            with self.in_alg_dir(idx):
+                self.status = alg.execute(patient=patient)
+            if not self.is_ok():
+                break
+
+    def execute_parallel(self, patient=None):
+        """
+        Pass patient object to execute() method of each algorithm,
+        running concurrently algorithms whose dependencies are satisfied.
+
+        Algorithms are started in list order, as their dependencies
+        complete.  If an algorithm returns a status that isn't ok,
+        no further algorithms are started.  Execution times,
+        and the critical path through the dependencies,
+        are recorded for each patient dataset.
+
+        Parameter
+        ---------
+        patient : skrt.patient.Patient, default=None
+            Object representing patient dataset.
+        """
+        start = time.monotonic()
+        if "processes" == self.parallel:
+            durations = self.execute_in_processes(patient)
+        else:
+            durations = self.execute_in_threads(patient)
+        wall_time = time.monotonic() - start
+
+        path, path_time = get_critical_path(self.alg_deps, durations)
+        path_names = [self.algs[idx].name for idx in path]
+        self.timings.append(
+            {
+                "path": str(getattr(patient, "path", "")),
+                "wall_time": round(wall_time, 3),
+                "critical_path": path_names,
+                "critical_path_time": round(path_time, 3),
+                "alg_times": {
+                    self.algs[idx].name: round(duration, 3)
+                    for idx, duration in sorted(durations.items())
+                },
+            }
+        )
+        print(
+            f"Critical path: {' -> '.join(path_names)} "
+            f"({path_time:.2f} s); wall time: {wall_time:.2f} s; "
+            f"sum of algorithm times: {sum(durations.values()):.2f} s"
+        )
+        with open(TIMING_FILE, "w", encoding="utf-8") as out_file:
+            json.dump(self.timings, out_file, indent=1)
+
+    def get_ready(self, pending=None, done=None, n_running=0):
+        """
+        Return list of indices of algorithms ready to be started.
+
+        Parameters
+        ----------
+        pending : set, default=None
+            Indices of algorithms not yet started.
+
+        done : set, default=None
+            Indices of algorithms completed.
+
+        n_running : int, default=0
+            Number of algorithms running.
+        """
+        ready = [
+            idx
+            for idx in sorted(pending or [])
+            if set(self.alg_deps[idx]) <= (done or set())
+        ]
+        return ready[: max(self.max_workers - n_running, 0)]
+
+    def execute_in_threads(self, patient=None):
+        """
+        Run algorithms for patient dataset in threads.
+
+        Threads can't be interrupted, so algorithms aren't run in threads
+        if time limits are defined.  If an exception is raised, algorithms
+        not yet started are cancelled, but those running aren't waited for.
+
+        Returns dictionary mapping algorithm indices to execution times.
+
+        Parameter
+        ---------
+        patient : skrt.patient.Patient, default=None
+            Object representing patient dataset.
+        """
+
+        def execute_alg(idx):
+            start = time.monotonic()
+            status = self.algs[idx].execute(patient=patient)
+            return (status, time.monotonic() - start)
+
+        pending = set(range(len(self.algs)))
+        done = set()
+        running = {}
+        durations = {}
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            while pending or running:
+                for idx in self.get_ready(pending, done, len(running)):
+                    pending.remove(idx)
+                    running[executor.submit(execute_alg, idx)] = idx
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    idx = running.pop(future)
+                    status, durations[idx] = future.result()
+                    done.add(idx)
+                    if self.is_ok():
+                        self.status = status
+                    if not self.is_ok():
+                        pending.clear()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        return durations
+
+    def execute_in_processes(self, patient=None):
+        """
+        Run algorithms for patient dataset in forked child processes.
+
+        Each child process has a copy-on-write view of the loaded patient
+        dataset.  It runs a single algorithm, then sends back the
+        algorithm's status and changed state, as described for fork_alg(),
+        which are applied to the algorithm in the parent process.  Changes
+        made to the patient object by an algorithm aren't seen by other
+        algorithms.
+
+        Time limits, for the patient dataset and for each algorithm, are
+        enforced by the parent process.  When a limit is reached, or if
+        any other exception is raised, all running child processes are
+        killed and reaped, and PatientTimeout (or the other exception)
+        is raised.
+
+        Returns dictionary mapping algorithm indices to execution times.
+
+        Parameter
+        ---------
+        patient : skrt.patient.Patient, default=None
+            Object representing patient dataset.
+        """
+        # Time limits are enforced here, rather than by SIGALRM,
+        # so that no child process is left running.
+        self.set_timer(0)
+        pending = set(range(len(self.algs)))
+        done = set()
+        running = {}
+        durations = {}
+        with selectors.DefaultSelector() as selector:
+            try:
+                self.select_results(
+                    patient, selector, pending, done, running, durations
+                )
+            except BaseException:
+                for read_fd, (_, pid, _, _) in running.items():
+                    with contextlib.suppress(ProcessLookupError):
+                        os.kill(pid, signal.SIGKILL)
+                    os.waitpid(pid, 0)
+                    os.close(read_fd)
+                raise
+
+        return durations
+
+    def get_deadline(self, running=None):
+        """
+        Return tuple of earliest deadline (monotonic time) for running
+        algorithms, and the limit that it represents, or (None, "")
+        if no time limit applies.
+
+        Parameter
+        ---------
+        running : dict, default=None
+            Dictionary where keys are file descriptors from which results
+            of running algorithms are read, and values are lists of index
+            of algorithm, process identifier, chunks of result, and start
+            time (monotonic).
+        """
+        deadlines = []
+        if self.deadline is not None:
+            deadlines.append((self.deadline, "patient"))
+        for idx, _, _, start in (running or {}).values():
+            if self.alg_timeouts[idx]:
+                deadlines.append(
+                    (start + self.alg_timeouts[idx], self.algs[idx].name)
+                )
+        return min(deadlines, key=lambda item: item[0], default=(None, ""))
+
+    def select_results(
+        self,
+        patient=None,
+        selector=None,
+        pending=None,
+        done=None,
+        running=None,
+        durations=None,
+    ):
+        """
+        Start algorithms in child processes as their dependencies
+        complete, and collect their results, until all have completed,
+        or until an algorithm returns a status that isn't ok.
+
+        PatientTimeout is raised if a time limit is reached.
+
+        Parameters
+        ----------
+        patient : skrt.patient.Patient, default=None
+            Object representing patient dataset.
+
+        selector : selectors.BaseSelector, default=None
+            Selector for reading results from child processes.
+
+        pending : set, default=None
+            Indices of algorithms not yet started.
+
+        done : set, default=None
+            Indices of algorithms completed.
+
+        running : dict, default=None
+            Dictionary of running algorithms, as described for
+            get_deadline(), to which algorithms started are added.
+
+        durations : dict, default=None
+            Dictionary to which execution times of algorithms
+            completed are added.
+        """
+        while pending or running:
+            for idx in self.get_ready(pending, done, len(running)):
+                pending.remove(idx)
+                pid, read_fd = self.fork_alg(idx, patient)
+                running[read_fd] = [idx, pid, [], time.monotonic()]
+                selector.register(read_fd, selectors.EVENT_READ)
+            if not running:
+                break
+
+            deadline, limit = self.get_deadline(running)
+            timeout = None
+            if deadline is not None:
+                timeout = max(deadline - time.monotonic(), 0)
+            events = selector.select(timeout)
+            if not events and deadline is not None:
+                if time.monotonic() >= deadline:
+                    self.limit = limit
+                    raise PatientTimeout()
+
+            for key, _ in events:
+                read_fd = key.fd
+                chunk = os.read(read_fd, 1 << 20)
+                if chunk:
+                    running[read_fd][2].append(chunk)
+                    continue
+                selector.unregister(read_fd)
+                idx, pid, chunks, start = running.pop(read_fd)
+                os.close(read_fd)
+                os.waitpid(pid, 0)
+                durations[idx] = time.monotonic() - start
+                done.add(idx)
+                status = self.apply_result(idx, b"".join(chunks))
+                if self.is_ok():
+                    self.status = status
+                if not self.is_ok():
+                    pending.clear()
+
+    def fork_alg(self, idx=0, patient=None):
+        """
+        Fork child process to run algorithm for patient dataset.
+
+        The child process sends back the status returned by the algorithm,
+        and the attributes of the algorithm that need to be updated in
+        the parent process.  If the algorithm has an attribute
+        parallel_state, listing names of attributes, only these
+        attributes are sent back.  Otherwise, the attributes sent back
+        are those whose serialised values have changed, so that large
+        unchanged state, such as arrays, isn't transferred.
+
+        Background threads may hold locks when a process is forked.
+        Threads reading ahead patient datasets, started by loaders
+        of SkrtLoader, are paused while a process is forked.  Other
+        loaders using background threads shouldn't be combined with
+        running algorithms in processes.
+
+        Returns tuple of child's process identifier, and file descriptor
+        from which the child's result is to be read.
+
+        Parameters
+        ----------
+        idx : int, default=0
+            Index of algorithm to be run.
+
+        patient : skrt.patient.Patient, default=None
+            Object representing patient dataset.
+        """
+        sys.stdout.flush()
+        sys.stderr.flush()
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid:
+            os.close(write_fd)
+            return (pid, read_fd)
+
+        os.close(read_fd)
+        try:
+            alg = self.algs[idx]
+            names = getattr(alg, "parallel_state", None)
+            before = {} if names is not None else get_digests(alg.__dict__)
+            with self.in_alg_dir(idx):
+                status = alg.execute(patient=patient)
+            if names is not None:
+                state = {
+                    name: alg.__dict__[name]
+                    for name in names
+                    if name in alg.__dict__
+                }
+                removed = []
+            else:
+                after = get_digests(alg.__dict__)
+                state = {
+                    name: alg.__dict__[name]
+                    for name, digest in after.items()
+                    if digest is not None and digest != before.get(name)
+                }
+                removed = [name for name in before if name not in after]
+            result = pickle.dumps(
+                (status, state, removed, None),
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        except BaseException as error:
+            traceback.print_exc()
+            result = pickle.dumps((None, None, None, repr(error)))
+        with os.fdopen(write_fd, "wb") as out_file:
+            out_file.write(result)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(0)
+
+    def apply_result(self, idx=0, result=b""):
+        """
+        Apply result from child process to algorithm, and return status.
+
+        Parameters
+        ----------
+        idx : int, default=0
+            Index of algorithm run in child process.
+
+        result : bytes, default=b""
+            Serialised tuple of status, dictionary of attributes updated,
+            list of names of attributes removed, and error message,
+            as sent by child process.
+        """
+        alg = self.algs[idx]
+        try:
+            status, state, removed, error = pickle.loads(result)
+        except (EOFError, pickle.UnpicklingError) as exc:
+            status, state, removed, error = (None, None, None, repr(exc))
+
+        if error is None:
+            for name in removed:
+                alg.__dict__.pop(name, None)
+            alg.__dict__.update(state)
+            return status
+
+        status = copy.copy(alg.status)
+        if status is not None:
+            status.code = 1
+            status.name = "Failed"
+            status.reason = f"Algorithm {alg.name} failed: {error}"
+        return status
+
+    @contextlib.contextmanager
+    def in_alg_dir(self, idx=0):
+        """
+        Context manager for working in algorithm's output directory,
+        if one is defined, creating the directory if needed.
+
+        Parameter
+        ---------
+        idx : int, default=0
+            Index of algorithm in list of algorithms.
+        """
+        alg_dir = self.alg_dirs[idx] if idx < len(self.alg_dirs) else ""
+        if not alg_dir:
+            yield
+            return
+
+        work_dir = os.getcwd()
+        os.makedirs(alg_dir, exist_ok=True)
+        os.chdir(alg_dir)
+        try:
+            yield
+        finally:
+            os.chdir(work_dir)
+
+    def get_state(self):
+        """
+        Return serialised states of algorithms.
+        """
+        return pickle.dumps(
+            [alg.__dict__ for alg in self.algs],
+            protocol=pickle.HIGHEST_PROTOCOL,
+        )
+
+    def set_state(self, state=None):
+        """
+        Restore states of algorithms.
+
+        Parameter
+        ---------
+        state : bytes, default=None
+            Serialised states of algorithms, as returned by get_state().
+        """
+        for alg, alg_state in zip(self.algs, pickle.loads(state)):
+            alg.__dict__.clear()
+            alg.__dict__.update(alg_state)
+
+    def checkpoint(self):
+        """
+        Write checkpoint file, if a checkpoint directory is defined.
+
+        The file is written to a temporary path, then renamed,
+        so that a valid checkpoint file exists at all times.
+        If algorithm states can't be serialised, checkpointing
+        is disabled.
+        """
+        if not self.checkpoint_path:
+            return
+
+        outputs = self.get_outputs()
+        try:
+            checkpoint = pickle.dumps(
+                {
+                    "done": self.done,
+                    "skipped": self.skipped,
+                    "state": self.get_state(),
+                    "status": self.status,
+                    "outputs": outputs,
+                },
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        except (AttributeError, pickle.PicklingError, TypeError) as error:
+            sys.stderr.write(f"Checkpointing disabled: {error}\n")
+            self.checkpoint_path = ""
+            return
+
+        # Copy outputs before writing checkpoint file that refers to them.
+        try:
+            self.copy_outputs(outputs)
+        except OSError as error:
+            sys.stderr.write(f"Checkpoint not updated: {error}\n")
+            return
+
+        os.makedirs(os.path.dirname(self.checkpoint_path), exist_ok=True)
+        tmp_path = f"{self.checkpoint_path}.{os.getpid()}"
+        with open(tmp_path, "wb") as out_file:
+            out_file.write(checkpoint)
+            out_file.flush()
+            os.fsync(out_file.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+        # Delete copies superseded by those of new checkpoint.
+        self.delete_copies(outputs)
+        self.outputs = outputs
+
+    def keep_outputs(self):
+        """
+        Keep copies of output files, for restoring after timeout
+        when there's no checkpointing.
+
+        Only files that are new or modified since copies were last kept
+        are copied, and copies superseded are deleted.
+        """
+        outputs = self.get_outputs()
+        self.copy_outputs(outputs)
+        self.delete_copies(outputs)
+        self.outputs = outputs
+
+    def copy_outputs(self, outputs=None):
+        """
+        Copy output files that are new or modified since copies
+        were last kept.
+
+        Parameter
+        ---------
+        outputs : dict, default=None
+            Dictionary of files to be copied, as returned
+            by get_outputs().
+        """
+        for rel_path, version in (outputs or {}).items():
+            if self.outputs.get(rel_path) != version:
+                copy_file(
+                    os.path.join(self.work_dir, rel_path),
+                    self.get_copy_path(rel_path, version),
+                )
+
+    def delete_copies(self, outputs=None):
+        """
+        Delete copies of output files superseded by new versions.
+
+        Parameter
+        ---------
+        outputs : dict, default=None
+            Dictionary of files for which copies are now kept,
+            as returned by get_outputs().
+        """
+        outputs = outputs or {}
+        for rel_path, version in self.outputs.items():
+            if outputs.get(rel_path) != version:
+                with contextlib.suppress(OSError):
+                    os.remove(self.get_copy_path(rel_path, version))
+
+    def revert_outputs(self):
+        """
+        Restore output files to the versions of which copies were
+        last kept, deleting files created since.
+        """
+        outputs = self.get_outputs()
+        for rel_path in outputs:
+            if rel_path not in self.outputs:
+                os.remove(os.path.join(self.work_dir, rel_path))
+        for rel_path, version in self.outputs.items():
+            if outputs.get(rel_path) != version:
+                copy_file(
+                    self.get_copy_path(rel_path, version),
+                    os.path.join(self.work_dir, rel_path),
+                )
+
+    def get_outputs(self):
+        """
+        Return dictionary of files written by algorithms,
+        in the directories returned by get_output_dirs().
+
+        Keys are paths relative to the working directory, and values
+        are versions, as lists of file size and modification time (ns).
+        Files present when the runner was created, and the contents
+        of the checkpoint directory and of the directory of copies,
+        are excluded.
+        """
+        outputs = {}
+        excluded = {os.path.dirname(self.checkpoint_path), self.copies_dir}
+        for output_dir in self.get_output_dirs():
+            for dir_path, dir_names, file_names in os.walk(output_dir):
+                dir_names[:] = [
+                    dir_name
+                    for dir_name in dir_names
+                    if os.path.join(dir_path, dir_name) not in excluded
+                ]
+                for file_name in file_names:
+                    path = os.path.join(dir_path, file_name)
+                    rel_path = os.path.relpath(path, self.work_dir)
+                    if rel_path in self.inputs or not os.path.isfile(path):
+                        continue
+                    stat = os.stat(path)
+                    outputs[rel_path] = [stat.st_size, stat.st_mtime_ns]
+        return outputs
+
+    def get_output_dirs(self):
+        """
+        Return list of directories where algorithms write files:
+        the output directories of algorithms, and the working directory
+        if any algorithm has no output directory.  Directories inside
+        others listed are omitted.
+        """
+        output_dirs = sorted(
+            {
+                os.path.normpath(
+                    os.path.join(
+                        self.work_dir,
+                        self.alg_dirs[idx] if idx < len(self.alg_dirs) else "",
+                    )
+                )
+                for idx in range(len(self.algs))
+            }
+        )
+        return [
+            output_dir
+            for output_dir in output_dirs
+            if not any(
+                output_dir.startswith(os.path.join(other_dir, ""))
+                for other_dir in output_dirs
+            )
+        ]
+
+    def get_copy_path(self, rel_path="", version=None):
+        """
+        Return path to copy of version of output file.
+
+        Parameters
+        ----------
+        rel_path : str, default=""
+            Path to output file, relative to working directory.
+
+        version : list, default=None
+            File size and modification time (ns), as returned
+            by get_outputs().
+        """
+        size, mtime = version
+        return os.path.join(self.copies_dir, f"{rel_path}.{size}-{mtime}")
+
+    def restore_outputs(self, outputs=None):
+        """
+        Restore output files from checkpoint copies, and delete
+        copies not referenced by the checkpoint.
+
+        Parameter
+        ---------
+        outputs : dict, default=None
+            Dictionary of files to be restored, as returned
+            by get_outputs().
+        """
+        outputs = dict(outputs or {})
+        for rel_path, version in outputs.items():
+            copy_file(
+                self.get_copy_path(rel_path, version),
+                os.path.join(self.work_dir, rel_path),
+            )
+        self.inputs -= set(outputs)
+        self.outputs = outputs
+
+        copies = {
+            self.get_copy_path(rel_path, version)
+            for rel_path, version in outputs.items()
+        }
+        for dir_path, _, file_names in os.walk(self.copies_dir):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                if path not in copies:
+                    os.remove(path)
+
+    def resume(self):
+        """
+        Restore state from checkpoint file, if this exists.
+
+        Returns True if state is restored, or False otherwise.
+        """
+        if not (self.checkpoint_path and os.path.exists(self.checkpoint_path)):
+            return False
+
+        with open(self.checkpoint_path, "rb") as in_file:
+            checkpoint = pickle.load(in_file)
+
+        self.set_state(checkpoint["state"])
+        self.done = list(checkpoint["done"])
+        self.skipped = list(checkpoint["skipped"])
+        self.status = checkpoint["status"]
+        self.restore_outputs(checkpoint.get("outputs"))
+        print(
+            f"Resuming from checkpoint: {len(self.done)} "
+            "patient dataset(s) already processed, "
+            f"{len(self.outputs)} output file(s) restored"
+        )
+
+        return True
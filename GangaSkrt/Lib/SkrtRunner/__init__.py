@@ -0,0 +1,4 @@
+# File: GangaSkrt/Lib/SkrtRunner/__init__.py
+"""Provide worker-side support for running scikit-rt applications."""
+
+from GangaSkrt.Lib.SkrtRunner import SkrtRunner
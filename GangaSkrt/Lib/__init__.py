@@ -4,13 +4,23 @@ Library of scikit-rt plugins for the Ganga job-management framework.
 
 This package contains the following sub-packages:
 
+    - ArchiveMerger: provides for packing output files into an indexed
+      archive;
+    - ArrayMerger: provides for merging NumPy arrays;
     - CsvMerger: provides for merging data in CSV format;
+    - IncrementalMerger: provides base class for mergers that support
+      merging of subjob outputs as subjobs complete;
     - JsonMerger: provides for merging data in JSON format;
+    - MergeFilter: provides selection of fields and rows for mergers;
+    - MergeIndex: provides random-access indexes for merged files;
     - PatientDataset: represents patient datasets;
     - PatientDatasetSplitter: provides for patient-level dataset splitting;
     - PatientImageSplitter: provides for image-level dataset splitting;
     - PatientMvctSplitter: provides for mvct-level dataset splitting
       => deprecated: use PatientImageSplitter;
     - SkrtAlg: defines SkrtAlg application and its runtime handling;
-    - SkrtApp: defines SkrtApp application and its runtime handling.
+    - SkrtApp: defines SkrtApp application and its runtime handling;
+    - SkrtLoader: provides worker-side loaders of patient datasets;
+    - SkrtRunner: provides worker-side support for running
+      scikit-rt applications.
 """
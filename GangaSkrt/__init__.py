@@ -21,6 +21,8 @@ The plugins provided are:
           - PatientMvctSplitter: split datasets at MV CT level
             => deprecated: used PatientImageSplitter;
     - mergers:
+          - ArchiveMerger: pack output files into an indexed archive;
+          - ArrayMerger: merge files of NumPy arrays;
           - CsvMerger: merge files of data in CSV format;
           - JsonMerger: merge files of data in JSON format.
 
@@ -53,6 +55,8 @@ def loadPlugins(config=None):
     during bootstrap, via the loadPlugins() method of
     GangaCore.Utility.Runtime.RuntimePackage.
     """
+    import GangaSkrt.Lib.ArchiveMerger
+    import GangaSkrt.Lib.ArrayMerger
     import GangaSkrt.Lib.CsvMerger
     import GangaSkrt.Lib.JsonMerger
     import GangaSkrt.Lib.PatientDataset
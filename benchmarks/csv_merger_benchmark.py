@@ -0,0 +1,135 @@
+# File: csv_merger_benchmark.py
+"""
+Benchmark of CsvMerger, comparing the python and pyarrow engines,
+for wide tables and for long tables.
+
+Synthetic subjob outputs are written to a temporary directory.  Each is
+a table of per-structure results, with columns of strings, integers and
+floating-point values.  A small fraction of values is left empty, and
+some columns are present only in some files, so that the pyarrow engine
+has to unify schemas and fill in nulls.
+
+The benchmark is run from the command line as:
+
+    ganga csv_merger_benchmark.py [n_file [kb_per_file]]
+
+Two cases are considered, each with approximately the same data size:
+"wide", with 500 columns and few rows per file; and "long", with
+10 columns and many rows per file.  For each case, each engine, and
+each output format (CSV, Parquet), the files are merged, and the
+wall-clock time and output size are reported.  The number of rows
+of each output is checked against the number of rows input.
+"""
+
+import csv
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from GangaSkrt.Lib.CsvMerger.CsvMerger import CsvMerger
+
+
+def write_table(path="", idx=0, n_column=10, n_row=100):
+    """
+    Write synthetic table of results in CSV format.
+
+    Parameters
+    ----------
+    path : str, default=""
+        Path to output file.
+
+    idx : int, default=0
+        Index of file, used in seeding the random-number generator.
+
+    n_column : int, default=10
+        Number of columns in table, including identifier columns.
+        One column in ten is omitted from files with odd index.
+
+    n_row : int, default=100
+        Number of rows in table.
+    """
+    rng = random.Random(idx)
+    labels = ["id", "roi"] + [
+        f"value_{icol:04d}"
+        for icol in range(n_column - 2)
+        if not (idx % 2 and icol % 10 == 9)
+    ]
+    with open(path, "w", newline="", encoding="utf-8") as out_file:
+        writer = csv.writer(out_file, lineterminator="\n")
+        writer.writerow(labels)
+        for irow in range(n_row):
+            row = [f"patient{idx:05d}", f"roi_{irow:05d}"]
+            for label in labels[2:]:
+                if rng.random() < 0.02:
+                    row.append("")
+                elif int(label[-4:]) % 2:
+                    row.append(rng.randint(0, 10**6))
+                else:
+                    row.append(f"{rng.uniform(0, 1000):.6g}")
+            writer.writerow(row)
+
+
+def count_rows(path=""):
+    """
+    Return number of data rows of file in CSV format.
+
+    Parameters
+    ----------
+    path : str, default=""
+        Path to file.
+    """
+    with open(path, newline="", encoding="utf-8") as in_file:
+        return sum(1 for _ in csv.reader(in_file)) - 1
+
+
+if "Ganga" in __name__:
+    args = [int(arg) for arg in sys.argv[1:]]
+    n_file, kb_per_file = (args + [500, 200][len(args) :])[:2]
+
+    work_dir = tempfile.mkdtemp(prefix="csv_merger_benchmark_")
+    try:
+        # Approximate size of one value, including separator, is 8 bytes.
+        n_value = kb_per_file * 1024 // 8
+        cases = {"wide": 500, "long": 10}
+        for case, n_column in cases.items():
+            n_row = max(1, n_value // n_column)
+            case_dir = os.path.join(work_dir, case)
+            os.makedirs(case_dir)
+            in_paths = []
+            for idx in range(n_file):
+                in_paths.append(os.path.join(case_dir, f"in{idx:05d}.csv"))
+                write_table(in_paths[-1], idx, n_column, n_row)
+            size = sum(os.path.getsize(in_path) for in_path in in_paths)
+            print(
+                f"{case}: {n_file} files, {n_column} columns, "
+                f"{n_row} rows per file, {size / 1024**2:.1f} MB"
+            )
+
+            for engine in ["python", "pyarrow"]:
+                for fmt in ["csv", "parquet"]:
+                    merger = CsvMerger(engine=engine, formats=[fmt])
+                    out_path = os.path.join(case_dir, "merged.csv")
+                    start = time.time()
+                    merger.mergefiles(in_paths, out_path)
+                    wall_time = time.time() - start
+
+                    merged_path = f"{os.path.splitext(out_path)[0]}.{fmt}"
+                    out_size = os.path.getsize(merged_path)
+                    check = ""
+                    if "csv" == fmt:
+                        n_merged = count_rows(merged_path)
+                        check = (
+                            "ok" if n_merged == n_file * n_row else "MISMATCH"
+                        )
+                    os.remove(merged_path)
+                    print(
+                        f"{case:>5} {engine:>7} {fmt:>7}: "
+                        f"{wall_time:8.2f} s, "
+                        f"{size / 1024**2 / wall_time:8.1f} MB/s, "
+                        f"{out_size / 1024**2:8.1f} MB {check}"
+                    )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
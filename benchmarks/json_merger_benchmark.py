@@ -0,0 +1,122 @@
+# File: json_merger_benchmark.py
+"""
+Benchmark of JsonMerger, comparing engines for JSON decoding and encoding,
+with and without parallel processing.
+
+Synthetic subjob outputs are written to a temporary directory.  Each is
+a dictionary of per-patient results, with nested dictionaries of values
+for regions of interest, similar in structure to the outputs of
+scikit-rt analysis algorithms.
+
+The benchmark is run from the command line as:
+
+    ganga json_merger_benchmark.py [n_file [kb_per_file [workers]]]
+
+For each combination of engine ("json", "orjson"), number of workers
+(0, and the number given, defaulting to the number of CPUs) and output
+format (JSON list, JSON Lines), the files are merged, and the wall-clock
+time is reported.  The data of each merged file are checked against
+those of the file merged with the json engine and no workers.
+"""
+
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from GangaSkrt.Lib.JsonMerger.JsonMerger import JsonMerger, get_engine
+
+
+def make_record(idx=0, kb_per_file=100):
+    """
+    Return synthetic per-patient results, of approximately given size.
+
+    Parameters
+    ----------
+    idx : int, default=0
+        Index of patient.
+
+    kb_per_file : int, default=100
+        Approximate size (kilobytes) of record encoded as JSON.
+    """
+    rng = random.Random(idx)
+    record = {"id": f"patient{idx:05d}", "status": "ok", "rois": {}}
+    n_roi = max(1, (kb_per_file * 1024) // 400)
+    for iroi in range(n_roi):
+        record["rois"][f"roi_{iroi:04d}"] = {
+            "volume": rng.uniform(0, 1000),
+            "centroid": [rng.uniform(-200, 200) for _ in range(3)],
+            "dice": rng.random(),
+            "label": rng.choice(["parotid_left", "parotid_right", "cord"]),
+            "n_voxel": rng.randint(0, 10**6),
+            "flags": {"valid": rng.random() > 0.1, "note": None},
+        }
+    return record
+
+
+def load_merged(path="", jsonl=False):
+    """
+    Return data of merged file, as list of records.
+
+    Parameters
+    ----------
+    path : str, default=""
+        Path to merged file.
+
+    jsonl : bool, default=False
+        Specify whether merged file is in JSON Lines format.
+    """
+    with open(path, encoding="utf-8") as in_file:
+        if jsonl:
+            return [json.loads(line) for line in in_file]
+        return json.load(in_file)
+
+
+if "Ganga" in __name__:
+    args = [int(arg) for arg in sys.argv[1:]]
+    n_file, kb_per_file, workers = (
+        args + [2000, 100, os.cpu_count() or 1][len(args) :]
+    )
+    if "orjson" != get_engine("auto"):
+        print("orjson not installed - engines compared will be identical")
+
+    work_dir = tempfile.mkdtemp(prefix="json_merger_benchmark_")
+    try:
+        in_paths = []
+        for idx in range(n_file):
+            in_paths.append(os.path.join(work_dir, f"in{idx:05d}.json"))
+            with open(in_paths[-1], "w", encoding="utf-8") as out_file:
+                json.dump(make_record(idx, kb_per_file), out_file)
+        size = sum(os.path.getsize(in_path) for in_path in in_paths)
+        print(
+            f"{n_file} files, {size / 1024**2:.1f} MB, "
+            f"{os.cpu_count()} CPUs"
+        )
+
+        for jsonl in [False, True]:
+            reference = None
+            for engine in ["json", "orjson"]:
+                for n_worker in [0, workers]:
+                    merger = JsonMerger(
+                        engine=engine, workers=n_worker, jsonl=jsonl
+                    )
+                    out_path = os.path.join(work_dir, "merged.json")
+                    start = time.time()
+                    merger.mergefiles(in_paths, out_path)
+                    wall_time = time.time() - start
+
+                    data = load_merged(out_path, jsonl)
+                    if reference is None:
+                        reference = data
+                    check = "ok" if data == reference else "MISMATCH"
+                    label = "jsonl" if jsonl else "json"
+                    print(
+                        f"{label:>5} {engine:>6} workers={n_worker:<3}: "
+                        f"{wall_time:8.2f} s, "
+                        f"{n_file / wall_time:8.1f} files/s, {check}"
+                    )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
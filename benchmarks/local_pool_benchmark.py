@@ -0,0 +1,169 @@
+# File: local_pool_benchmark.py
+"""
+Benchmark of throughput for SkrtApp subjobs run with the Local backend,
+with and without memory-aware admission control (local_pool).
+
+Each subjob runs an algorithm that, for each patient dataset, allocates
+a configurable amount of memory and keeps the CPU busy for a configurable
+time.  Patient datasets are dummy paths, loaded by a minimal patient class,
+so that no data are needed.
+
+The benchmark is run from the command line as:
+
+    ganga local_pool_benchmark.py [n_subjob [patients_per_subjob
+        [memory_mb [seconds]]]]
+
+For each mode, a job is submitted, and its completion is awaited.
+Throughput is reported as patient datasets processed per second of
+wall-clock time, from submission to completion.  With the plain Local
+backend, all subjobs start at once, so that CPUs are oversubscribed and,
+if the combined footprint exceeds the memory of the node, subjobs may be
+killed or the node may swap.  With local_pool, the number of subjobs
+running at any time is limited by the CPUs and memory available.
+"""
+
+import os
+import sys
+import time
+
+from skrt.application import Algorithm
+from skrt.core import fullpath
+
+
+class DummyPatient:
+    """
+    Minimal patient class, for which no data are needed.
+    """
+
+    def __init__(self, path="", **kwargs):
+        self.path = path
+        self.id = os.path.basename(path)
+
+
+class LoadAlgorithm(Algorithm):
+    """
+    Algorithm allocating memory and using CPU for each patient dataset.
+    """
+
+    def __init__(self, opts={}, name=None, log_level="INFO"):
+        """
+        Create instance of LoadAlgorithm.
+
+        Parameters
+        ----------
+        opts : dict, default={}
+            Dictionary of options, the keys of which are mapped
+            to instance attributes.
+        name : str/None, default=None
+            Name to be associated with algorithm instance; if None,
+            the instance name is set to the class name.
+        log_level : str, default='INFO'
+            Severity level for event logging.
+        """
+        # Memory (MB) to allocate for each patient dataset.
+        self.memory_mb = 500
+        # Time (seconds) of CPU use for each patient dataset.
+        self.seconds = 5
+
+        Algorithm.__init__(self, opts, name, log_level)
+
+    def execute(self, patient=None):
+        """
+        Allocate memory, and use CPU, for patient dataset.
+
+        Parameter:
+        patient : DummyPatient
+            Patient object for which processing is to be performed.
+        """
+        data = bytearray(self.memory_mb * 1024**2)
+        end = time.monotonic() + self.seconds
+        while time.monotonic() < end:
+            for idx in range(0, len(data), 4096):
+                data[idx] = (data[idx] + 1) % 256
+        print(f"{patient.id}: {self.memory_mb} MB, {self.seconds} s")
+
+        return self.status
+
+
+def run_job(mode="", n_subjob=0, patients_per_subjob=1, opts=None):
+    """
+    Submit job, wait for completion, and return tuple of
+    status and wall-clock time (seconds).
+
+    Parameters
+    ----------
+    mode : str, default=""
+        Mode of running: "local" for plain Local backend,
+        or "local_pool" for running with admission control.
+
+    n_subjob : int, default=0
+        Number of subjobs.
+
+    patients_per_subjob : int, default=1
+        Number of patient datasets for each subjob.
+
+    opts : dict, default=None
+        Dictionary of options for LoadAlgorithm.
+    """
+    alg = SkrtAlg(
+        alg_class="LoadAlgorithm",
+        alg_module=fullpath(sys.argv[0]),
+        alg_name="load",
+        opts=dict(opts or {}),
+    )
+    app = SkrtApp(
+        algs=[alg],
+        patient_class="local_pool_benchmark.DummyPatient",
+    )
+    if "local_pool" == mode:
+        app.local_pool = {
+            "memory_per_subjob": f"{opts['memory_mb'] + 150}M",
+        }
+
+    paths = [
+        f"/benchmark/patient{idx:05d}"
+        for idx in range(n_subjob * patients_per_subjob)
+    ]
+
+    j = Job(
+        application=app,
+        backend=Local(),
+        inputdata=PatientDataset(paths=paths),
+        splitter=PatientDatasetSplitter(
+            patients_per_subjob=patients_per_subjob
+        ),
+        name=f"local_pool_benchmark_{mode}",
+    )
+
+    start = time.time()
+    j.submit()
+    while j.status not in ["completed", "failed", "killed"]:
+        time.sleep(2)
+    wall_time = time.time() - start
+
+    return (j.status, wall_time)
+
+
+if "Ganga" in __name__:
+    args = [int(arg) for arg in sys.argv[1:]]
+    n_subjob, patients_per_subjob, memory_mb, seconds = (
+        args + [4 * (os.cpu_count() or 1), 2, 500, 5][len(args) :]
+    )
+    n_patient = n_subjob * patients_per_subjob
+    opts = {"memory_mb": memory_mb, "seconds": seconds}
+
+    print(
+        f"{n_subjob} subjobs x {patients_per_subjob} patients, "
+        f"{memory_mb} MB and {seconds} s per patient, "
+        f"{os.cpu_count()} CPUs"
+    )
+    results = {}
+    for mode in ["local", "local_pool"]:
+        status, wall_time = run_job(mode, n_subjob, patients_per_subjob, opts)
+        results[mode] = wall_time
+        print(
+            f"{mode:>12}: {status:>9}, {wall_time:8.1f} s, "
+            f"{n_patient / wall_time:8.3f} patients/s"
+        )
+    speed_up = results["local"] / results["local_pool"]
+    print(f"Speed-up with local_pool: {speed_up:.2f}")
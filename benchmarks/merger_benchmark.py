@@ -0,0 +1,698 @@
+# File: merger_benchmark.py
+"""
+Benchmark suite for GangaSkrt mergers, with regression checking.
+
+Synthetic subjob output directories are written to a temporary directory.
+Each contains a file of CSV data, a file of JSON data and, if numpy is
+installed, a file of NumPy array data.  The number of files, the number
+of rows per file, the number of columns, the heterogeneity of columns
+across files, and the nesting depth of JSON records are configurable.
+
+Each merger is then run, for each of several engines and modes, with
+each run in a forked process, so that peak memory use is measured
+independently.  For each run, the wall-clock time, throughput, peak
+resident-set size (of the merging process, and of any worker processes)
+and output size are recorded to a results file in JSON format.  Runs
+requiring packages that aren't installed (pyarrow, orjson, numpy)
+are skipped.
+
+The benchmark is run from the command line as, for example:
+
+    ganga merger_benchmark.py --files 500 --rows 200 \\
+        --results results.json --baseline baseline.json
+
+A results file from an earlier run, for example on a reference commit,
+can be used as baseline.  A regression is reported for any run whose
+throughput is lower, or whose peak memory use or output size is higher,
+than for the baseline by more than the threshold (default 20%).  If any
+regression is found, the benchmark exits with status 1.  Results are
+compared only for runs present in both files, and a warning is printed
+if the benchmark configurations differ.
+
+For options, see:
+
+    ganga merger_benchmark.py --help
+"""
+
+import argparse
+import csv
+import importlib.util
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from GangaSkrt.Lib.ArchiveMerger.ArchiveMerger import ArchiveMerger
+from GangaSkrt.Lib.ArrayMerger.ArrayMerger import ArrayMerger
+from GangaSkrt.Lib.CsvMerger.CsvMerger import CsvMerger
+from GangaSkrt.Lib.JsonMerger.JsonMerger import JsonMerger
+
+# Absolute tolerance (MB) on peak memory use, in addition to the
+# relative threshold, so that small fluctuations aren't reported.
+RSS_SLACK_MB = 16
+
+
+def write_csv(path="", idx=0, config=None):
+    """
+    Write synthetic subjob output in CSV format.
+
+    Each file has identifier columns "id" and "roi", and value columns
+    alternating between floating-point and integer values, with 2% of
+    values left empty.  For heterogeneity h, each value column is
+    omitted with probability h, and column order is shuffled with
+    probability h.
+
+    Parameters
+    ----------
+    path : str, default=""
+        Path to output file.
+
+    idx : int, default=0
+        Index of subjob, used in seeding the random-number generator.
+
+    config : dict, default=None
+        Benchmark configuration.
+    """
+    rng = random.Random(idx)
+    heterogeneity = config["heterogeneity"]
+    labels = [
+        f"value_{icol:04d}"
+        for icol in range(config["columns"])
+        if rng.random() >= heterogeneity
+    ]
+    labels = ["id", "roi"] + labels
+    if rng.random() < heterogeneity:
+        rng.shuffle(labels)
+
+    with open(path, "w", newline="", encoding="utf-8") as out_file:
+        writer = csv.writer(out_file, lineterminator="\n")
+        writer.writerow(labels)
+        for irow in range(config["rows"]):
+            row = []
+            for label in labels:
+                if "id" == label:
+                    row.append(f"patient{idx:06d}")
+                elif "roi" == label:
+                    row.append(f"roi_{irow:05d}")
+                elif rng.random() < 0.02:
+                    row.append("")
+                elif int(label[-4:]) % 2:
+                    row.append(rng.randint(0, 10**6))
+                else:
+                    row.append(f"{rng.random():.6g}")
+            writer.writerow(row)
+
+
+def make_nested(rng=None, depth=1, width=4, heterogeneity=0):
+    """
+    Return synthetic nested dictionary of results.
+
+    Parameters
+    ----------
+    rng : random.Random, default=None
+        Random-number generator.
+
+    depth : int, default=1
+        Number of levels of nesting.
+
+    width : int, default=4
+        Number of keys at each level.
+
+    heterogeneity : float, default=0
+        Probability with which each key is omitted.
+    """
+    if depth <= 0:
+        return rng.choice(
+            [
+                rng.random(),
+                rng.randint(0, 10**6),
+                [rng.random() for _ in range(3)],
+                rng.choice(["ok", "warning", "error"]),
+            ]
+        )
+    return {
+        f"key_{ikey}": make_nested(rng, depth - 1, width, heterogeneity)
+        for ikey in range(width)
+        if rng.random() >= heterogeneity
+    }
+
+
+def write_json(path="", idx=0, config=None):
+    """
+    Write synthetic subjob output in JSON format.
+
+    The output is a dictionary of per-patient results, with one entry
+    for each of a number of regions of interest equal to one tenth
+    of the number of rows of CSV files (at least 1), each being
+    a nested dictionary.
+
+    Parameters
+    ----------
+    path : str, default=""
+        Path to output file.
+
+    idx : int, default=0
+        Index of subjob, used in seeding the random-number generator.
+
+    config : dict, default=None
+        Benchmark configuration.
+    """
+    rng = random.Random(-1 - idx)
+    record = {
+        "id": f"patient{idx:06d}",
+        "status": rng.choice(["ok", "ok", "ok", "failed"]),
+        "dice": rng.random(),
+        "rois": {
+            f"roi_{iroi:05d}": make_nested(
+                rng, config["nesting"], 4, config["heterogeneity"]
+            )
+            for iroi in range(max(1, config["rows"] // 10))
+        },
+    }
+    with open(path, "w", encoding="utf-8") as out_file:
+        json.dump(record, out_file)
+
+
+def write_array(path="", idx=0, config=None):
+    """
+    Write synthetic subjob output in .npy format.
+
+    The output is an array of floating-point values, with shape
+    given by the numbers of rows and of columns.
+
+    Parameters
+    ----------
+    path : str, default=""
+        Path to output file.
+
+    idx : int, default=0
+        Index of subjob, used in seeding the random-number generator.
+
+    config : dict, default=None
+        Benchmark configuration.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(idx)
+    np.save(path, rng.random((config["rows"], config["columns"])))
+
+
+def is_installed(package=""):
+    """
+    Return True if package can be imported, and False otherwise.
+
+    Parameters
+    ----------
+    package : str, default=""
+        Name of package.
+    """
+    return importlib.util.find_spec(package) is not None
+
+
+def generate(work_dir="", config=None):
+    """
+    Write synthetic subjob output directories.
+
+    Returns dictionary where keys are input types ("csv", "json", "npy",
+    "all") and values are lists of paths to input files.
+
+    Parameters
+    ----------
+    work_dir : str, default=""
+        Directory in which subjob output directories are to be written.
+
+    config : dict, default=None
+        Benchmark configuration.
+    """
+    writers = {"csv": write_csv, "json": write_json}
+    if is_installed("numpy"):
+        writers["npy"] = write_array
+
+    in_paths = {kind: [] for kind in writers}
+    for idx in range(config["files"]):
+        out_dir = os.path.join(work_dir, "jobs", str(idx), "output")
+        os.makedirs(out_dir)
+        for kind, writer in writers.items():
+            in_paths[kind].append(os.path.join(out_dir, f"results.{kind}"))
+            writer(in_paths[kind][-1], idx, config)
+    in_paths["all"] = sorted(
+        path for kind in writers for path in in_paths[kind]
+    )
+    return in_paths
+
+
+def get_cases(workers=2):
+    """
+    Return dictionary of benchmark cases.
+
+    Keys are case names, and values are tuples of merger class,
+    dictionary of merger attributes, input type, name of output file
+    whose size is recorded, mode ("merge" or "incremental"), and list
+    of packages required.
+
+    Parameters
+    ----------
+    workers : int, default=2
+        Number of worker processes, for cases with parallel merging.
+    """
+    selection = {
+        "columns": ["id", "roi", "value_0000"],
+        "where": "value_0000 < 0.5",
+    }
+    return {
+        "csv-python": (CsvMerger, {}, "csv", "merged.csv", "merge", []),
+        "csv-python-workers": (
+            CsvMerger,
+            {"workers": workers},
+            "csv",
+            "merged.csv",
+            "merge",
+            [],
+        ),
+        "csv-python-fan-in": (
+            CsvMerger,
+            {"fan_in": 16},
+            "csv",
+            "merged.csv",
+            "merge",
+            [],
+        ),
+        "csv-python-incremental": (
+            CsvMerger,
+            {"incremental": True},
+            "csv",
+            "merged.csv",
+            "incremental",
+            [],
+        ),
+        "csv-python-keys": (
+            CsvMerger,
+            {"keys": ["id", "roi"]},
+            "csv",
+            "merged.csv",
+            "merge",
+            [],
+        ),
+        "csv-python-where": (
+            CsvMerger,
+            selection,
+            "csv",
+            "merged.csv",
+            "merge",
+            [],
+        ),
+        "csv-python-parquet": (
+            CsvMerger,
+            {"formats": ["parquet"]},
+            "csv",
+            "merged.parquet",
+            "merge",
+            ["pyarrow"],
+        ),
+        "csv-pyarrow": (
+            CsvMerger,
+            {"engine": "pyarrow"},
+            "csv",
+            "merged.csv",
+            "merge",
+            ["pyarrow"],
+        ),
+        "csv-pyarrow-parquet": (
+            CsvMerger,
+            {"engine": "pyarrow", "formats": ["parquet"]},
+            "csv",
+            "merged.parquet",
+            "merge",
+            ["pyarrow"],
+        ),
+        "json-json": (
+            JsonMerger,
+            {"engine": "json"},
+            "json",
+            "merged.json",
+            "merge",
+            [],
+        ),
+        "json-json-workers": (
+            JsonMerger,
+            {"engine": "json", "workers": workers},
+            "json",
+            "merged.json",
+            "merge",
+            [],
+        ),
+        "json-json-jsonl": (
+            JsonMerger,
+            {"engine": "json", "jsonl": True},
+            "json",
+            "merged.json",
+            "merge",
+            [],
+        ),
+        "json-orjson-jsonl": (
+            JsonMerger,
+            {"engine": "orjson", "jsonl": True},
+            "json",
+            "merged.json",
+            "merge",
+            ["orjson"],
+        ),
+        "json-json-fan-in": (
+            JsonMerger,
+            {"engine": "json", "fan_in": 16},
+            "json",
+            "merged.json",
+            "merge",
+            [],
+        ),
+        "json-json-incremental": (
+            JsonMerger,
+            {"engine": "json", "incremental": True},
+            "json",
+            "merged.json",
+            "incremental",
+            [],
+        ),
+        "json-json-where": (
+            JsonMerger,
+            {
+                "engine": "json",
+                "columns": ["id", "dice"],
+                "where": "dice < 0.5",
+            },
+            "json",
+            "merged.json",
+            "merge",
+            [],
+        ),
+        "array": (ArrayMerger, {}, "npy", "merged.npy", "merge", ["numpy"]),
+        "archive": (ArchiveMerger, {}, "all", "merged.tar", "merge", []),
+    }
+
+
+def get_peak_rss_mb():
+    """
+    Return peak resident-set size (MB) of current process.
+    """
+    try:
+        with open("/proc/self/status", encoding="utf-8") as status_file:
+            for line in status_file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def reset_peak_rss():
+    """
+    Reset peak resident-set size of current process to current size,
+    where supported (Linux), so that a forked process doesn't inherit
+    the peak of its parent.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="utf-8") as refs:
+            refs.write("5")
+    except OSError:
+        pass
+
+
+def run_case(case=None, in_paths=None, out_dir=""):
+    """
+    Run benchmark case, and return dictionary of measurements.
+
+    Parameters
+    ----------
+    case : tuple, default=None
+        Tuple defining case, as returned in get_cases().
+
+    in_paths : list, default=None
+        List of paths to input files.
+
+    out_dir : str, default=""
+        Directory where merger output is to be written.
+    """
+    reset_peak_rss()
+    merger_class, attributes, _, out_name, mode, _ = case
+    merger = merger_class(**attributes)
+    # Columnar formats are written alongside a path with CSV suffix.
+    if out_name.endswith(".parquet"):
+        out_path = os.path.join(out_dir, "merged.csv")
+    else:
+        out_path = os.path.join(out_dir, out_name)
+
+    start = time.time()
+    if "incremental" == mode:
+        for in_path in in_paths:
+            merger.fold([in_path], out_path)
+        merger.finalise(out_path)
+    else:
+        merger.mergefiles(in_paths, out_path)
+    wall_time = max(time.time() - start, 1e-6)
+
+    in_bytes = sum(os.path.getsize(in_path) for in_path in in_paths)
+    return {
+        "status": "ok",
+        "wall_time_s": wall_time,
+        "files_per_s": len(in_paths) / wall_time,
+        "mb_per_s": in_bytes / 1024**2 / wall_time,
+        "peak_rss_mb": get_peak_rss_mb(),
+        "worker_peak_rss_mb": (
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+        ),
+        "output_bytes": os.path.getsize(os.path.join(out_dir, out_name)),
+    }
+
+
+def run_forked(case=None, in_paths=None, out_dir=""):
+    """
+    Run benchmark case in forked process, and return dictionary
+    of measurements, or of error status.
+
+    Parameters
+    ----------
+    case : tuple, default=None
+        Tuple defining case, as returned in get_cases().
+
+    in_paths : list, default=None
+        List of paths to input files.
+
+    out_dir : str, default=""
+        Directory where merger output is to be written.
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if not pid:
+        os.close(read_fd)
+        exit_status = 0
+        try:
+            result = run_case(case, in_paths, out_dir)
+        except BaseException as error:
+            result = {"status": f"error: {type(error).__name__}: {error}"}
+            exit_status = 1
+        with os.fdopen(write_fd, "w", encoding="utf-8") as pipe:
+            json.dump(result, pipe)
+        os._exit(exit_status)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd, encoding="utf-8") as pipe:
+        text = pipe.read()
+    os.waitpid(pid, 0)
+    return json.loads(text) if text else {"status": "error: no result"}
+
+
+def compare(results=None, baseline=None, threshold=0.2):
+    """
+    Return list of descriptions of regressions relative to baseline.
+
+    Parameters
+    ----------
+    results : dict, default=None
+        Dictionary where keys are case names, and values are
+        dictionaries of measurements.
+
+    baseline : dict, default=None
+        Dictionary of baseline measurements, in the same format
+        as results.
+
+    threshold : float, default=0.2
+        Fractional change beyond which a change is a regression.
+    """
+    regressions = []
+    for name, result in (results or {}).items():
+        reference = (baseline or {}).get(name, {})
+        if "ok" != result.get("status") or "ok" != reference.get("status"):
+            continue
+        if result["mb_per_s"] < reference["mb_per_s"] * (1 - threshold):
+            regressions.append(
+                f"{name}: throughput {result['mb_per_s']:.2f} MB/s, "
+                f"baseline {reference['mb_per_s']:.2f} MB/s"
+            )
+        for metric, slack in [
+            ("peak_rss_mb", RSS_SLACK_MB),
+            ("worker_peak_rss_mb", RSS_SLACK_MB),
+            ("output_bytes", 0),
+        ]:
+            if result[metric] > reference[metric] * (1 + threshold) + slack:
+                regressions.append(
+                    f"{name}: {metric} {result[metric]:.1f}, "
+                    f"baseline {reference[metric]:.1f}"
+                )
+    return regressions
+
+
+def parse_args(args=None):
+    """
+    Return benchmark options, parsed from command-line arguments.
+
+    Parameters
+    ----------
+    args : list, default=None
+        List of command-line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog="merger_benchmark.py",
+        description="Benchmark GangaSkrt mergers on synthetic data.",
+    )
+    parser.add_argument(
+        "--files", type=int, default=200, help="number of subjob outputs"
+    )
+    parser.add_argument(
+        "--rows", type=int, default=1000, help="rows per CSV file"
+    )
+    parser.add_argument(
+        "--columns", type=int, default=20, help="value columns per CSV file"
+    )
+    parser.add_argument(
+        "--heterogeneity",
+        type=float,
+        default=0.1,
+        help="probability of omitting a column or JSON key",
+    )
+    parser.add_argument(
+        "--nesting", type=int, default=3, help="nesting depth of JSON data"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=max(2, min(4, os.cpu_count() or 1)),
+        help="worker processes for parallel cases",
+    )
+    parser.add_argument(
+        "--cases",
+        default="",
+        help="comma-separated substrings selecting cases to run",
+    )
+    parser.add_argument(
+        "--results",
+        default="merger_benchmark_results.json",
+        help="path to results file to be written",
+    )
+    parser.add_argument(
+        "--baseline", default="", help="path to baseline results file"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="fractional change reported as regression",
+    )
+    return parser.parse_args(args)
+
+
+if "Ganga" in __name__:
+    options = parse_args(sys.argv[1:])
+    config = {
+        key: getattr(options, key)
+        for key in [
+            "files",
+            "rows",
+            "columns",
+            "heterogeneity",
+            "nesting",
+            "workers",
+        ]
+    }
+    cases = {
+        name: case
+        for name, case in get_cases(options.workers).items()
+        if not options.cases
+        or any(part in name for part in options.cases.split(","))
+    }
+
+    work_dir = tempfile.mkdtemp(prefix="merger_benchmark_")
+    try:
+        start = time.time()
+        in_paths = generate(work_dir, config)
+        print(
+            f"Generated {config['files']} subjob outputs in "
+            f"{time.time() - start:.1f} s: "
+            + ", ".join(
+                f"{kind} {sum(map(os.path.getsize, paths)) / 1024**2:.1f} MB"
+                for kind, paths in in_paths.items()
+                if "all" != kind
+            )
+        )
+
+        results = {}
+        for name, case in cases.items():
+            missing = [
+                package for package in case[5] if not is_installed(package)
+            ]
+            if missing:
+                results[name] = {"status": f"skipped: requires {missing}"}
+            else:
+                out_dir = os.path.join(work_dir, "out", name)
+                os.makedirs(out_dir)
+                results[name] = run_forked(case, in_paths[case[2]], out_dir)
+                shutil.rmtree(out_dir, ignore_errors=True)
+
+            result = results[name]
+            if "ok" == result["status"]:
+                print(
+                    f"{name:>24}: {result['wall_time_s']:8.2f} s, "
+                    f"{result['mb_per_s']:8.2f} MB/s, "
+                    f"peak RSS {result['peak_rss_mb']:7.1f} MB "
+                    f"(workers {result['worker_peak_rss_mb']:7.1f} MB), "
+                    f"output {result['output_bytes'] / 1024**2:8.2f} MB"
+                )
+            else:
+                print(f"{name:>24}: {result['status']}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(options.results, "w", encoding="utf-8") as out_file:
+        json.dump(
+            {
+                "config": config,
+                "host": {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "cpus": os.cpu_count(),
+                },
+                "results": results,
+            },
+            out_file,
+            indent=1,
+        )
+    print(f"Results written to {options.results}")
+
+    if options.baseline:
+        with open(options.baseline, encoding="utf-8") as in_file:
+            baseline = json.load(in_file)
+        if baseline.get("config") != config:
+            print(
+                "Warning: benchmark configuration differs from baseline: "
+                f"{baseline.get('config')}"
+            )
+        regressions = compare(results, baseline["results"], options.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {options.threshold:.0%} of baseline")
@@ -13,7 +13,11 @@ setup(
         "ganga",
         "in_place",
     ],
-    scripts=["examples/bin/create_config", "examples/bin/create_setup"],
+    scripts=[
+        "examples/bin/create_config",
+        "examples/bin/create_header_index",
+        "examples/bin/create_setup",
+    ],
     classifiers=[
         "Development Status :: 1 - Planning",
         "Intended Audience :: Science/Research",
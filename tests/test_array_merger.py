@@ -0,0 +1,113 @@
+# File: tests/test_array_merger.py
+"""
+Tests for merging of files of NumPy arrays.
+"""
+
+import os
+import zipfile
+
+import pytest
+
+pytest.importorskip("GangaCore")
+np = pytest.importorskip("numpy")
+
+from GangaSkrt.Lib.ArrayMerger.ArrayMerger import (  # noqa: E402
+    get_source,
+    merge_arrays,
+    write_provenance,
+)
+
+
+def save(path, array=None, **arrays):
+    """Save array in .npy format, or named arrays in .npz format."""
+    if arrays:
+        np.savez(path, **arrays)
+    else:
+        np.save(path, array)
+    return str(path)
+
+
+@pytest.mark.parametrize("block_size", [None, 24])
+def test_merge_npy(tmp_path, block_size):
+    """Arrays are concatenated, with provenance of rows."""
+    arrays = [np.arange(12.0).reshape(4, 3), np.arange(6).reshape(2, 3)]
+    in_paths = [
+        save(tmp_path / f"in{idx}.npy", array)
+        for idx, array in enumerate(arrays)
+    ]
+    out_path = str(tmp_path / "out.npy")
+    provenance = merge_arrays(in_paths, out_path, block_size=block_size)
+    np.testing.assert_array_equal(np.load(out_path), np.concatenate(arrays))
+    write_provenance(out_path, provenance)
+    assert get_source(out_path, 3) == in_paths[0]
+    assert get_source(out_path, 4) == in_paths[1]
+    assert get_source(out_path, 6) is None
+
+
+@pytest.mark.parametrize("suffix", [".npy", ".npz"])
+@pytest.mark.parametrize("block_size", [None, 40])
+def test_merge_fortran(tmp_path, suffix, block_size):
+    """Arrays in Fortran order are merged in C order."""
+    arrays = [
+        np.asfortranarray(np.arange(60.0).reshape(5, 4, 3)),
+        np.arange(24.0).reshape(2, 4, 3) + 100,
+    ]
+    if ".npz" == suffix:
+        in_paths = [
+            save(tmp_path / f"in{idx}.npz", dose=array)
+            for idx, array in enumerate(arrays)
+        ]
+    else:
+        in_paths = [
+            save(tmp_path / f"in{idx}.npy", array)
+            for idx, array in enumerate(arrays)
+        ]
+    out_path = str(tmp_path / f"out{suffix}")
+    merge_arrays(in_paths, out_path, block_size=block_size)
+    merged = np.load(out_path)
+    if ".npz" == suffix:
+        merged = merged["dose"]
+    np.testing.assert_array_equal(merged, np.concatenate(arrays))
+    assert merged.flags.c_contiguous
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        [os.path.basename(path) for path in in_paths + [out_path]]
+    )
+
+
+def test_merge_npz(tmp_path):
+    """Named arrays are merged separately, to stored archive members."""
+    in_paths = [
+        save(tmp_path / f"in{idx}.npz", a=np.full(idx + 1, idx), b=idx)
+        for idx in range(3)
+    ]
+    out_path = str(tmp_path / "out.npz")
+    provenance = merge_arrays(in_paths, out_path, stack=False)
+    with np.load(out_path) as merged:
+        np.testing.assert_array_equal(merged["a"], [0, 1, 1, 2, 2, 2])
+        np.testing.assert_array_equal(merged["b"], [0, 1, 2])
+    assert [rows[1:] for rows in provenance["a"]] == [[0, 1], [1, 3], [3, 6]]
+    with zipfile.ZipFile(out_path) as archive:
+        assert {info.compress_type for info in archive.infolist()} == {
+            zipfile.ZIP_STORED
+        }
+
+
+def test_merge_npz_to_npy(tmp_path):
+    """Single array of .npz files is merged to .npy file."""
+    in_paths = [
+        save(tmp_path / f"in{idx}.npz", dvh=np.full((2, 2), idx))
+        for idx in range(2)
+    ]
+    out_path = str(tmp_path / "out.npy")
+    provenance = merge_arrays(in_paths, out_path, stack=True)
+    merged = np.load(out_path)
+    assert merged.shape == (2, 2, 2)
+    np.testing.assert_array_equal(merged[1], np.ones((2, 2)))
+    assert list(provenance) == [""]
+
+
+def test_merge_npz_to_npy_several(tmp_path):
+    """Several arrays of .npz files can't be merged to .npy file."""
+    in_paths = [save(tmp_path / "in.npz", a=np.zeros(2), b=np.ones(2))]
+    with pytest.raises(AssertionError, match="single array"):
+        merge_arrays(in_paths, str(tmp_path / "out.npy"))
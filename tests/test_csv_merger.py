@@ -0,0 +1,102 @@
+# File: tests/test_csv_merger.py
+"""
+Tests for merging of files of data in CSV format.
+"""
+
+import pytest
+
+pytest.importorskip("GangaCore")
+
+from GangaSkrt.Lib.CsvMerger.CsvMerger import CsvMerger  # noqa: E402
+
+INPUTS = [
+    "id,roi,dice\np1,cord,0.9\n\np1,parotid,0.5\n",
+    "dice,id,volume\n0.99,p2,12\n",
+    "id,roi\np3,cord\n",
+]
+
+MERGED = (
+    "dice,id,roi,volume\n"
+    "0.9,p1,cord,\n"
+    "0.5,p1,parotid,\n"
+    "0.99,p2,,12\n"
+    ",p3,cord,\n"
+)
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    """Create input files, one for each subjob."""
+    paths = []
+    for idx, text in enumerate(INPUTS):
+        path = tmp_path / f"in{idx}.csv"
+        path.write_text(text, encoding="utf-8")
+        paths.append(str(path))
+    return paths
+
+
+def get_merger(**kwargs):
+    """Return CsvMerger, with attributes set as given."""
+    merger = CsvMerger()
+    merger.ignorefailed = False
+    for name, value in kwargs.items():
+        setattr(merger, name, value)
+    return merger
+
+
+def merge(in_paths, out_path, **kwargs):
+    """Merge inputs, returning text of merged file."""
+    get_merger(**kwargs).mergefiles(in_paths, out_path)
+    with open(out_path, encoding="utf-8") as in_file:
+        return in_file.read()
+
+
+@pytest.mark.parametrize(
+    "kwargs", [{}, {"workers": 2}, {"fan_in": 2}, {"fan_in": 2, "workers": 2}]
+)
+def test_merge(tmp_path, inputs, kwargs):
+    """Rows are streamed with columns mapped to union of labels."""
+    assert merge(inputs, str(tmp_path / "out.csv"), **kwargs) == MERGED
+
+
+@pytest.mark.parametrize("kwargs", [{}, {"workers": 2}, {"fan_in": 2}])
+def test_select(tmp_path, inputs, kwargs):
+    """Columns and rows are selected as inputs are streamed."""
+    text = merge(
+        inputs,
+        str(tmp_path / "out.csv"),
+        columns=["id", "dice"],
+        where="dice > 0.6 or roi == 'cord'",
+        **kwargs,
+    )
+    assert text == "id,dice\np1,0.9\np2,0.99\np3,\n"
+
+
+@pytest.mark.parametrize(
+    "keep, expected",
+    [
+        ("first", "p1,cord,0.9\np2,,0.99\np3,cord,\n"),
+        ("last", "p1,parotid,0.5\np2,,0.99\np3,cord,\n"),
+    ],
+)
+def test_keys(tmp_path, inputs, keep, expected):
+    """Rows are sorted by key, with duplicates removed."""
+    text = merge(
+        inputs[::-1],
+        str(tmp_path / "out.csv"),
+        columns=["id", "roi", "dice"],
+        keys=["id"],
+        keep=keep,
+    )
+    assert text == "id,roi,dice\n" + expected
+
+
+def test_incremental(tmp_path, inputs):
+    """Folding inputs with new labels rewrites header row."""
+    out_path = str(tmp_path / "out.csv")
+    merger = get_merger(incremental=True)
+    for in_path in inputs:
+        merger.fold([in_path], out_path)
+    merger.finalise(out_path)
+    with open(out_path, encoding="utf-8") as in_file:
+        assert in_file.read() == MERGED
@@ -0,0 +1,104 @@
+# File: tests/test_incremental_merger.py
+"""
+Tests for incremental and hierarchical merging.
+"""
+
+import os
+
+import pytest
+
+pytest.importorskip("GangaCore")
+
+from GangaSkrt.Lib.IncrementalMerger.IncrementalMerger import (  # noqa: E402
+    IncrementalMerger,
+    read_ledger,
+)
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    """Create input files, one for each of three subjobs."""
+    paths = []
+    for idx in range(3):
+        path = tmp_path / f"in{idx}.txt"
+        path.write_text(f"line {idx}\n")
+        paths.append(str(path))
+    return paths
+
+
+def read(path):
+    """Return contents of text file."""
+    with open(path, encoding="utf-8") as in_file:
+        return in_file.read()
+
+
+def test_fold_once(tmp_path, inputs):
+    """Inputs are merged once, in order of folding."""
+    out_path = str(tmp_path / "out.txt")
+    merger = IncrementalMerger()
+    merger.fold(inputs[1:2], out_path)
+    merger.fold(inputs, out_path)
+    merger.fold(inputs, out_path)
+    assert read(out_path) == "line 1\nline 0\nline 2\n"
+    ledger = read_ledger(out_path)
+    assert ledger["paths"] == [inputs[1], inputs[0], inputs[2]]
+    assert set(ledger["versions"]) == set(inputs)
+    assert ledger["size"] == os.path.getsize(out_path)
+
+
+def test_fold_interrupted(tmp_path, inputs):
+    """Data from an interrupted merge is truncated."""
+    out_path = str(tmp_path / "out.txt")
+    merger = IncrementalMerger()
+    merger.fold(inputs[:1], out_path)
+    with open(out_path, "a", encoding="utf-8") as out_file:
+        out_file.write("partial")
+    merger.fold(inputs[1:2], out_path)
+    assert read(out_path) == "line 0\nline 1\n"
+
+
+def test_rebuild_changed_input(tmp_path, inputs):
+    """Merged file is rebuilt when a merged input has changed."""
+    out_path = str(tmp_path / "out.txt")
+    merger = IncrementalMerger()
+    merger.fold(inputs[:2], out_path)
+    with open(inputs[0], "w", encoding="utf-8") as out_file:
+        out_file.write("line 0, resubmitted\n")
+    merger.fold(inputs[2:], out_path)
+    assert read(out_path) == "line 0, resubmitted\nline 1\nline 2\n"
+    merger.fold(inputs, out_path)
+    assert read(out_path) == "line 0, resubmitted\nline 1\nline 2\n"
+
+
+def test_rebuild_no_duplicates(tmp_path, inputs):
+    """Rebuilding doesn't append to existing merged data."""
+    out_path = str(tmp_path / "out.txt")
+    merger = IncrementalMerger()
+    merger.fold(inputs[:2], out_path)
+    os.truncate(out_path, 3)
+    merger.fold(inputs[2:], out_path)
+    assert read(out_path) == "line 0\nline 1\nline 2\n"
+
+
+def test_discard(tmp_path, inputs):
+    """Discarded merged file is merged afresh."""
+    out_path = str(tmp_path / "out.txt")
+    merger = IncrementalMerger()
+    merger.fold(inputs, out_path)
+    merger.discard(out_path)
+    assert not os.path.exists(out_path)
+    assert read_ledger(out_path)["paths"] == []
+    merger.fold(inputs[2:], out_path)
+    assert read(out_path) == "line 2\n"
+
+
+def test_merge_tree(tmp_path, inputs):
+    """Hierarchical merging preserves order, and removes intermediates."""
+    out_path = str(tmp_path / "out.txt")
+    merger = IncrementalMerger()
+    merger.fan_in = 2
+    assert merger.use_tree(inputs)
+    assert not merger.use_tree(inputs[:2])
+    merger.merge_tree(inputs, out_path)
+    assert read(out_path) == "line 0\nline 1\nline 2\n"
+    assert not os.path.exists(tmp_path / ".out.txt.tree")
@@ -0,0 +1,144 @@
+# File: tests/test_json_merger.py
+"""
+Tests for merging of files of data in JSON format.
+"""
+
+import json
+import sys
+
+import pytest
+
+pytest.importorskip("GangaCore")
+
+from GangaSkrt.Lib.JsonMerger.JsonMerger import JsonMerger  # noqa: E402
+
+DATA = [
+    {"id": "p1", "name": "Zoë", "dice": 0.95, "tolerance": 1e-7},
+    {"id": "p2", "name": "Łukasz ✓", "dice": 1e22, "nested": {"b": 1}},
+]
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    """Create input files, one for each record."""
+    paths = []
+    for idx, record in enumerate(DATA):
+        path = tmp_path / f"in{idx}.json"
+        path.write_text(json.dumps(record), encoding="utf-8")
+        paths.append(str(path))
+    return paths
+
+
+def merge(in_paths, out_path, **kwargs):
+    """Merge inputs, returning bytes of merged file."""
+    merger = JsonMerger()
+    for name, value in kwargs.items():
+        setattr(merger, name, value)
+    merger.mergefiles(in_paths, out_path)
+    with open(out_path, "rb") as in_file:
+        return in_file.read()
+
+
+@pytest.mark.parametrize("jsonl", [False, True])
+def test_merge(tmp_path, inputs, jsonl):
+    """Records are merged in input order."""
+    data = merge(inputs, str(tmp_path / "out.json"), jsonl=jsonl)
+    if jsonl:
+        records = [json.loads(line) for line in data.decode().splitlines()]
+    else:
+        records = json.loads(data)
+    assert records == DATA
+
+
+def test_auto_engine(tmp_path, inputs, monkeypatch):
+    """JSON Lines output doesn't depend on whether orjson is installed."""
+    with_orjson = merge(
+        inputs, str(tmp_path / "out1.jsonl"), jsonl=True, engine="auto"
+    )
+    monkeypatch.setitem(sys.modules, "orjson", None)
+    without_orjson = merge(
+        inputs, str(tmp_path / "out2.jsonl"), jsonl=True, engine="auto"
+    )
+    assert with_orjson == without_orjson
+    assert "Zoë".encode() in without_orjson
+
+
+def test_orjson_engine(tmp_path, inputs):
+    """Output of orjson engine is semantically identical."""
+    pytest.importorskip("orjson")
+    json_data = merge(
+        inputs, str(tmp_path / "out1.jsonl"), jsonl=True, engine="json"
+    )
+    orjson_data = merge(
+        inputs, str(tmp_path / "out2.jsonl"), jsonl=True, engine="orjson"
+    )
+    assert [json.loads(line) for line in json_data.splitlines()] == [
+        json.loads(line) for line in orjson_data.splitlines()
+    ]
+
+
+@pytest.mark.parametrize("jsonl", [False, True])
+@pytest.mark.parametrize(
+    "kwargs", [{"workers": 2}, {"fan_in": 1}, {"fan_in": 2, "workers": 2}]
+)
+def test_merge_same_output(tmp_path, inputs, jsonl, kwargs):
+    """Output doesn't depend on workers or hierarchical merging."""
+    inputs = inputs * 3
+    serial = merge(inputs, str(tmp_path / "out1.json"), jsonl=jsonl)
+    other = merge(inputs, str(tmp_path / "out2.json"), jsonl=jsonl, **kwargs)
+    assert serial == other
+
+
+@pytest.mark.parametrize("jsonl", [False, True])
+def test_merge_format(tmp_path, inputs, jsonl):
+    """List output is formatted as by a single call to json.dump()."""
+    data = merge(inputs, str(tmp_path / "out.json"), jsonl=jsonl)
+    if jsonl:
+        expected = "".join(
+            json.dumps(
+                record,
+                separators=(",", ":"),
+                sort_keys=True,
+                ensure_ascii=False,
+            )
+            + "\n"
+            for record in DATA
+        )
+        assert data.decode() == expected
+    else:
+        expected = json.dumps(
+            DATA, indent=1, separators=(",", ":"), sort_keys=True
+        )
+        assert data.decode() == expected
+
+
+@pytest.mark.parametrize("jsonl", [False, True])
+def test_select(tmp_path, inputs, jsonl):
+    """Fields and records are selected as inputs are read."""
+    data = merge(
+        inputs,
+        str(tmp_path / "out.json"),
+        jsonl=jsonl,
+        columns=["id", "nested.b"],
+        where="dice > 1",
+    )
+    if jsonl:
+        records = [json.loads(line) for line in data.decode().splitlines()]
+    else:
+        records = json.loads(data)
+    assert records == [{"id": "p2", "nested": {"b": 1}}]
+
+
+@pytest.mark.parametrize("jsonl", [False, True])
+def test_incremental(tmp_path, inputs, jsonl):
+    """Records folded one at a time match those merged together."""
+    expected = merge(inputs, str(tmp_path / "out1.json"), jsonl=jsonl)
+    out_path = str(tmp_path / "out2.json")
+    merger = JsonMerger()
+    merger.jsonl = jsonl
+    merger.where = "id != 'none'"
+    for in_path in inputs:
+        merger.fold([in_path], out_path)
+    merger.finalise(out_path)
+    with open(out_path, "rb") as in_file:
+        assert in_file.read() == expected
@@ -0,0 +1,90 @@
+# File: tests/test_merge_filter.py
+"""
+Tests for selection of fields and rows for mergers.
+"""
+
+import pytest
+
+from GangaSkrt.Lib.MergeFilter.MergeFilter import (
+    Predicate,
+    get_predicate,
+    select_fields,
+)
+
+
+@pytest.mark.parametrize(
+    "where, record, expected",
+    [
+        ("dice < 0.999", {"dice": 0.5}, True),
+        ("dice < 0.999", {"dice": "0.9995"}, False),
+        ("dice < 0.999", {}, False),
+        ("dice < 0.999", {"dice": "n/a"}, False),
+        ("0 < volume <= 10", {"volume": "10"}, True),
+        ("0 < volume <= 10", {"volume": 0}, False),
+        ("not (0 < volume <= 10)", {"volume": 11}, True),
+        ("roi in ['parotid_left', 'parotid_right']", {"roi": "cord"}, False),
+        ("roi not in ('cord',)", {"roi": "parotid_left"}, True),
+        ("dose > -1 and status == 'ok'", {"dose": 0, "status": "ok"}, True),
+        ("dose > 5 or status == 'ok'", {"dose": 0, "status": "bad"}, False),
+        ("flags.valid == True", {"flags": {"valid": True}}, True),
+        ("flags.valid == True", {"flags.valid": True}, True),
+        ("flags.valid == True", {"flags": None}, False),
+        ("label == None", {"label": None}, False),
+    ],
+)
+def test_predicate(where, record, expected):
+    """Predicates are evaluated for records."""
+    assert Predicate(where)(record) is expected
+
+
+@pytest.mark.parametrize(
+    "where",
+    [
+        "dice <",
+        "__import__('os').system('true')",
+        "dice + 1 < 2",
+        "roi in rois",
+        "dice is None",
+        "dice",
+    ],
+)
+def test_invalid_predicate(where):
+    """Invalid or unsupported expressions are rejected."""
+    with pytest.raises(ValueError):
+        Predicate(where)
+
+
+def test_fields():
+    """Fields referenced are recorded in order of first reference."""
+    predicate = Predicate("b < 1 and (a == 2 or b > c.d)")
+    assert predicate.fields == ["b", "a", "c.d"]
+
+
+def test_get_predicate():
+    """Predicates are cached, and empty expressions give None."""
+    assert get_predicate("") is None
+    assert get_predicate("  ") is None
+    assert get_predicate("a < 1") is get_predicate("a < 1")
+
+
+def test_select_fields():
+    """Selected fields are kept, with nesting for dotted names."""
+    record = {"id": 1, "dose": {"mean": 2.0, "max": 3.0}, "x.y": 4}
+    assert select_fields(record, ["dose.mean", "id", "x.y", "z"]) == {
+        "dose": {"mean": 2.0},
+        "id": 1,
+        "x.y": 4,
+    }
+    assert select_fields(record, []) is record
+    assert select_fields([1, 2], ["id"]) == [1, 2]
+
+
+def test_to_expression():
+    """Predicates are converted to equivalent pyarrow expressions."""
+    pa = pytest.importorskip("pyarrow")
+    table = pa.table(
+        {"dice": [0.5, 1.0, None, 0.9], "roi": ["a", "b", "a", None]}
+    )
+    predicate = Predicate("dice < 0.999 and roi not in ['b']")
+    selected = table.filter(predicate.to_expression())
+    assert selected.column("dice").to_pylist() == [0.5]
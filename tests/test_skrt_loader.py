@@ -0,0 +1,102 @@
+# File: tests/test_skrt_loader.py
+"""
+Tests for worker-side loaders of patient datasets.
+"""
+
+import inspect
+
+import pytest
+
+from GangaSkrt.Lib.SkrtLoader.SkrtLoader import IndexedPatient, parse_size
+
+
+def dcmread(
+    fp,
+    defer_size=None,
+    stop_before_pixels=False,
+    force=False,
+    specific_tags=None,
+):
+    """Stand-in with the signature of pydicom.dcmread()."""
+
+
+SIGNATURE = inspect.signature(dcmread)
+
+
+@pytest.fixture
+def restricted_index(monkeypatch):
+    """Simulate index restricted to selected tags."""
+    monkeypatch.setattr(IndexedPatient, "tags", ["Modality", "PatientID"])
+
+
+@pytest.fixture
+def full_index(monkeypatch):
+    """Simulate index of all tags."""
+    monkeypatch.setattr(IndexedPatient, "tags", [])
+
+
+def test_parse_size():
+    """Sizes are parsed with and without unit suffixes."""
+    assert parse_size(0) == 0
+    assert parse_size("512") == 512
+    assert parse_size("4K") == 4096
+    assert parse_size("1.5MB") == int(1.5 * 1024**2)
+    assert parse_size("2g") == 2 * 1024**3
+
+
+@pytest.mark.parametrize(
+    "args, kwargs",
+    [
+        ((), {}),
+        ((), {"stop_before_pixels": False}),
+        ((None, False), {}),
+    ],
+)
+def test_pixels_requested(full_index, args, kwargs):
+    """Calls needing pixel data aren't served from the index."""
+    assert not IndexedPatient.is_indexed(SIGNATURE, "f.dcm", *args, **kwargs)
+
+
+def test_full_index_headers(full_index):
+    """An index of all tags serves any header-only call."""
+    assert IndexedPatient.is_indexed(
+        SIGNATURE, "f.dcm", stop_before_pixels=True
+    )
+    assert IndexedPatient.is_indexed(SIGNATURE, "f.dcm", None, True)
+
+
+def test_restricted_index_full_header(restricted_index):
+    """A restricted index doesn't serve requests for the full header."""
+    assert not IndexedPatient.is_indexed(
+        SIGNATURE, "f.dcm", stop_before_pixels=True
+    )
+    assert not IndexedPatient.is_indexed(
+        SIGNATURE, "f.dcm", stop_before_pixels=True, specific_tags=[]
+    )
+
+
+def test_restricted_index_tags(restricted_index):
+    """A restricted index serves only requests for indexed tags."""
+    pytest.importorskip("pydicom")
+    assert IndexedPatient.is_indexed(
+        SIGNATURE, "f.dcm", stop_before_pixels=True, specific_tags=["Modality"]
+    )
+    assert IndexedPatient.is_indexed(
+        SIGNATURE,
+        "f.dcm",
+        stop_before_pixels=True,
+        specific_tags=[(0x0008, 0x0060), "PatientID"],
+    )
+    assert not IndexedPatient.is_indexed(
+        SIGNATURE,
+        "f.dcm",
+        stop_before_pixels=True,
+        specific_tags=["Modality", "PatientName"],
+    )
+
+
+def test_invalid_call(full_index):
+    """Calls not matching the signature aren't served from the index."""
+    assert not IndexedPatient.is_indexed(
+        SIGNATURE, "f.dcm", stop_before_pixels=True, unknown=1
+    )
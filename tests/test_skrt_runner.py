@@ -0,0 +1,320 @@
+# File: tests/test_skrt_runner.py
+"""
+Tests for worker-side running of scikit-rt applications.
+"""
+
+import json
+import os
+import pickle
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+
+from GangaSkrt.Lib.SkrtRunner.SkrtRunner import (
+    SkrtRunner,
+    encode_option_changes,
+    encode_options,
+    get_alg_deps,
+    get_critical_path,
+    get_digests,
+    load_options,
+    load_runner_options,
+    tag,
+    untag,
+)
+
+
+class Status:
+    """Minimal stand-in for skrt.application.Status."""
+
+    def __init__(self, code=0, name="ok", reason=""):
+        self.code = code
+        self.name = name
+        self.reason = reason
+
+    def is_ok(self):
+        return 0 == self.code
+
+
+class Patient:
+    """Minimal stand-in for skrt.patient.Patient."""
+
+    def __init__(self, path="", **kwargs):
+        self.path = path
+        self.id = os.path.basename(path)
+
+
+class SleepAlg:
+    """Algorithm recording patients processed, after optional sleep."""
+
+    def __init__(self, name="", sleep=0):
+        self.name = name
+        self.sleep = sleep
+        self.status = Status()
+        self.records = []
+        self.table = list(range(1000))
+
+    def initialise(self):
+        return self.status
+
+    def execute(self, patient=None):
+        time.sleep(self.sleep)
+        self.records.append(patient.id)
+        return self.status
+
+    def finalise(self):
+        return self.status
+
+
+class WriteAlg(SleepAlg):
+    """Algorithm writing files, before sleeping for selected patients."""
+
+    # Patients for which to sleep, as class attribute, unaffected
+    # by restoring algorithm state from checkpoint.
+    slow = []
+
+    def __init__(self, name=""):
+        super().__init__(name, sleep=30)
+
+    def execute(self, patient=None):
+        with open(f"{patient.id}.txt", "w", encoding="utf-8") as out_file:
+            out_file.write(patient.id)
+        with open("log.txt", "a", encoding="utf-8") as out_file:
+            out_file.write(f"{patient.id}\n")
+        if patient.id in self.slow:
+            time.sleep(self.sleep)
+        self.records.append(patient.id)
+        return self.status
+
+
+class App:
+    """Minimal stand-in for skrt.application.Application."""
+
+    def __init__(self, algs=None):
+        self.algs = algs or []
+        self.status = Status()
+
+
+def assert_no_children():
+    """Check that no child process is left running or unreaped."""
+    with pytest.raises(ChildProcessError):
+        os.waitpid(-1, os.WNOHANG)
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        None,
+        [1, 2.5, "a", True],
+        (1, (2, 3)),
+        {"b", "a"},
+        {"a": {"b": [1]}},
+        {1: "one", (2, 3): "two-three"},
+        {"__skrt_type__": "tuple", "items": []},
+    ],
+)
+def test_tag_untag(value):
+    """Values are restored faithfully after encoding as JSON."""
+    text = json.dumps(tag(value))
+    assert json.loads(text, object_hook=untag) == value
+
+
+def test_tag_conversions():
+    """Paths and NumPy values are converted to JSON-native types."""
+    assert tag(Path("/data/p1")) == "/data/p1"
+    assert tag([{"x"}]) == [{"__skrt_type__": "set", "items": ["x"]}]
+    with pytest.raises(TypeError, match="can't be passed"):
+        tag(object())
+    np = pytest.importorskip("numpy")
+    assert tag(np.float32(0.5)) == 0.5
+    assert tag(np.arange(4).reshape(2, 2)) == [[0, 1], [2, 3]]
+
+
+def test_load_options(tmp_path):
+    """Subjob options are applied as changes to master options."""
+    master_alg_opts = [{"a": 1, "b": (1, 2), "c": "x"}, {}]
+    alg_opts = [{"a": 1, "b": (3, 4)}, {"images": {"p1", "p2"}}]
+    options_file = tmp_path / "opts.json"
+    subjob_options_file = tmp_path / "subjob_opts.json"
+    options_file.write_text(
+        encode_options(
+            master_alg_opts, {"unsorted_dicom": True}, {"parallel": ""}
+        )
+    )
+    subjob_options_file.write_text(
+        encode_option_changes(
+            master_alg_opts, alg_opts, {"patient_timeout": 60}
+        )
+    )
+    assert load_options(options_file, subjob_options_file) == (
+        alg_opts,
+        {"unsorted_dicom": True},
+    )
+    assert load_runner_options(options_file, subjob_options_file) == {
+        "parallel": "",
+        "patient_timeout": 60,
+    }
+
+    subjob_options_file.write_text(encode_options(alg_opts, "{'a': 1}"))
+    assert load_options(options_file, subjob_options_file) == (
+        alg_opts,
+        {"a": 1},
+    )
+
+
+def test_get_alg_deps():
+    """Dependencies are converted to indices, and are checked."""
+    names = ["a", "b", "c"]
+    assert get_alg_deps(names) == [[], [], []]
+    assert get_alg_deps(names, {"c": ["b", "a"]}) == [[], [], [0, 1]]
+    with pytest.raises(ValueError, match="Unknown"):
+        get_alg_deps(names, {"c": ["d"]})
+    with pytest.raises(ValueError, match="Circular"):
+        get_alg_deps(names, {"a": ["b"], "b": ["a"]})
+    with pytest.raises(ValueError, match="unique"):
+        get_alg_deps(["a", "a"], {"a": []})
+
+
+def test_get_critical_path():
+    """Critical path is the chain with longest total duration."""
+    alg_deps = [[], [], [0, 1], [2]]
+    durations = {0: 1.0, 1: 3.0, 2: 2.0, 3: 0.5}
+    assert get_critical_path(alg_deps, durations) == ([1, 2, 3], 5.5)
+    assert get_critical_path(alg_deps, {0: 1.0, 2: 2.0}) == ([0, 2], 3.0)
+    assert get_critical_path() == ([], 0)
+
+
+def test_get_digests():
+    """Digests change with values, and are None if unserialisable."""
+    before = get_digests({"a": [1, 2], "b": "x", "c": lambda: None})
+    after = get_digests({"a": [1, 2, 3], "b": "x"})
+    assert before["a"] != after["a"]
+    assert before["b"] == after["b"]
+    assert before["c"] is None
+
+
+def test_threads_with_timeouts():
+    """Algorithms are run in processes if time limits are defined."""
+    app = App([SleepAlg("a")])
+    runner = SkrtRunner(app, patient_timeout=10, parallel="threads")
+    assert "processes" == runner.parallel
+
+
+@pytest.mark.parametrize(
+    "patient_timeout, alg_timeouts, limit",
+    [(0, [0, 0.5], "slow"), (0.5, [0, 0], "patient")],
+)
+def test_parallel_timeout(
+    tmp_path, monkeypatch, patient_timeout, alg_timeouts, limit
+):
+    """Time limits kill child processes, and patient is skipped."""
+    monkeypatch.chdir(tmp_path)
+    app = App([SleepAlg("fast"), SleepAlg("slow", sleep=30)])
+    runner = SkrtRunner(
+        app,
+        patient_timeout=patient_timeout,
+        alg_timeouts=alg_timeouts,
+        parallel="processes",
+    )
+    start = time.monotonic()
+    runner.run_here(["p1"], Patient)
+    assert time.monotonic() - start < 10
+    assert [skipped["limit"] for skipped in runner.skipped] == [limit]
+    assert [alg.records for alg in app.algs] == [[], []]
+    assert_no_children()
+
+
+def test_parallel_changed_state(tmp_path, monkeypatch):
+    """Only changed attributes are sent back from child process."""
+    monkeypatch.chdir(tmp_path)
+    alg = SleepAlg("a")
+    runner = SkrtRunner(App([alg]), parallel="processes")
+    pid, read_fd = runner.fork_alg(0, Patient("p1"))
+    with os.fdopen(read_fd, "rb") as in_file:
+        status, state, removed, error = pickle.loads(in_file.read())
+    os.waitpid(pid, 0)
+    assert error is None
+    assert status.is_ok()
+    assert state == {"records": ["p1"]}
+    assert removed == []
+
+    runner.run_here(["p2", "p3"], Patient)
+    assert alg.records == ["p2", "p3"]
+    assert_no_children()
+
+
+@pytest.mark.parametrize("parallel", ["", "processes"])
+@pytest.mark.parametrize("checkpoint", [False, True])
+def test_timeout_outputs(tmp_path, monkeypatch, parallel, checkpoint):
+    """Outputs written for patient skipped on timeout are reverted."""
+    work_dir = tmp_path / "work"
+    work_dir.mkdir()
+    monkeypatch.chdir(work_dir)
+    tmp_dir = tmp_path / "tmp"
+    tmp_dir.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_dir))
+    monkeypatch.setattr(WriteAlg, "slow", ["p2"])
+    alg = WriteAlg("write")
+    runner = SkrtRunner(
+        App([alg]),
+        checkpoint_dir=str(tmp_path / "checkpoint") if checkpoint else "",
+        alg_timeouts=[0.5],
+        parallel=parallel,
+    )
+    runner.run_here(["p1", "p2", "p3"], Patient)
+    assert [skipped["path"] for skipped in runner.skipped] == ["p2"]
+    assert alg.records == ["p1", "p3"]
+    assert not (work_dir / "p2.txt").exists()
+    assert (work_dir / "log.txt").read_text() == "p1\np3\n"
+    assert not os.listdir(tmp_dir)
+
+
+def test_timeout_not_done(tmp_path, monkeypatch):
+    """Patient skipped on timeout isn't checkpointed as done."""
+    work_dir = tmp_path / "work"
+    work_dir.mkdir()
+    monkeypatch.chdir(work_dir)
+    checkpoint_dir = str(tmp_path / "checkpoint")
+    monkeypatch.setattr(WriteAlg, "slow", ["p2"])
+    alg = WriteAlg("write")
+    runner = SkrtRunner(
+        App([alg]), checkpoint_dir=checkpoint_dir, alg_timeouts=[0.5]
+    )
+    runner.run_here(["p1", "p2"], Patient)
+    assert runner.done == ["p1"]
+
+    monkeypatch.setattr(WriteAlg, "slow", [])
+    alg = WriteAlg("write")
+    runner = SkrtRunner(
+        App([alg]), checkpoint_dir=checkpoint_dir, alg_timeouts=[0.5]
+    )
+    runner.run_here(["p1", "p2"], Patient)
+    assert runner.done == ["p1", "p2"]
+    assert not runner.skipped
+    assert alg.records == ["p1", "p2"]
+    assert (work_dir / "log.txt").read_text() == "p1\np2\n"
+
+
+def test_output_dirs(tmp_path, monkeypatch):
+    """Only files in algorithms' output directories are outputs."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "input.txt").write_text("input")
+    algs = [SleepAlg("a"), SleepAlg("b"), SleepAlg("c")]
+    runner = SkrtRunner(
+        App(algs),
+        checkpoint_dir=str(tmp_path / "checkpoint"),
+        alg_dirs=["a", "a/b", "c"],
+    )
+    assert runner.get_output_dirs() == [
+        str(tmp_path / "a"),
+        str(tmp_path / "c"),
+    ]
+    for path in ["other.txt", "a/b/1.txt", "c/2.txt"]:
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text(path)
+    assert sorted(runner.get_outputs()) == ["a/b/1.txt", "c/2.txt"]
+
+    runner = SkrtRunner(App(algs), alg_dirs=["a", "", "c"])
+    assert runner.get_output_dirs() == [str(tmp_path)]